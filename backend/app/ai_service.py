@@ -1,9 +1,10 @@
 # app/ai_service.py
 
-import os
-from openai import OpenAI
+from .llm_router import llm_router
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Provider choice, failover, rate limits, retries and circuit breakers are
+# handled by the router and its governors (it prefers whichever provider is
+# fastest, not necessarily OpenAI).
 
 
 def summarize_text(text: str) -> str:
@@ -16,15 +17,10 @@ def summarize_text(text: str) -> str:
         f"{text[:4000]}"
     )
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=120,
-        )
-        return resp.choices[0].message.content.strip()
+        return llm_router.complete("", prompt, max_tokens=120).text
     except Exception as e:
-        # 👇 This is where your 429 is happening.
+        # 429s are retried (honouring Retry-After) before we get here;
+        # LLMUnavailable means the limiter or circuit breaker refused the call.
         print("ERROR in summarize_text:", e)
         # Fallback: at least give the user a preview instead of nothing
         preview = (text or "").strip()
@@ -47,10 +43,4 @@ def generate_reply_for_email(email_body: str, sender: str, subject: str) -> str:
         f"From: {sender}\n\n"
         f"Original email:\n{email_body[:4000]}"
     )
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.4,
-        max_tokens=300,
-    )
-    return resp.choices[0].message.content.strip()
+    return llm_router.complete("", prompt, max_tokens=300).text
@@ -1,13 +1,38 @@
 # app/auth_utils.py
+import threading
+from datetime import datetime, timedelta
 from typing import Optional
 
+from anyio import to_thread
+from cachetools import TTLCache
 from fastapi import Request
 from jose import jwt as jose_jwt
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleRequest
 
-from .config import JWT_SECRET, JWT_ALG
-from .db import get_token
+from .config import (
+    JWT_SECRET,
+    JWT_ALG,
+    CREDENTIALS_CACHE_SIZE,
+    CREDENTIALS_CACHE_TTL_SECONDS,
+    CREDENTIALS_REFRESH_MARGIN_SECONDS,
+    CREDENTIALS_REFRESH_INTERVAL_SECONDS,
+)
+from .db import get_token, get_token_async, save_token
+from .metrics import set_user, span
+
+# Credentials per user email, so a request doesn't hit Postgres (or Google's
+# token endpoint) when the access token is still good. The TTL bounds how
+# long a token changed elsewhere (e.g. a new login) can go unnoticed.
+_creds_lock = threading.Lock()
+_creds_cache: "TTLCache[str, Credentials]" = TTLCache(
+    maxsize=max(1, CREDENTIALS_CACHE_SIZE), ttl=CREDENTIALS_CACHE_TTL_SECONDS
+)
+# Refresh locks, striped by email so concurrent requests for a user share a
+# single refresh. A fixed pool: one lock per user ever seen would grow
+# forever, and two users sharing a stripe only wait on each other's refresh.
+_REFRESH_LOCK_STRIPES = 64
+_refresh_locks = [threading.Lock() for _ in range(_REFRESH_LOCK_STRIPES)]
 
 
 def get_session_token(request: Request) -> Optional[str]:
@@ -27,46 +52,221 @@ def get_session_token(request: Request) -> Optional[str]:
     return None
 
 
-def refresh_credentials_if_needed(session_token: Optional[str]) -> Optional[Credentials]:
+def get_session_email(session_token: Optional[str]) -> Optional[str]:
     """
-    Decode the session JWT, look up Gmail tokens in DB, and
-    return google.oauth2.credentials.Credentials, or None on failure.
+    Decode the session JWT and return the user's email, or None if the
+    token is missing or invalid.
     """
     if not session_token:
-        print("refresh_credentials_if_needed: no session token")
+        print("get_session_email: no session token")
         return None
 
     try:
-        payload = jose_jwt.decode(session_token, JWT_SECRET, algorithms=[JWT_ALG])
+        with span("jwt_decode"):
+            payload = jose_jwt.decode(session_token, JWT_SECRET, algorithms=[JWT_ALG])
     except Exception as e:
-        print("refresh_credentials_if_needed decode error:", e)
+        print("get_session_email decode error:", e)
         return None
 
     email = payload.get("email") or payload.get("sub")
     if not email:
-        print("refresh_credentials_if_needed: no email in payload")
+        print("get_session_email: no email in payload")
         return None
+    set_user(email)
+    return email
 
-    token_entry = get_token(email)
-    if not token_entry:
-        print("refresh_credentials_if_needed: no token in DB for", email)
-        return None
 
-    creds = Credentials(
+def token_entry_from_credentials(creds: Credentials) -> dict:
+    """Serialize credentials into the dict stored by db.save_token."""
+    return {
+        "token": creds.token,
+        "refresh_token": creds.refresh_token,
+        "token_uri": creds.token_uri,
+        "client_id": creds.client_id,
+        "client_secret": creds.client_secret,
+        "scopes": list(creds.scopes or []),
+        "expiry": creds.expiry.isoformat() if creds.expiry else None,
+    }
+
+
+def _credentials_from_entry(token_entry: dict) -> Credentials:
+    expiry = token_entry.get("expiry")
+    return Credentials(
         token=token_entry["token"],
         refresh_token=token_entry["refresh_token"],
         token_uri=token_entry["token_uri"],
         client_id=token_entry["client_id"],
         client_secret=token_entry["client_secret"],
         scopes=token_entry["scopes"],
+        # google-auth compares against naive UTC datetimes
+        expiry=datetime.fromisoformat(expiry) if expiry else None,
     )
 
-    # Optional: refresh if expired
-    if not creds.valid and creds.refresh_token:
+
+def _refresh_lock(email: str) -> threading.Lock:
+    return _refresh_locks[hash(email) % _REFRESH_LOCK_STRIPES]
+
+
+def _expires_within(creds: Credentials, seconds: float) -> bool:
+    if not creds.expiry:
+        return False
+    return creds.expiry - datetime.utcnow() < timedelta(seconds=seconds)
+
+
+def _refresh(email: str, creds: Credentials, margin: float = 0) -> bool:
+    """
+    Refresh `creds` in place unless another thread already did, then write
+    the new token back to the DB. Returns False if the refresh failed.
+    """
+    with _refresh_lock(email):
+        # Whoever held the lock before us may have refreshed already.
+        if creds.valid and not _expires_within(creds, margin):
+            return True
+        try:
+            with span("token_refresh"):
+                creds.refresh(GoogleRequest())
+        except Exception as e:
+            print("refresh credentials failed for", email, e)
+            return False
         try:
-            creds.refresh(GoogleRequest())
+            save_token(email, token_entry_from_credentials(creds))
         except Exception as e:
-            print("refresh_credentials_if_needed: refresh failed", e)
+            # Still usable for this process; the next refresh retries the save.
+            print("refresh credentials: failed to save refreshed token for", email, e)
+        return True
+
+
+def forget_credentials(email: str):
+    """Drop cached credentials, e.g. after a new login stored fresh tokens."""
+    with _creds_lock:
+        _creds_cache.pop(email, None)
+
+
+def get_credentials_for_email(email: str) -> Optional[Credentials]:
+    """
+    Return valid credentials for `email` from the cache or the DB,
+    refreshing them (once, shared by concurrent callers) if expired.
+    """
+    with _creds_lock:
+        creds = _creds_cache.get(email)
+
+    if creds is None:
+        with _refresh_lock(email):
+            # Another request may have loaded them while we waited.
+            with _creds_lock:
+                creds = _creds_cache.get(email)
+            if creds is None:
+                with span("get_token"):
+                    token_entry = get_token(email)
+                if not token_entry:
+                    print("get_credentials_for_email: no token in DB for", email)
+                    return None
+                creds = _credentials_from_entry(token_entry)
+                with _creds_lock:
+                    _creds_cache[email] = creds
+
+    if not creds.valid and creds.refresh_token:
+        if not _refresh(email, creds):
+            forget_credentials(email)
             return None
 
     return creds
+
+
+def refresh_credentials_if_needed(session_token: Optional[str]) -> Optional[Credentials]:
+    """
+    Decode the session JWT, look up Gmail tokens (cache, then DB), and
+    return google.oauth2.credentials.Credentials, or None on failure.
+    """
+    email = get_session_email(session_token)
+    if not email:
+        return None
+    return get_credentials_for_email(email)
+
+
+async def get_credentials_for_email_async(email: str) -> Optional[Credentials]:
+    """
+    Async get_credentials_for_email. Cache hits never leave the event loop;
+    the DB lookup is async, and the (rare) refresh runs in a worker thread so
+    it shares the per-user single-flight lock with the sync path.
+    """
+    with _creds_lock:
+        creds = _creds_cache.get(email)
+
+    if creds is None:
+        with span("get_token"):
+            token_entry = await get_token_async(email)
+        if not token_entry:
+            print("get_credentials_for_email_async: no token in DB for", email)
+            return None
+        loaded = _credentials_from_entry(token_entry)
+        with _creds_lock:
+            # Keep whichever object got cached first so refreshes are shared.
+            creds = _creds_cache.get(email)
+            if creds is None:
+                creds = _creds_cache[email] = loaded
+
+    if not creds.valid and creds.refresh_token:
+        if not await to_thread.run_sync(_refresh, email, creds):
+            forget_credentials(email)
+            return None
+
+    return creds
+
+
+async def refresh_credentials_if_needed_async(session_token: Optional[str]) -> Optional[Credentials]:
+    """Async refresh_credentials_if_needed."""
+    email = get_session_email(session_token)
+    if not email:
+        return None
+    return await get_credentials_for_email_async(email)
+
+
+def refresh_expiring_credentials(margin: float = CREDENTIALS_REFRESH_MARGIN_SECONDS) -> int:
+    """
+    Refresh every cached credential that expires within `margin` seconds.
+    Returns how many were refreshed.
+    """
+    with _creds_lock:
+        entries = list(_creds_cache.items())
+
+    refreshed = 0
+    for email, creds in entries:
+        if creds.refresh_token and _expires_within(creds, margin):
+            if _refresh(email, creds, margin):
+                refreshed += 1
+            else:
+                forget_credentials(email)
+    return refreshed
+
+
+class CredentialRefresher:
+    """
+    Background thread that refreshes cached tokens shortly before they
+    expire, so the request path almost never waits on Google.
+    """
+
+    def __init__(self, interval: float = CREDENTIALS_REFRESH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="credential-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                refresh_expiring_credentials()
+            except Exception as e:
+                print("CredentialRefresher error:", e)
+
+
+credential_refresher = CredentialRefresher()
@@ -3,19 +3,79 @@
 Postgres-backed token store for AI Email Assistant.
 Uses SQLAlchemy core to create a simple tokens table:
   tokens(email text primary key, data text)
+a cache of AI summaries:
+  summaries(email, message_id, body_hash, model, prompt_version, summary, created_at)
+and content fingerprints of summarized bodies (summary_dedup.py):
+  summary_fingerprints(id, model, prompt_version, sender, email, exact_hash, simhash, digits_hash, summary, created_at)
+and the local mailbox copy kept by mail_sync.py:
+  messages(email, message_id, thread_id, label_ids, subject, from_line, snippet, body, internal_date)
+  sync_state(email, history_id, synced_at)
+  sync_retries(email, message_id, attempts)  (new messages a sync failed to fetch)
+  message_headers(email, message_id, headers)  (the few headers triage.py reads, as JSON)
+and rolling summaries of email threads for replies (thread_context.py):
+  thread_summaries(email, thread_id, model, prompt_version, summary, folded_until, message_count, updated_at)
+and the backlog of the summary prefetch worker (prefetch.py):
+  summary_jobs(email, message_id, enqueued_at, attempts, due_at)
+and the replies waiting to be sent by the outbox worker (outbox.py):
+  outbox(id, email, message_id, idempotency_key, body, status, attempts, due_at, created_at, updated_at,
+         sent_message_id, error)
+and a full-text index over stored messages and their latest summary:
+  message_search(id, email, message_id, internal_date[, document])
+  (Postgres: a weighted tsvector column with a GIN index; SQLite: an FTS5
+  table, message_search_fts, sharing its rowids)
 
 Functions:
 - init_db()
 - save_token(email, token_dict)
 - get_token(email) -> token_dict or None
+- get_summaries(email, message_ids, models, prompt_version) -> {(message_id, body_hash): summary}
+- save_summary(email, message_id, body_hash, model, prompt_version, summary)
+- delete_stale_summaries(models, prompt_version) -> rows deleted (fingerprints included)
+- find_summary_fingerprints(models, prompt_version, email, senders, exact_hashes, limit) -> candidate rows
+- save_summary_fingerprint(model, prompt_version, sender, email, exact_hash, simhash, digits_hash, summary)
+- get_thread_summary(email, thread_id) -> row or None
+- save_thread_summary(email, thread_id, model, prompt_version, summary, folded_until, message_count, models)
+- get_sync_state(email) / save_sync_state(email, history_id)
+- get_sync_retries(email) -> {message_id: attempts} / replace_sync_retries(email, {message_id: attempts})
+- upsert_messages(email, rows) / delete_messages(email, ids) / replace_messages(email, rows)
+- update_message_labels(email, {message_id: label_ids})
+- get_stored_message_ids(email, ids) -> set of ids already stored
+- list_messages(email, label, limit) -> newest first
+- get_messages(email, ids) -> {message_id: row}
+  (rows of both include the stored triage headers)
+- get_message_senders(email, ids) -> {message_id: from_line}
+- list_token_emails() -> every user with a stored token
+- enqueue_summary_jobs(email, ids) / claim_summary_jobs(email, limit, lease_seconds)
+- finish_summary_jobs(email, ids) / retry_summary_jobs(email, ids, delay, max_attempts)
+- due_summary_job_emails() / count_summary_jobs()
+- enqueue_outbox(email, message_id, idempotency_key, body) -> outbox id (the existing one for a repeated key)
+- claim_outbox(limit, lease_seconds) -> due rows, marked sending
+- finish_outbox(id, sent_message_id) / retry_outbox(id, delay, error) / fail_outbox(id, error)
+- get_outbox(email, id) -> row or None
+- count_outbox() -> {status: count} / delete_finished_outbox(older_than) -> rows deleted
+- search_messages(email, query, limit, offset, label) -> ranked rows
+- index_unindexed_messages() -> rows indexed (backfill)
+- get_token_async / save_token_async / get_messages_async: async versions
+  for the async request path (async engine, or a worker thread when the
+  URL's driver has no async variant)
 """
 
 import os
 import json
-from sqlalchemy import create_engine, Table, Column, String, Text, MetaData, select
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+import re
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import (
+    create_engine, Table, Column, String, Text, Float, BigInteger, Integer, MetaData, Index,
+    UniqueConstraint, select, delete, update, or_, and_, bindparam, func, literal_column, text, table, column,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
-from .config import DATABASE_URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from anyio import to_thread
+from .config import DATABASE_URL, SEARCH_TEXT_CONFIG
 
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set. Set it in .env or environment variables.")
@@ -24,6 +84,28 @@ if not DATABASE_URL:
 engine = create_engine(DATABASE_URL, future=True)
 meta = MetaData()
 
+def _async_database_url(url: str) -> str:
+    """Map DATABASE_URL onto the async driver for its database."""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def _make_async_engine():
+    try:
+        async_eng = create_async_engine(_async_database_url(DATABASE_URL))
+    except Exception as e:
+        # e.g. aiosqlite not installed: async helpers run the sync ones in a thread
+        print("Async DB engine unavailable, using worker threads:", e)
+        return None
+    if not async_eng.dialect.is_async:
+        return None
+    return async_eng
+
+async_engine: Optional[AsyncEngine] = _make_async_engine()
+
 tokens_table = Table(
     "tokens",
     meta,
@@ -31,9 +113,170 @@ tokens_table = Table(
     Column("data", Text, nullable=False),
 )
 
+summaries_table = Table(
+    "summaries",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("message_id", String, primary_key=True),
+    Column("body_hash", String, primary_key=True),
+    Column("model", String, primary_key=True),
+    Column("prompt_version", String, primary_key=True),
+    Column("summary", Text, nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+# One row per distinct summarized body (per sender, model and prompt
+# version); email is the user whose copy was summarized. simhash is the
+# body's 64-bit SimHash as a signed integer.
+summary_fingerprints_table = Table(
+    "summary_fingerprints",
+    meta,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("model", String, nullable=False),
+    Column("prompt_version", String, nullable=False),
+    Column("sender", String, nullable=False),
+    Column("email", String, nullable=False),
+    Column("exact_hash", String, nullable=False),
+    Column("simhash", BigInteger, nullable=False),
+    Column("digits_hash", String, nullable=False),
+    Column("summary", Text, nullable=False),
+    Column("created_at", Float, nullable=False),
+    UniqueConstraint("model", "prompt_version", "sender", "exact_hash", name="uq_summary_fingerprints_exact"),
+    Index("ix_summary_fingerprints_owner", "email", "sender", "created_at"),
+)
+
+# folded_until is the internalDate (ms) of the newest message the summary covers.
+thread_summaries_table = Table(
+    "thread_summaries",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("thread_id", String, primary_key=True),
+    Column("model", String, nullable=False),
+    Column("prompt_version", String, nullable=False),
+    Column("summary", Text, nullable=False),
+    Column("folded_until", BigInteger, nullable=False),
+    Column("message_count", Integer, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+
+# label_ids is stored space-delimited with surrounding spaces (" INBOX UNREAD ")
+# so "has label X" is a portable LIKE '% X %'.
+messages_table = Table(
+    "messages",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("message_id", String, primary_key=True),
+    Column("thread_id", String),
+    Column("label_ids", Text, nullable=False, default=" "),
+    Column("subject", Text),
+    Column("from_line", Text),
+    Column("snippet", Text),
+    Column("body", Text),
+    Column("internal_date", BigInteger),
+    Index("ix_messages_email_date", "email", "internal_date"),
+)
+
+# Kept beside messages rather than as a column of it: create_all() adds
+# tables, not columns, to an existing database.
+message_headers_table = Table(
+    "message_headers",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("message_id", String, primary_key=True),
+    Column("headers", Text, nullable=False),
+)
+
+sync_state_table = Table(
+    "sync_state",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("history_id", String, nullable=False),
+    Column("synced_at", Float, nullable=False),
+)
+
+# Messages a sync saw arrive but failed to fetch: the next sync tries them
+# again, since the historyId has moved past them.
+sync_retries_table = Table(
+    "sync_retries",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("message_id", String, primary_key=True),
+    Column("attempts", Integer, nullable=False),
+)
+
+# Messages waiting for a prefetched summary. A claimed job's due_at is pushed
+# past its lease, so a worker that dies leaves it to be picked up again.
+summary_jobs_table = Table(
+    "summary_jobs",
+    meta,
+    Column("email", String, primary_key=True),
+    Column("message_id", String, primary_key=True),
+    Column("enqueued_at", Float, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("due_at", Float, nullable=False),
+    Index("ix_summary_jobs_due", "due_at"),
+)
+
+# Replies waiting to be sent. status is queued, sending (claimed: due_at is
+# the end of the lease, after which another worker may take it over), sent or
+# failed. The idempotency key makes a repeated request return the same entry.
+outbox_table = Table(
+    "outbox",
+    meta,
+    Column("id", String, primary_key=True),
+    Column("email", String, nullable=False),
+    Column("message_id", String, nullable=False),
+    Column("idempotency_key", String, nullable=False),
+    Column("body", Text, nullable=False),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("due_at", Float, nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Column("sent_message_id", String),
+    Column("error", Text),
+    UniqueConstraint("email", "idempotency_key", name="uq_outbox_idempotency_key"),
+    Index("ix_outbox_due", "status", "due_at"),
+)
+
+# Full-text search. Postgres keeps a weighted tsvector per message (subject
+# A, sender and summary B, body C) under a GIN index; SQLite keeps the text
+# in an FTS5 table whose rowid is message_search.id. Other databases get no
+# search.
+_SEARCH_DIALECT = engine.dialect.name if engine.dialect.name in ("postgresql", "sqlite") else None
+if not re.fullmatch(r"[a-z_]+", SEARCH_TEXT_CONFIG):
+    raise RuntimeError(f"SEARCH_TEXT_CONFIG must be a text search configuration name, got {SEARCH_TEXT_CONFIG!r}")
+
+message_search_table = Table(
+    "message_search",
+    meta,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("email", String, nullable=False),
+    Column("message_id", String, nullable=False),
+    Column("internal_date", BigInteger),
+    *(
+        [Column("document", TSVECTOR), Index("ix_message_search_document", "document", postgresql_using="gin")]
+        if _SEARCH_DIALECT == "postgresql" else []
+    ),
+    UniqueConstraint("email", "message_id", name="uq_message_search_message"),
+)
+
+message_search_fts = table(
+    "message_search_fts", column("rowid"), column("subject"), column("from_line"), column("summary"), column("body"),
+)
+_SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_search_fts "
+    "USING fts5(subject, from_line, summary, body, tokenize='porter unicode61')"
+)
+# bm25 weights for the FTS5 columns above, in order
+_SQLITE_FTS_WEIGHTS = "10.0, 4.0, 4.0, 1.0"
+
 def init_db():
-    """Create tokens table if missing."""
+    """Create tables if missing."""
     meta.create_all(engine)
+    if _SEARCH_DIALECT == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text(_SQLITE_FTS_DDL))
 
 def save_token(email: str, token_dict: dict):
     """Upsert token JSON for email."""
@@ -63,3 +306,724 @@ def get_token(email: str):
     except SQLAlchemyError as e:
         print("DB get_token error:", e)
         return None
+
+def get_summaries(
+    email: str, message_ids: List[str], models: List[str], prompt_version: str,
+) -> Dict[Tuple[str, str], str]:
+    """Return {(message_id, body_hash): summary} by any of `models` for the given messages, in one query."""
+    if not email or not message_ids or not models:
+        return {}
+    t = summaries_table
+    stmt = select(t.c.message_id, t.c.body_hash, t.c.summary).where(
+        t.c.email == email,
+        t.c.message_id.in_(message_ids),
+        t.c.model.in_(models),
+        t.c.prompt_version == prompt_version,
+    )
+    try:
+        with engine.connect() as conn:
+            return {(row[0], row[1]): row[2] for row in conn.execute(stmt)}
+    except SQLAlchemyError as e:
+        print("DB get_summaries error:", e)
+        return {}
+
+def save_summary(email: str, message_id: str, body_hash: str, model: str, prompt_version: str, summary: str):
+    """Upsert one cached summary. Errors are logged, not raised (it's only a cache)."""
+    stmt = pg_insert(summaries_table).values(
+        email=email,
+        message_id=message_id,
+        body_hash=body_hash,
+        model=model,
+        prompt_version=prompt_version,
+        summary=summary,
+        created_at=time.time(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email", "message_id", "body_hash", "model", "prompt_version"],
+        set_={"summary": stmt.excluded.summary, "created_at": stmt.excluded.created_at},
+    )
+    try:
+        with engine.begin() as conn:
+            conn.execute(stmt)
+            # The summary is searchable too
+            _index_messages(conn, email, [message_id])
+    except SQLAlchemyError as e:
+        print("DB save_summary error:", e)
+
+def delete_stale_summaries(models: List[str], prompt_version: str) -> int:
+    """Drop summaries produced by a model not in `models` or another prompt version."""
+    t = summaries_table
+    f = summary_fingerprints_table
+    stmt = delete(t).where(or_(t.c.model.notin_(models), t.c.prompt_version != prompt_version))
+    try:
+        with engine.begin() as conn:
+            conn.execute(delete(f).where(or_(f.c.model.notin_(models), f.c.prompt_version != prompt_version)))
+            return conn.execute(stmt).rowcount or 0
+    except SQLAlchemyError as e:
+        print("DB delete_stale_summaries error:", e)
+        return 0
+
+def find_summary_fingerprints(
+    models: List[str],
+    prompt_version: str,
+    email: str,
+    senders: Iterable[str],
+    exact_hashes: Iterable[str],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """
+    Candidates for a page of fingerprints, in one query: the ones from
+    `senders` with any of `exact_hashes` (any user's), and the newest `limit`
+    per sender in `email`'s own mail. Rows carry their sender and email, for
+    the caller to match each fingerprint with its own candidates.
+    """
+    senders, exact_hashes = list(senders), list(exact_hashes)
+    if not models or not senders:
+        return []
+    f = summary_fingerprints_table
+    cols = [f.c.model, f.c.sender, f.c.email, f.c.exact_hash, f.c.simhash, f.c.digits_hash, f.c.summary]
+    where = (f.c.model.in_(models), f.c.prompt_version == prompt_version, f.c.sender.in_(senders))
+    exact = select(*cols).where(*where, f.c.exact_hash.in_(exact_hashes))
+    ranked = select(
+        *cols, func.row_number().over(partition_by=f.c.sender, order_by=f.c.created_at.desc()).label("recency"),
+    ).where(*where, f.c.email == email).subquery()
+    near = select(*[ranked.c[c.name] for c in cols]).where(ranked.c.recency <= limit)
+    try:
+        with engine.connect() as conn:
+            return [dict(r._mapping) for r in conn.execute(union_all(exact, near))]
+    except SQLAlchemyError as e:
+        print("DB find_summary_fingerprints error:", e)
+        return []
+
+def save_summary_fingerprint(
+    model: str,
+    prompt_version: str,
+    sender: str,
+    email: str,
+    exact_hash: str,
+    simhash: int,
+    digits_hash: str,
+    summary: str,
+):
+    """Store one fingerprint; a body already stored for this sender is left as it is."""
+    stmt = pg_insert(summary_fingerprints_table).values(
+        model=model,
+        prompt_version=prompt_version,
+        sender=sender,
+        email=email,
+        exact_hash=exact_hash,
+        simhash=simhash,
+        digits_hash=digits_hash,
+        summary=summary,
+        created_at=time.time(),
+    ).on_conflict_do_nothing(index_elements=["model", "prompt_version", "sender", "exact_hash"])
+    try:
+        with engine.begin() as conn:
+            conn.execute(stmt)
+    except SQLAlchemyError as e:
+        print("DB save_summary_fingerprint error:", e)
+
+def get_thread_summary(email: str, thread_id: str) -> Optional[Dict[str, Any]]:
+    t = thread_summaries_table
+    stmt = select(t).where(t.c.email == email, t.c.thread_id == thread_id)
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(stmt).first()
+            return dict(row._mapping) if row else None
+    except SQLAlchemyError as e:
+        print("DB get_thread_summary error:", e)
+        return None
+
+def save_thread_summary(
+    email: str,
+    thread_id: str,
+    model: str,
+    prompt_version: str,
+    summary: str,
+    folded_until: int,
+    message_count: int,
+    models: List[str],
+):
+    """
+    Upsert a thread summary; a summary that covers less than the stored one
+    is dropped, unless that one is by a model not in `models` or another
+    prompt version.
+    """
+    t = thread_summaries_table
+    stmt = pg_insert(t).values(
+        email=email,
+        thread_id=thread_id,
+        model=model,
+        prompt_version=prompt_version,
+        summary=summary,
+        folded_until=folded_until,
+        message_count=message_count,
+        updated_at=time.time(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email", "thread_id"],
+        set_={
+            c: stmt.excluded[c]
+            for c in ("model", "prompt_version", "summary", "folded_until", "message_count", "updated_at")
+        },
+        # Two requests folding the same thread: the one that saw more wins
+        where=or_(
+            t.c.folded_until <= stmt.excluded.folded_until,
+            t.c.model.notin_(models),
+            t.c.prompt_version != stmt.excluded.prompt_version,
+        ),
+    )
+    try:
+        with engine.begin() as conn:
+            conn.execute(stmt)
+    except SQLAlchemyError as e:
+        print("DB save_thread_summary error:", e)
+
+def _labels_to_db(label_ids: Iterable[str]) -> str:
+    return " " + " ".join(label_ids or []) + " "
+
+def _labels_from_db(value: Optional[str]) -> List[str]:
+    return (value or "").split()
+
+def _message_values(email: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "email": email,
+        "message_id": row["id"],
+        "thread_id": row.get("thread_id"),
+        "label_ids": _labels_to_db(row.get("label_ids")),
+        "subject": row.get("subject"),
+        "from_line": row.get("from"),
+        "snippet": row.get("snippet"),
+        "body": row.get("body"),
+        "internal_date": row.get("internal_date"),
+    }
+
+def _message_from_db(r) -> Dict[str, Any]:
+    return {
+        "id": r.message_id,
+        "thread_id": r.thread_id,
+        "label_ids": _labels_from_db(r.label_ids),
+        "subject": r.subject,
+        "from": r.from_line,
+        "snippet": r.snippet,
+        "body": r.body,
+        "internal_date": r.internal_date,
+    }
+
+def _with_headers(stmt):
+    """Add the stored triage headers to a select over messages."""
+    t, h = messages_table, message_headers_table
+    return stmt.add_columns(h.c.headers).select_from(
+        t.outerjoin(h, and_(h.c.email == t.c.email, h.c.message_id == t.c.message_id))
+    )
+
+def _message_with_headers_from_db(r) -> Dict[str, Any]:
+    return dict(_message_from_db(r), headers=json.loads(r.headers) if r.headers else {})
+
+def get_sync_state(email: str) -> Optional[Dict[str, Any]]:
+    """Return {"history_id", "synced_at"} for a user, or None if never synced."""
+    t = sync_state_table
+    stmt = select(t.c.history_id, t.c.synced_at).where(t.c.email == email)
+    try:
+        with engine.connect() as conn:
+            res = conn.execute(stmt).fetchone()
+            return {"history_id": res[0], "synced_at": res[1]} if res else None
+    except SQLAlchemyError as e:
+        print("DB get_sync_state error:", e)
+        return None
+
+def save_sync_state(email: str, history_id: str):
+    stmt = pg_insert(sync_state_table).values(email=email, history_id=str(history_id), synced_at=time.time())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email"],
+        set_={"history_id": stmt.excluded.history_id, "synced_at": stmt.excluded.synced_at},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+def get_sync_retries(email: str) -> Dict[str, int]:
+    t = sync_retries_table
+    stmt = select(t.c.message_id, t.c.attempts).where(t.c.email == email)
+    with engine.connect() as conn:
+        return {row[0]: row[1] for row in conn.execute(stmt)}
+
+def replace_sync_retries(email: str, attempts: Dict[str, int]):
+    """Set the messages still to fetch for a user (and how often they failed), dropping the others."""
+    t = sync_retries_table
+    with engine.begin() as conn:
+        conn.execute(delete(t).where(t.c.email == email))
+        if attempts:
+            conn.execute(
+                pg_insert(t), [{"email": email, "message_id": mid, "attempts": n} for mid, n in attempts.items()]
+            )
+
+def _upsert_messages(conn, email: str, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    stmt = pg_insert(messages_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email", "message_id"],
+        set_={
+            c: stmt.excluded[c]
+            for c in ("thread_id", "label_ids", "subject", "from_line", "snippet", "body", "internal_date")
+        },
+    )
+    conn.execute(stmt, [_message_values(email, r) for r in rows])
+    with_headers = [r for r in rows if "headers" in r]
+    if with_headers:
+        stmt = pg_insert(message_headers_table)
+        stmt = stmt.on_conflict_do_update(index_elements=["email", "message_id"], set_={"headers": stmt.excluded.headers})
+        conn.execute(
+            stmt,
+            [{"email": email, "message_id": r["id"], "headers": json.dumps(r["headers"] or {})} for r in with_headers],
+        )
+    _index_messages(conn, email, [r["id"] for r in rows])
+
+def upsert_messages(email: str, rows: List[Dict[str, Any]]):
+    """Insert or update stored messages (rows use the API shape: id, from, label_ids, ...)."""
+    with engine.begin() as conn:
+        _upsert_messages(conn, email, rows)
+
+def replace_messages(email: str, rows: List[Dict[str, Any]]):
+    """Replace everything stored for a user (full resync), in one transaction."""
+    with engine.begin() as conn:
+        conn.execute(delete(messages_table).where(messages_table.c.email == email))
+        conn.execute(delete(message_headers_table).where(message_headers_table.c.email == email))
+        _unindex_messages(conn, email, None)
+        _upsert_messages(conn, email, rows)
+
+def delete_messages(email: str, message_ids: Iterable[str]):
+    ids = list(message_ids)
+    if not ids:
+        return
+    t = messages_table
+    h = message_headers_table
+    with engine.begin() as conn:
+        conn.execute(delete(t).where(t.c.email == email, t.c.message_id.in_(ids)))
+        conn.execute(delete(h).where(h.c.email == email, h.c.message_id.in_(ids)))
+        _unindex_messages(conn, email, ids)
+
+def update_message_labels(email: str, labels_by_id: Dict[str, List[str]]):
+    """Set the full label list of already-stored messages."""
+    if not labels_by_id:
+        return
+    t = messages_table
+    stmt = (
+        update(t)
+        .where(t.c.email == bindparam("b_email"), t.c.message_id == bindparam("b_id"))
+        .values(label_ids=bindparam("b_labels"))
+    )
+    with engine.begin() as conn:
+        conn.execute(
+            stmt,
+            [
+                {"b_email": email, "b_id": mid, "b_labels": _labels_to_db(labels)}
+                for mid, labels in labels_by_id.items()
+            ],
+        )
+
+def get_stored_message_ids(email: str, message_ids: Iterable[str]) -> Set[str]:
+    ids = list(message_ids)
+    if not ids:
+        return set()
+    t = messages_table
+    stmt = select(t.c.message_id).where(t.c.email == email, t.c.message_id.in_(ids))
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(stmt)}
+
+def list_messages(email: str, label: Optional[str] = "INBOX", limit: int = 5) -> List[Dict[str, Any]]:
+    """Stored messages for a user, newest first, optionally filtered by label."""
+    t = messages_table
+    stmt = select(t).where(t.c.email == email)
+    if label:
+        stmt = stmt.where(t.c.label_ids.like(f"% {label} %"))
+    stmt = _with_headers(stmt.order_by(t.c.internal_date.desc()).limit(limit))
+    with engine.connect() as conn:
+        return [_message_with_headers_from_db(r) for r in conn.execute(stmt)]
+
+def get_messages(email: str, message_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Stored messages by id; ids that aren't stored are simply absent."""
+    ids = list(message_ids)
+    if not ids:
+        return {}
+    t = messages_table
+    stmt = _with_headers(select(t).where(t.c.email == email, t.c.message_id.in_(ids)))
+    with engine.connect() as conn:
+        return {r.message_id: _message_with_headers_from_db(r) for r in conn.execute(stmt)}
+
+def get_message_senders(email: str, message_ids: Iterable[str]) -> Dict[str, str]:
+    """From lines of stored messages by id (no bodies)."""
+    ids = list(message_ids)
+    if not ids:
+        return {}
+    t = messages_table
+    stmt = select(t.c.message_id, t.c.from_line).where(t.c.email == email, t.c.message_id.in_(ids))
+    with engine.connect() as conn:
+        return {r.message_id: r.from_line or "" for r in conn.execute(stmt)}
+
+def list_token_emails() -> List[str]:
+    """Every user with a stored token."""
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(select(tokens_table.c.email))]
+
+def enqueue_summary_jobs(email: str, message_ids: Iterable[str]):
+    """Queue messages for a prefetched summary; already queued ones are left as they are."""
+    ids = list(dict.fromkeys(message_ids))
+    if not ids:
+        return
+    now = time.time()
+    stmt = pg_insert(summary_jobs_table).on_conflict_do_nothing(index_elements=["email", "message_id"])
+    with engine.begin() as conn:
+        conn.execute(
+            stmt,
+            [{"email": email, "message_id": mid, "enqueued_at": now, "attempts": 0, "due_at": now} for mid in ids],
+        )
+
+def due_summary_job_emails() -> List[str]:
+    """Users with at least one job due now."""
+    t = summary_jobs_table
+    stmt = select(t.c.email).where(t.c.due_at <= time.time()).group_by(t.c.email)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(stmt)]
+
+def claim_summary_jobs(email: str, limit: int, lease_seconds: float) -> List[str]:
+    """
+    Claim up to `limit` of a user's due jobs, oldest first, for `lease_seconds`.
+    Jobs another worker claimed in the meantime are not returned.
+    """
+    t = summary_jobs_table
+    now = time.time()
+    candidates = (
+        select(t.c.message_id)
+        .where(t.c.email == email, t.c.due_at <= now)
+        .order_by(t.c.enqueued_at)
+        .limit(limit)
+    )
+    with engine.begin() as conn:
+        ids = [row[0] for row in conn.execute(candidates)]
+        if not ids:
+            return []
+        stmt = (
+            update(t)
+            .where(t.c.email == email, t.c.message_id.in_(ids), t.c.due_at <= now)
+            .values(due_at=now + lease_seconds)
+            .returning(t.c.message_id)
+        )
+        return [row[0] for row in conn.execute(stmt)]
+
+def finish_summary_jobs(email: str, message_ids: Iterable[str]):
+    ids = list(message_ids)
+    if not ids:
+        return
+    t = summary_jobs_table
+    with engine.begin() as conn:
+        conn.execute(delete(t).where(t.c.email == email, t.c.message_id.in_(ids)))
+
+def retry_summary_jobs(email: str, message_ids: Iterable[str], delay: float, max_attempts: int) -> int:
+    """Put failed jobs back `delay` seconds from now; drop those out of attempts. Returns how many were dropped."""
+    ids = list(message_ids)
+    if not ids:
+        return 0
+    t = summary_jobs_table
+    with engine.begin() as conn:
+        conn.execute(
+            update(t)
+            .where(t.c.email == email, t.c.message_id.in_(ids))
+            .values(attempts=t.c.attempts + 1, due_at=time.time() + delay)
+        )
+        return conn.execute(
+            delete(t).where(t.c.email == email, t.c.message_id.in_(ids), t.c.attempts >= max_attempts)
+        ).rowcount or 0
+
+def count_summary_jobs() -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(summary_jobs_table)).scalar() or 0
+
+def enqueue_outbox(email: str, message_id: str, idempotency_key: str, body: str) -> str:
+    """Queue a reply; a key already used by this user returns that entry's id instead."""
+    t = outbox_table
+    now = time.time()
+    stmt = pg_insert(t).values(
+        id=uuid.uuid4().hex, email=email, message_id=message_id, idempotency_key=idempotency_key, body=body,
+        status="queued", attempts=0, due_at=now, created_at=now, updated_at=now,
+    ).on_conflict_do_nothing(index_elements=["email", "idempotency_key"])
+    with engine.begin() as conn:
+        conn.execute(stmt)
+        return conn.execute(
+            select(t.c.id).where(t.c.email == email, t.c.idempotency_key == idempotency_key)
+        ).scalar_one()
+
+def claim_outbox(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Claim up to `limit` due entries (queued, or sending with an expired lease),
+    oldest first, for `lease_seconds`, counting an attempt for each. Entries
+    another worker claimed in the meantime are not returned.
+    """
+    t = outbox_table
+    now = time.time()
+    pending = t.c.status.in_(("queued", "sending"))
+    candidates = select(t.c.id).where(pending, t.c.due_at <= now).order_by(t.c.due_at).limit(limit)
+    with engine.begin() as conn:
+        ids = [row[0] for row in conn.execute(candidates)]
+        if not ids:
+            return []
+        stmt = (
+            update(t)
+            .where(t.c.id.in_(ids), pending, t.c.due_at <= now)
+            .values(status="sending", attempts=t.c.attempts + 1, due_at=now + lease_seconds, updated_at=now)
+            .returning(*t.c)
+        )
+        return [dict(row._mapping) for row in conn.execute(stmt)]
+
+def _update_outbox(outbox_id: str, **values):
+    t = outbox_table
+    with engine.begin() as conn:
+        conn.execute(update(t).where(t.c.id == outbox_id).values(updated_at=time.time(), **values))
+
+def finish_outbox(outbox_id: str, sent_message_id: Optional[str]):
+    _update_outbox(outbox_id, status="sent", sent_message_id=sent_message_id, error=None)
+
+def retry_outbox(outbox_id: str, delay: float, error: str):
+    """Put a failed send back `delay` seconds from now."""
+    _update_outbox(outbox_id, status="queued", due_at=time.time() + delay, error=error)
+
+def fail_outbox(outbox_id: str, error: str):
+    _update_outbox(outbox_id, status="failed", error=error)
+
+def get_outbox(email: str, outbox_id: str) -> Optional[Dict[str, Any]]:
+    """The user's outbox entry, or None (also for another user's id)."""
+    t = outbox_table
+    with engine.connect() as conn:
+        row = conn.execute(select(t).where(t.c.id == outbox_id, t.c.email == email)).first()
+    return dict(row._mapping) if row else None
+
+def count_outbox() -> Dict[str, int]:
+    t = outbox_table
+    with engine.connect() as conn:
+        return {status: n for status, n in conn.execute(select(t.c.status, func.count()).group_by(t.c.status))}
+
+def delete_finished_outbox(older_than: float) -> int:
+    """Drop sent and failed entries last updated more than `older_than` seconds ago."""
+    t = outbox_table
+    stmt = delete(t).where(t.c.status.in_(("sent", "failed")), t.c.updated_at < time.time() - older_than)
+    with engine.begin() as conn:
+        return conn.execute(stmt).rowcount or 0
+
+def _latest_summary(email_col, message_id_col):
+    """Newest cached summary of a message (any model or prompt version), as a scalar subquery."""
+    t = summaries_table
+    return (
+        select(t.c.summary)
+        .where(t.c.email == email_col, t.c.message_id == message_id_col)
+        .order_by(t.c.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+def _ts_config():
+    return literal_column(f"'{SEARCH_TEXT_CONFIG}'::regconfig")
+
+def _tsvector(column, weight: str):
+    return func.setweight(func.to_tsvector(_ts_config(), func.coalesce(column, "")), literal_column(f"'{weight}'"))
+
+def _index_messages(conn, email: str, message_ids: List[str]):
+    """(Re)index stored messages; ids that aren't stored are skipped."""
+    if not message_ids or _SEARCH_DIALECT is None:
+        return
+    m, s = messages_table, message_search_table
+    summary = _latest_summary(m.c.email, m.c.message_id)
+    stored = and_(m.c.email == email, m.c.message_id.in_(message_ids))
+
+    if _SEARCH_DIALECT == "postgresql":
+        document = (
+            _tsvector(m.c.subject, "A")
+            .op("||")(_tsvector(m.c.from_line, "B"))
+            .op("||")(_tsvector(summary, "B"))
+            .op("||")(_tsvector(m.c.body, "C"))
+        )
+        stmt = pg_insert(s).from_select(
+            ["email", "message_id", "internal_date", "document"],
+            select(m.c.email, m.c.message_id, m.c.internal_date, document).where(stored),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["email", "message_id"],
+            set_={"internal_date": stmt.excluded.internal_date, "document": stmt.excluded.document},
+        )
+        conn.execute(stmt)
+        return
+
+    stmt = pg_insert(s).from_select(
+        ["email", "message_id", "internal_date"],
+        select(m.c.email, m.c.message_id, m.c.internal_date).where(stored),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email", "message_id"], set_={"internal_date": stmt.excluded.internal_date},
+    )
+    conn.execute(stmt)
+    rows = conn.execute(
+        select(s.c.id, m.c.subject, m.c.from_line, summary, m.c.body)
+        .join(m, and_(m.c.email == s.c.email, m.c.message_id == s.c.message_id))
+        .where(stored)
+    ).fetchall()
+    if rows:
+        conn.execute(
+            message_search_fts.insert().prefix_with("OR REPLACE"),
+            [
+                {"rowid": r[0], "subject": r[1] or "", "from_line": r[2] or "", "summary": r[3] or "", "body": r[4] or ""}
+                for r in rows
+            ],
+        )
+
+def _unindex_messages(conn, email: str, message_ids: Optional[List[str]]):
+    """Drop messages (all of the user's when `message_ids` is None) from the index."""
+    if _SEARCH_DIALECT is None:
+        return
+    s = message_search_table
+    where = s.c.email == email
+    if message_ids is not None:
+        where = and_(where, s.c.message_id.in_(message_ids))
+    if _SEARCH_DIALECT == "sqlite":
+        fts = message_search_fts
+        conn.execute(delete(fts).where(fts.c.rowid.in_(select(s.c.id).where(where))))
+    conn.execute(delete(s).where(where))
+
+def index_unindexed_messages(batch_size: int = 500) -> int:
+    """Index stored messages that have no index entry yet (first start with search). Returns how many."""
+    if _SEARCH_DIALECT is None:
+        return 0
+    m, s = messages_table, message_search_table
+    missing = (
+        select(m.c.email, m.c.message_id)
+        .outerjoin(s, and_(s.c.email == m.c.email, s.c.message_id == m.c.message_id))
+        .where(s.c.id.is_(None))
+        .limit(batch_size)
+    )
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(missing).fetchall()
+            by_email: Dict[str, List[str]] = {}
+            for email, message_id in rows:
+                by_email.setdefault(email, []).append(message_id)
+            for email, ids in by_email.items():
+                _index_messages(conn, email, ids)
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+
+_FTS_TERM_RE = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+def _fts5_query(query: str) -> Optional[str]:
+    """
+    websearch_to_tsquery-style input (words, "quoted phrases", OR, -excluded)
+    as an FTS5 query; None when nothing is left to match.
+    """
+    positives: List[str] = []
+    negatives: List[str] = []
+    join_or = False
+    for match in _FTS_TERM_RE.finditer(query):
+        negate, phrase, word = match.group(1), match.group(2), match.group(3)
+        if word is not None:
+            if word.upper() == "OR":
+                join_or = bool(positives)
+                continue
+            negate, phrase = ("-", word[1:]) if word.startswith("-") else ("", word)
+        tokens = re.findall(r"\w+", phrase)
+        if not tokens:
+            continue
+        term = '"' + " ".join(tokens) + '"'
+        if negate:
+            negatives.append(term)
+        elif join_or:
+            positives[-1] = f"({positives[-1]} OR {term})"
+            join_or = False
+        else:
+            positives.append(term)
+    if not positives:
+        return None
+    return " AND ".join(positives) + "".join(f" NOT {term}" for term in negatives)
+
+def search_messages(
+    email: str,
+    query: str,
+    limit: int = 20,
+    offset: int = 0,
+    label: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Stored messages matching `query` (words, "phrases", OR, -word), best
+    match first, then newest. Rows have the get_messages shape plus
+    "summary" (latest cached, or None) and "rank" (higher is better).
+    """
+    if _SEARCH_DIALECT is None or not query.strip():
+        return []
+    m, s = messages_table, message_search_table
+    joined = s.join(m, and_(m.c.email == s.c.email, m.c.message_id == s.c.message_id))
+    columns = [m, _latest_summary(m.c.email, m.c.message_id).label("summary")]
+
+    if _SEARCH_DIALECT == "postgresql":
+        tsquery = func.websearch_to_tsquery(_ts_config(), query)
+        rank = func.ts_rank_cd(s.c.document, tsquery)
+        stmt = select(*columns, rank.label("rank")).select_from(joined).where(
+            s.c.email == email, s.c.document.op("@@")(tsquery)
+        )
+    else:
+        fts_query = _fts5_query(query)
+        if fts_query is None:
+            return []
+        # bm25() is lower-is-better
+        rank = -literal_column(f"bm25(message_search_fts, {_SQLITE_FTS_WEIGHTS})")
+        fts = message_search_fts
+        stmt = (
+            select(*columns, rank.label("rank"))
+            .select_from(joined.join(fts, fts.c.rowid == s.c.id))
+            .where(s.c.email == email, literal_column("message_search_fts").op("MATCH")(fts_query))
+        )
+    if label:
+        stmt = stmt.where(m.c.label_ids.like(f"% {label} %"))
+    stmt = stmt.order_by(rank.desc(), m.c.internal_date.desc()).limit(limit).offset(offset)
+
+    with engine.connect() as conn:
+        return [dict(_message_from_db(r), summary=r.summary, rank=float(r.rank or 0)) for r in conn.execute(stmt)]
+
+async def get_token_async(email: str):
+    """Async get_token."""
+    if not email:
+        return None
+    if async_engine is None:
+        return await to_thread.run_sync(get_token, email)
+    stmt = select(tokens_table.c.data).where(tokens_table.c.email == email)
+    try:
+        async with async_engine.connect() as conn:
+            res = (await conn.execute(stmt)).fetchone()
+            return json.loads(res[0]) if res else None
+    except SQLAlchemyError as e:
+        print("DB get_token_async error:", e)
+        return None
+
+async def save_token_async(email: str, token_dict: dict):
+    """Async save_token."""
+    if async_engine is None:
+        return await to_thread.run_sync(save_token, email, token_dict)
+    if not email:
+        raise ValueError("email required")
+    stmt = pg_insert(tokens_table).values(email=email, data=json.dumps(token_dict))
+    stmt = stmt.on_conflict_do_update(index_elements=["email"], set_={"data": stmt.excluded.data})
+    try:
+        async with async_engine.begin() as conn:
+            await conn.execute(stmt)
+    except SQLAlchemyError as e:
+        print("DB save_token_async error:", e)
+        raise
+
+async def get_messages_async(email: str, message_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Async get_messages."""
+    ids = list(message_ids)
+    if async_engine is None:
+        return await to_thread.run_sync(get_messages, email, ids)
+    if not ids:
+        return {}
+    t = messages_table
+    stmt = _with_headers(select(t).where(t.c.email == email, t.c.message_id.in_(ids)))
+    async with async_engine.connect() as conn:
+        return {r.message_id: _message_with_headers_from_db(r) for r in await conn.execute(stmt)}
@@ -0,0 +1,268 @@
+# app/gmail_async.py
+"""
+Async Gmail REST client on a shared, pooled httpx.AsyncClient.
+
+Used by the async route handlers so a request waiting on Gmail doesn't hold
+a threadpool worker. The same client (keep-alive connection pool) is used
+for the OAuth token/userinfo calls in auth.py.
+
+Several messages are fetched with one Gmail batch request
+(multipart/mixed, up to GMAIL_BATCH_SIZE calls each), like
+gmail_service.batch_get_messages does on the sync path. The bulk routes'
+batchModify/batchDelete calls go out in chunks of up to 1000 ids.
+"""
+
+import asyncio
+import json
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote, urlencode
+
+import httpx
+from google.oauth2.credentials import Credentials
+
+from .config import (
+    ASYNC_HTTP_MAX_CONNECTIONS,
+    GMAIL_API_BASE_URL,
+    GMAIL_ASYNC_CONCURRENCY,
+    GMAIL_BATCH_SIZE,
+    GMAIL_HTTP_TIMEOUT_SECONDS,
+)
+from .metrics import span
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class GmailAPIError(Exception):
+    """Non-2xx answer from Gmail; `status` is the HTTP status code."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Gmail API error {status}: {message}")
+        self.status = status
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide async HTTP client (created on first use)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=GMAIL_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _query(params: Dict[str, Any]) -> str:
+    return urlencode({k: v for k, v in params.items() if v is not None}, doseq=True)
+
+
+def _path(path: str) -> str:
+    return f"/gmail/v1/users/me/{path}"
+
+
+async def _request(
+    creds: Credentials,
+    method: str,
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    body: Any = None,
+    stage: str = "gmail",
+):
+    with span(stage):
+        resp = await get_client().request(
+            method,
+            GMAIL_API_BASE_URL + _path(path),
+            params=_query(params or {}),
+            json=body,
+            headers={"Authorization": f"Bearer {creds.token}"},
+        )
+    if resp.status_code >= 400:
+        raise GmailAPIError(resp.status_code, resp.text[:300])
+    return resp.json() if resp.content else {}
+
+
+async def get_profile(creds: Credentials) -> Dict[str, Any]:
+    return await _request(creds, "GET", "profile", stage="gmail_profile")
+
+
+async def list_messages(creds: Credentials, **params) -> Dict[str, Any]:
+    return await _request(creds, "GET", "messages", params, stage="gmail_list")
+
+
+async def get_message(creds: Credentials, message_id: str, fmt: str = "full", **params) -> Dict[str, Any]:
+    return await _request(creds, "GET", f"messages/{quote(message_id, safe='')}", dict(params, format=fmt), stage="gmail_get")
+
+
+async def get_thread(creds: Credentials, thread_id: str, fmt: str = "full") -> Dict[str, Any]:
+    return await _request(creds, "GET", f"threads/{quote(thread_id, safe='')}", {"format": fmt}, stage="gmail_thread")
+
+
+async def get_attachment(creds: Credentials, message_id: str, attachment_id: str) -> Dict[str, Any]:
+    return await _request(
+        creds,
+        "GET",
+        f"messages/{quote(message_id, safe='')}/attachments/{quote(attachment_id, safe='')}",
+        stage="gmail_get",
+    )
+
+
+async def send_message(creds: Credentials, raw: str, thread_id: Optional[str] = None) -> Dict[str, Any]:
+    body = {"raw": raw}
+    if thread_id:
+        body["threadId"] = thread_id
+    return await _request(creds, "POST", "messages/send", body=body, stage="gmail_send")
+
+
+async def delete_message(creds: Credentials, message_id: str):
+    await _request(creds, "DELETE", f"messages/{quote(message_id, safe='')}", stage="gmail_delete")
+
+
+# messages.batchModify / batchDelete accept at most 1000 ids per call.
+GMAIL_BULK_LIMIT = 1000
+
+
+async def _chunked_bulk_call(
+    creds: Credentials, path: str, message_ids: List[str], body: Dict[str, Any]
+) -> Dict[str, Optional[str]]:
+    """
+    POST `body` plus chunks of GMAIL_BULK_LIMIT ids to `path`; chunks run
+    concurrently (at most GMAIL_ASYNC_CONCURRENCY at a time).
+    Returns {message_id: None on success, or an error message}; a failed call
+    marks every id of its chunk as failed and the other chunks still run.
+    """
+    semaphore = asyncio.Semaphore(max(1, GMAIL_ASYNC_CONCURRENCY))
+
+    async def run(chunk: List[str]) -> Optional[str]:
+        async with semaphore:
+            try:
+                await _request(creds, "POST", path, body=dict(body, ids=chunk), stage="gmail_bulk")
+                return None
+            except Exception as e:
+                print("DEBUG bulk call failed for", len(chunk), "messages:", e)
+                return str(e) or e.__class__.__name__
+
+    chunks = [message_ids[i:i + GMAIL_BULK_LIMIT] for i in range(0, len(message_ids), GMAIL_BULK_LIMIT)]
+    results: Dict[str, Optional[str]] = {}
+    for chunk, error in zip(chunks, await asyncio.gather(*(run(c) for c in chunks))):
+        for msg_id in chunk:
+            results[msg_id] = error
+    return results
+
+
+async def batch_modify(
+    creds: Credentials,
+    message_ids: List[str],
+    add_label_ids: Optional[List[str]] = None,
+    remove_label_ids: Optional[List[str]] = None,
+) -> Dict[str, Optional[str]]:
+    """Add/remove labels on many messages with users.messages.batchModify."""
+    body: Dict[str, Any] = {}
+    if add_label_ids:
+        body["addLabelIds"] = add_label_ids
+    if remove_label_ids:
+        body["removeLabelIds"] = remove_label_ids
+    return await _chunked_bulk_call(creds, "messages/batchModify", message_ids, body)
+
+
+async def batch_delete(creds: Credentials, message_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Permanently delete many messages with users.messages.batchDelete."""
+    return await _chunked_bulk_call(creds, "messages/batchDelete", message_ids, {})
+
+
+def _parse_batch_response(content_type: str, content: bytes) -> Dict[int, Any]:
+    """
+    Split a multipart/mixed batch response into {item index: parsed JSON or GmailAPIError}.
+    """
+    envelope = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + content
+    )
+    results: Dict[int, Any] = {}
+    for part in envelope.iter_parts():
+        content_id = (part.get("Content-ID") or "").strip("<> ")
+        if not content_id.startswith("response-item"):
+            continue
+        index = int(content_id[len("response-item"):])
+        # Each part is an embedded HTTP response: status line, headers, blank line, body.
+        raw = part.get_payload(decode=True) or b""
+        head, _, body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+        status_line = head.split(b"\n", 1)[0].decode("latin-1")
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            status = 500
+        if status >= 400:
+            results[index] = GmailAPIError(status, body.decode("utf-8", errors="replace")[:300])
+        else:
+            results[index] = json.loads(body or b"{}")
+    return results
+
+
+async def _batch_get(creds: Credentials, message_ids: List[str], query: str) -> Dict[str, Any]:
+    boundary = "batch_" + uuid.uuid4().hex
+    parts = []
+    for i, msg_id in enumerate(message_ids):
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"GET {_path('messages/' + quote(msg_id, safe=''))}?{query}\r\n\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+
+    with span("gmail_batch"):
+        resp = await get_client().post(
+            GMAIL_API_BASE_URL + "/batch/gmail/v1",
+            content="".join(parts).encode("utf-8"),
+            headers={
+                "Authorization": f"Bearer {creds.token}",
+                "Content-Type": f"multipart/mixed; boundary={boundary}",
+            },
+        )
+    if resp.status_code >= 400:
+        raise GmailAPIError(resp.status_code, resp.text[:300])
+
+    parsed = _parse_batch_response(resp.headers.get("content-type", ""), resp.content)
+    return {message_ids[i]: value for i, value in parsed.items() if i < len(message_ids)}
+
+
+async def batch_get_messages(creds: Credentials, message_ids: List[str], fmt: str = "full", **params) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch several messages with Gmail batch requests; batches run concurrently
+    (at most GMAIL_ASYNC_CONCURRENCY at a time).
+    Returns {message_id: message}; failed messages are logged and left out.
+    """
+    if not message_ids:
+        return {}
+    query = _query(dict(params, format=fmt))
+    batch_size = max(1, min(GMAIL_BATCH_SIZE, 100))
+    semaphore = asyncio.Semaphore(max(1, GMAIL_ASYNC_CONCURRENCY))
+
+    async def run(chunk: List[str]) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await _batch_get(creds, chunk, query)
+            except Exception as e:
+                print("DEBUG async batch get: batch request failed", e)
+                return {}
+
+    chunks = [message_ids[i:i + batch_size] for i in range(0, len(message_ids), batch_size)]
+    results: Dict[str, Dict[str, Any]] = {}
+    for partial in await asyncio.gather(*(run(c) for c in chunks)):
+        for msg_id, value in partial.items():
+            if isinstance(value, Exception):
+                print(f"DEBUG async batch get: failed to fetch message {msg_id}", value)
+            else:
+                results[msg_id] = value
+    return results
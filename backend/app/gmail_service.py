@@ -0,0 +1,140 @@
+# app/gmail_service.py
+"""
+Reusable Gmail API service objects.
+
+`googleapiclient.discovery.build()` parses the ~140 KB Gmail discovery
+document and opens a fresh httplib2 connection (new TLS handshake) every
+time it's called. Here we:
+- parse the discovery document once per process, and
+- keep one built service per (worker thread, user), whose keep-alive
+  AuthorizedHttp connection is reused by every later request.
+
+httplib2.Http is not thread-safe, so connections are never shared between
+threads: each threadpool worker owns its own small LRU of per-user services.
+
+Also home to the message helpers shared by the routes and the sync engine
+(header lookup, attachment data, batched messages.get). Body extraction lives in mime_body.py.
+"""
+
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+import httplib2
+from cachetools import LRUCache
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from .config import (
+    GMAIL_API_BASE_URL,
+    GMAIL_BATCH_SIZE,
+    GMAIL_HTTP_TIMEOUT_SECONDS,
+    GMAIL_SERVICE_CACHE_SIZE,
+)
+from .metrics import span
+
+_doc_lock = threading.Lock()
+_discovery_doc: Optional[Dict[str, Any]] = None
+
+_local = threading.local()
+
+
+def _get_discovery_doc() -> Dict[str, Any]:
+    """Parsed Gmail v1 discovery document, loaded once per process."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        with _doc_lock:
+            if _discovery_doc is None:
+                doc = json.loads(get_static_doc("gmail", "v1"))
+                # rootUrl drives both the REST and the batch endpoint
+                doc["rootUrl"] = GMAIL_API_BASE_URL + "/"
+                _discovery_doc = doc
+    return _discovery_doc
+
+
+def _thread_services() -> LRUCache:
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = LRUCache(maxsize=max(1, GMAIL_SERVICE_CACHE_SIZE))
+        _local.services = services
+    return services
+
+
+def _build(creds: Credentials):
+    with span("discovery_build"):
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT_SECONDS))
+        return build_from_document(_get_discovery_doc(), http=http)
+
+
+def get_service(email: str, creds: Credentials):
+    """
+    Return a Gmail service for `email`, reusing this thread's cached service
+    (and its open connection) when there is one.
+    """
+    services = _thread_services()
+    service = services.get(email)
+    if service is None:
+        service = _build(creds)
+        services[email] = service
+    elif service._http.credentials is not creds:
+        # Same user, newer credentials object: keep the connection, swap the auth.
+        service._http.credentials = creds
+    return service
+
+
+def get_header(headers: List[Dict[str, str]], name: str) -> str:
+    for h in headers:
+        if h.get("name", "").lower() == name.lower():
+            return h.get("value", "")
+    return ""
+
+
+def get_attachment_data(service, message_id: str, attachment_id: str) -> Optional[str]:
+    """base64url data of an attachment (also used for bodies Gmail stores separately)."""
+    with span("gmail_get"):
+        resp = (
+            service.users()
+            .messages()
+            .attachments()
+            .get(userId="me", messageId=message_id, id=attachment_id)
+            .execute()
+        )
+    return resp.get("data")
+
+
+def batch_get_messages(service, message_ids: List[str], fmt: str = "full", **params) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch several messages with Gmail batch HTTP requests instead of one
+    round trip per message. Calls are grouped into batches of GMAIL_BATCH_SIZE.
+    Extra `params` (e.g. metadataHeaders, fields) are passed to messages.get.
+
+    Returns {message_id: message}. Messages that failed are logged and left
+    out, so one bad message doesn't fail the whole page.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def on_response(request_id: str, response: Dict[str, Any], exception: Exception):
+        if exception is not None:
+            print(f"DEBUG batch get: failed to fetch message {request_id}", exception)
+            return
+        results[request_id] = response
+
+    batch_size = max(1, min(GMAIL_BATCH_SIZE, 100))
+    for start in range(0, len(message_ids), batch_size):
+        batch = service.new_batch_http_request(callback=on_response)
+        for msg_id in message_ids[start:start + batch_size]:
+            batch.add(
+                service.users().messages().get(userId="me", id=msg_id, format=fmt, **params),
+                request_id=msg_id,
+            )
+        try:
+            with span("gmail_batch"):
+                batch.execute()
+        except Exception as e:
+            # Transport-level failure: every message in this chunk is lost,
+            # but earlier/later chunks are still returned.
+            print("DEBUG batch get: batch request failed", e)
+
+    return results
@@ -0,0 +1,381 @@
+# app/llm_governor.py
+"""
+Shared governor for LLM API calls, one per provider (Groq, OpenAI). Calls
+reach them through llm_router.py.
+
+Every model call goes through its provider's Governor, which:
+- paces calls with token buckets for requests/minute and tokens/minute.
+  A call that would have to queue longer than LLM_MAX_QUEUE_SECONDS is
+  refused instead of piling up behind the limit;
+- retries 429s, 5xx and connection errors with jittered exponential
+  backoff. A Retry-After header is honoured and pauses the bucket for every
+  caller; one longer than LLM_BACKOFF_MAX_SECONDS is not waited out;
+- trips a circuit breaker after LLM_BREAKER_FAILURES failures in a row.
+  While it is open calls fail at once; after LLM_BREAKER_RESET_SECONDS one
+  probe call is let through to test the provider;
+- times each call, queueing and retries included, as a metrics span named
+  after the provider, and counts the tokens the response reports.
+
+A refused or failed call raises LLMUnavailable; callers catch it and use
+their usual fallback (snippet preview, template reply).
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import groq
+import openai
+
+from .config import (
+    GROQ_REQUESTS_PER_MINUTE,
+    GROQ_TOKENS_PER_MINUTE,
+    LLM_BACKOFF_BASE_SECONDS,
+    LLM_BACKOFF_MAX_SECONDS,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_SECONDS,
+    LLM_MAX_QUEUE_SECONDS,
+    LLM_MAX_RETRIES,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+)
+from .metrics import record_llm_usage, span
+
+T = TypeVar("T")
+
+_CONNECTION_ERRORS = (groq.APIConnectionError, openai.APIConnectionError, ConnectionError, TimeoutError)
+
+
+class LLMUnavailable(Exception):
+    """The model call was refused (open circuit, rate limit) or kept failing."""
+
+
+def estimate_tokens(*texts: str, max_tokens: int = 0) -> int:
+    """Rough token count for rate limiting: ~4 characters per token, plus the completion budget."""
+    return sum(len(t) for t in texts if t) // 4 + max_tokens
+
+
+def _status_code(e: Exception) -> Optional[int]:
+    return getattr(e, "status_code", None)
+
+
+def _is_retryable(e: Exception) -> bool:
+    status = _status_code(e)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(e, _CONNECTION_ERRORS)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds from a Retry-After / retry-after-ms response header, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Two token buckets (requests and tokens per minute), refilled continuously.
+    A limit of 0 or less disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._requests = float(max(0, requests_per_minute))
+        self._tokens = float(max(0, tokens_per_minute))
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute > 0:
+            self._requests = min(
+                self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute > 0:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def reserve(self, tokens: int, max_wait: float) -> Optional[float]:
+        """
+        Reserve one request and `tokens` tokens. Returns how many seconds the
+        caller must wait before sending, or None (nothing reserved) if that
+        would be longer than `max_wait`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._paused_until - now)
+            if self.requests_per_minute > 0 and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute > 0:
+                # A call bigger than the whole bucket still goes once the bucket is full.
+                tokens = min(tokens, self.tokens_per_minute)
+                if self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+            if wait > max_wait:
+                return None
+            # Buckets may go negative: later callers then wait for this reservation too.
+            if self.requests_per_minute > 0:
+                self._requests -= 1
+            if self.tokens_per_minute > 0:
+                self._tokens -= tokens
+            return wait
+
+    def settle(self, reserved: int, used: int):
+        """Correct the token bucket once the real usage of a call is known."""
+        if self.tokens_per_minute <= 0 or not used:
+            return
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + min(reserved, self.tokens_per_minute) - used)
+
+    def pause(self, seconds: float):
+        """Hold every caller back for `seconds` (provider said Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def headroom(self) -> float:
+        """Fraction (0-1) of the fuller-used bucket that is available right now."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._paused_until > now:
+                return 0.0
+            fractions = [1.0]
+            if self.requests_per_minute > 0:
+                fractions.append(self._requests / self.requests_per_minute)
+            if self.tokens_per_minute > 0:
+                fractions.append(self._tokens / self.tokens_per_minute)
+            return max(0.0, min(fractions))
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` failures in a row -> half-open probe after `reset_seconds`."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """May a call go out now? In half-open state only one probe call is allowed."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._state = "half_open"
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release(self):
+        """An allowed call was not sent after all; let another probe go."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                print(f"LLM {self.name}: provider healthy again, circuit closed")
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                if self._state == "closed":
+                    print(f"LLM {self.name}: {self._failures} failures in a row, circuit open")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Governor:
+    """Rate limiter + retries + circuit breaker for one LLM provider."""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_retries: int = LLM_MAX_RETRIES,
+        max_queue_seconds: float = LLM_MAX_QUEUE_SECONDS,
+    ):
+        self.name = name
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.breaker = CircuitBreaker(name, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        self.max_retries = max_retries
+        self.max_queue_seconds = max_queue_seconds
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "throttled": 0, "rejected": 0, "failures": 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self._stats, circuit=self.breaker.state)
+
+    def headroom(self) -> float:
+        """Share of the rate budget free right now; 0 while the circuit isn't closed."""
+        if self.breaker.state != "closed":
+            return 0.0
+        return self.limiter.headroom()
+
+    def _admit(self, tokens: int, deadline: Optional[float]) -> float:
+        """Admission for one attempt: seconds to wait before sending, or LLMUnavailable."""
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise LLMUnavailable(f"{self.name}: circuit open")
+        budget = self.max_queue_seconds
+        if deadline is not None:
+            budget = min(budget, deadline - time.monotonic())
+        wait = self.limiter.reserve(tokens, max(0.0, budget))
+        if wait is None:
+            self.breaker.release()
+            self._count("throttled")
+            raise LLMUnavailable(f"{self.name}: rate limit reached")
+        self._count("calls")
+        return wait
+
+    def _backoff(self, e: Exception, attempt: int, deadline: Optional[float]) -> float:
+        """Seconds to wait before retrying after `e`; raises when the call shouldn't be retried."""
+        if not _is_retryable(e):
+            # The provider answered; the request itself was bad (400, 401, ...).
+            self.breaker.record_success()
+            raise e
+        self.breaker.record_failure()
+        self._count("failures")
+
+        retry_after = _retry_after(e)
+        if retry_after is not None and _status_code(e) == 429:
+            self.limiter.pause(retry_after)
+        if attempt >= self.max_retries:
+            raise LLMUnavailable(f"{self.name}: giving up after {attempt + 1} attempts") from e
+        if retry_after is not None:
+            if retry_after > LLM_BACKOFF_MAX_SECONDS:
+                raise LLMUnavailable(f"{self.name}: asked to retry after {retry_after:.0f}s") from e
+            delay = retry_after + random.uniform(0, LLM_BACKOFF_BASE_SECONDS)
+        else:
+            # "full jitter": anywhere between 0 and the exponential step
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise LLMUnavailable(f"{self.name}: no time left to retry") from e
+        self._count("retries")
+        return delay
+
+    def _succeeded(self, result: Any, tokens: int):
+        self.breaker.record_success()
+        usage = getattr(result, "usage", None)
+        record_llm_usage(self.name, usage)
+        total = getattr(usage, "total_tokens", None)
+        if total:
+            self.limiter.settle(tokens, total)
+
+    @staticmethod
+    def _attempt_timeout(deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        return max(0.1, deadline - time.monotonic())
+
+    def call(self, fn: Callable[[Optional[float]], T], tokens: int = 0, timeout: Optional[float] = None) -> T:
+        """
+        Run `fn(attempt_timeout)` under the limits, retrying as needed.
+        `timeout` bounds the whole call, queueing and retries included;
+        `fn` gets the seconds left for its attempt (None without a timeout).
+        """
+        with span(self.name):
+            return self._call(fn, tokens, timeout)
+
+    def _call(self, fn: Callable[[Optional[float]], T], tokens: int, timeout: Optional[float]) -> T:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            wait = self._admit(tokens, deadline)
+            if wait:
+                time.sleep(wait)
+            try:
+                result = fn(self._attempt_timeout(deadline))
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._succeeded(result, tokens)
+            return result
+
+    async def call_async(
+        self,
+        fn: Callable[[Optional[float]], Awaitable[T]],
+        tokens: int = 0,
+        timeout: Optional[float] = None,
+    ) -> T:
+        """Async call(): same limits and retries, sleeping on the event loop."""
+        with span(self.name):
+            return await self._call_async(fn, tokens, timeout)
+
+    async def _call_async(
+        self,
+        fn: Callable[[Optional[float]], Awaitable[T]],
+        tokens: int,
+        timeout: Optional[float],
+    ) -> T:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            wait = self._admit(tokens, deadline)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                result = await fn(self._attempt_timeout(deadline))
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded(result, tokens)
+            return result
+
+
+groq_governor = Governor("groq", GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE)
+openai_governor = Governor("openai", OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
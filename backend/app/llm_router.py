@@ -0,0 +1,439 @@
+# app/llm_router.py
+"""
+One entry point for chat completions, routed across the configured LLM
+providers (Groq and OpenAI; LLM_PROVIDERS sets the order, a provider needs
+its API key to take part).
+
+- Each provider keeps rolling results for the last LLM_ROUTER_WINDOW_SECONDS:
+  latency of successful calls (queueing and retries included) and the error
+  rate. Calls go to the fastest healthy provider by median latency. Healthy
+  means a closed circuit, some rate budget left and an error rate below
+  LLM_ROUTER_MAX_ERROR_RATE. A provider with fewer than
+  LLM_ROUTER_MIN_SAMPLES results is tried first, so it gets measured.
+- A call that fails on one provider (refused by its governor, or failed
+  after the governor's retries) moves on to the next one.
+- Hedging (complete_async(hedge=True), for calls a user is waiting on): if
+  the first provider hasn't answered by its p95 latency, the same request
+  goes to the next provider too. The first answer wins and the other call
+  is cancelled.
+- Rate limits, retries and circuit breaking stay with each provider's
+  Governor (llm_governor.py).
+- stats() has calls, wins, hedges, failures, tokens and estimated spend
+  per provider (exported on /metrics, see main.py).
+- A Completion names the provider and model that wrote it (its `source`);
+  cached model output is keyed by that, not by whichever provider comes first.
+
+Prompts are sized for the Groq model's input budget (prompt_builder.py),
+which is the smaller one.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from groq import AsyncGroq, Groq
+from openai import AsyncOpenAI, OpenAI
+
+from .config import (
+    GROQ_API_KEY,
+    GROQ_BASE_URL,
+    GROQ_MODEL,
+    LLM_HEDGE_DEFAULT_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_SECONDS,
+    LLM_PROVIDERS,
+    LLM_ROUTER_MAX_ERROR_RATE,
+    LLM_ROUTER_MIN_SAMPLES,
+    LLM_ROUTER_WINDOW_SECONDS,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_MODEL,
+)
+from .llm_governor import Governor, LLMUnavailable, estimate_tokens, groq_governor, openai_governor
+from .metrics import record_llm_usage
+
+# USD per million (prompt, completion) tokens, for the spend estimate.
+PRICES_PER_MILLION_TOKENS = {
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Results kept per provider at most, however busy the window
+_MAX_SAMPLES = 1000
+
+
+class Completion(NamedTuple):
+    text: str
+    provider: str
+    model: str
+
+    @property
+    def source(self) -> str:
+        """"provider:model", what the caches record as the model that wrote a text."""
+        return f"{self.provider}:{self.model}"
+
+
+class Provider:
+    """One chat-completions backend: its clients, model, governor and rolling results."""
+
+    def __init__(self, name: str, model: str, governor: Governor, client: Any, async_client: Any):
+        self.name = name
+        self.model = model
+        self.governor = governor
+        self.client = client
+        self.async_client = async_client
+        self._lock = threading.Lock()
+        # (time, latency or None for a failure)
+        self._results: Deque[Tuple[float, Optional[float]]] = deque(maxlen=_MAX_SAMPLES)
+        self._counts = {
+            "calls": 0, "wins": 0, "failures": 0, "hedges": 0, "hedge_wins": 0, "cancelled": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "spend_usd": 0.0,
+        }
+
+    def _recent(self) -> List[Optional[float]]:
+        cutoff = time.monotonic() - LLM_ROUTER_WINDOW_SECONDS
+        while self._results and self._results[0][0] < cutoff:
+            self._results.popleft()
+        return [latency for _, latency in self._results]
+
+    def count(self, key: str, n: float = 1):
+        with self._lock:
+            self._counts[key] += n
+
+    def record(self, latency: Optional[float]):
+        """A finished call: its latency, or None if it failed."""
+        with self._lock:
+            self._results.append((time.monotonic(), latency))
+            self._counts["calls"] += 1
+            if latency is None:
+                self._counts["failures"] += 1
+
+    def record_usage(self, usage: Any):
+        """Count the tokens (and their price) a response reports. The per-user token metrics are the governor's."""
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        prompt_price, completion_price = PRICES_PER_MILLION_TOKENS.get(self.model, (0.0, 0.0))
+        with self._lock:
+            self._counts["prompt_tokens"] += prompt
+            self._counts["completion_tokens"] += completion
+            self._counts["spend_usd"] += (prompt * prompt_price + completion * completion_price) / 1e6
+
+    def latency(self, pct: float) -> Optional[float]:
+        """Latency percentile of recent successful calls; None without enough of them."""
+        with self._lock:
+            latencies = sorted(x for x in self._recent() if x is not None)
+        if len(latencies) < LLM_ROUTER_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            recent = self._recent()
+        if len(recent) < LLM_ROUTER_MIN_SAMPLES:
+            return 0.0
+        return sum(1 for x in recent if x is None) / len(recent)
+
+    def healthy(self) -> bool:
+        return self.governor.headroom() > 0 and self.error_rate() <= LLM_ROUTER_MAX_ERROR_RATE
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return dict(
+            counts,
+            model=self.model,
+            p50=self.latency(50),
+            p95=self.latency(95),
+            error_rate=self.error_rate(),
+            healthy=self.healthy(),
+        )
+
+    def request_kwargs(self, system_prompt: str, user_prompt: str, max_tokens: int, json_mode: bool) -> Dict[str, Any]:
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.append({"role": "user", "content": user_prompt})
+        kwargs: Dict[str, Any] = dict(model=self.model, messages=messages, temperature=0.4, max_tokens=max_tokens)
+        if json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def stream_kwargs(self) -> Dict[str, Any]:
+        # Groq puts usage on the last chunk by itself (chunk.x_groq.usage)
+        return {"stream_options": {"include_usage": True}} if self.name == "openai" else {}
+
+
+def _chunk_usage(chunk: Any) -> Any:
+    return getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+
+def _chunk_text(chunk: Any) -> str:
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+class Router:
+    def __init__(self, providers: List[Provider]):
+        self.providers = providers
+
+    def available(self) -> bool:
+        return bool(self.providers)
+
+    def sources(self) -> List[str]:
+        """Completion.source of every configured provider."""
+        return [f"{p.name}:{p.model}" for p in self.providers]
+
+    def ranked(self) -> List[Provider]:
+        """Providers to try, in order: healthy before unhealthy, faster (or unmeasured) first."""
+        def key(provider: Provider):
+            p50 = provider.latency(50)
+            return (not provider.healthy(), 0.0 if p50 is None else p50)
+        return sorted(self.providers, key=key)
+
+    def headroom(self) -> float:
+        """Largest share of rate budget free at any provider (0 with none configured)."""
+        return max((p.governor.headroom() for p in self.providers), default=0.0)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {p.name: p.stats() for p in self.providers}
+
+    def _first(self) -> List[Provider]:
+        ranked = self.ranked()
+        if not ranked:
+            raise LLMUnavailable("no LLM provider configured")
+        return ranked
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _attempt(self, provider: Provider, kwargs: Dict[str, Any], tokens: int, timeout: Optional[float]) -> Completion:
+        start = time.monotonic()
+
+        def request(attempt_timeout: Optional[float]):
+            extra = {"timeout": attempt_timeout} if attempt_timeout is not None else {}
+            return provider.client.chat.completions.create(**kwargs, **extra)
+
+        try:
+            resp = provider.governor.call(request, tokens=tokens, timeout=timeout)
+        except Exception:
+            provider.record(None)
+            raise
+        provider.record(time.monotonic() - start)
+        provider.record_usage(getattr(resp, "usage", None))
+        return Completion((resp.choices[0].message.content or "").strip(), provider.name, provider.model)
+
+    async def _attempt_async(
+        self,
+        provider: Provider,
+        kwargs: Dict[str, Any],
+        tokens: int,
+        timeout: Optional[float],
+    ) -> Completion:
+        start = time.monotonic()
+
+        def request(attempt_timeout: Optional[float]):
+            extra = {"timeout": attempt_timeout} if attempt_timeout is not None else {}
+            return provider.async_client.chat.completions.create(**kwargs, **extra)
+
+        try:
+            resp = await provider.governor.call_async(request, tokens=tokens, timeout=timeout)
+        except asyncio.CancelledError:
+            # Lost a hedge race; says nothing about the provider
+            provider.count("cancelled")
+            raise
+        except Exception:
+            provider.record(None)
+            raise
+        provider.record(time.monotonic() - start)
+        provider.record_usage(getattr(resp, "usage", None))
+        return Completion((resp.choices[0].message.content or "").strip(), provider.name, provider.model)
+
+    def complete(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 256,
+        timeout: Optional[float] = None,
+        json_mode: bool = False,
+    ) -> Completion:
+        """
+        One chat completion from the best provider, falling back to the others.
+        `timeout` bounds the whole call. Raises LLMUnavailable when every
+        provider refused or failed.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        tokens = estimate_tokens(system_prompt, user_prompt, max_tokens=max_tokens)
+        errors = []
+        for provider in self._first():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            kwargs = provider.request_kwargs(system_prompt, user_prompt, max_tokens, json_mode)
+            try:
+                result = self._attempt(provider, kwargs, tokens, self._remaining(deadline))
+            except Exception as e:
+                print(f"LLM router: {provider.name} failed:", repr(e))
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.count("wins")
+            return result
+        raise LLMUnavailable("; ".join(errors) or "no time left")
+
+    def _hedge_delay(self, provider: Provider) -> float:
+        p95 = provider.latency(95)
+        return max(LLM_HEDGE_MIN_SECONDS, LLM_HEDGE_DEFAULT_SECONDS if p95 is None else p95)
+
+    async def complete_async(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 256,
+        timeout: Optional[float] = None,
+        json_mode: bool = False,
+        hedge: bool = False,
+    ) -> Completion:
+        """
+        Async complete(). With `hedge`, a call still running after the
+        provider's p95 latency is raced against the next provider.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        tokens = estimate_tokens(system_prompt, user_prompt, max_tokens=max_tokens)
+        waiting = self._first()
+        running: Dict["asyncio.Task[Completion]", Provider] = {}
+        hedged = set()
+        errors = []
+
+        def launch(provider: Provider):
+            kwargs = provider.request_kwargs(system_prompt, user_prompt, max_tokens, json_mode)
+            task = asyncio.ensure_future(self._attempt_async(provider, kwargs, tokens, self._remaining(deadline)))
+            running[task] = provider
+
+        launch(waiting.pop(0))
+        try:
+            while running:
+                hedge_at = None
+                if hedge and LLM_HEDGE_ENABLED and waiting and not hedged:
+                    hedge_at = self._hedge_delay(next(iter(running.values())))
+                    if deadline is not None:
+                        hedge_at = min(hedge_at, self._remaining(deadline))
+                done, _ = await asyncio.wait(running, timeout=hedge_at, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+                    provider = waiting.pop(0)
+                    provider.count("hedges")
+                    hedged.add(provider.name)
+                    launch(provider)
+                    continue
+
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        print(f"LLM router: {provider.name} failed:", repr(e))
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    provider.count("wins")
+                    if provider.name in hedged:
+                        provider.count("hedge_wins")
+                    return result
+
+                # Everything in flight failed: move on to the next provider
+                if not running and waiting and (deadline is None or time.monotonic() < deadline):
+                    launch(waiting.pop(0))
+        finally:
+            for task in running:
+                task.cancel()
+        raise LLMUnavailable("; ".join(errors) or "no time left")
+
+    def stream(self, system_prompt: str, user_prompt: str, max_tokens: int = 256) -> Iterator[str]:
+        """
+        Stream a completion as text pieces. Providers are tried in turn until
+        one starts a stream; after the first piece there is no fallback.
+        """
+        tokens = estimate_tokens(system_prompt, user_prompt, max_tokens=max_tokens)
+        errors = []
+        for provider in self._first():
+            kwargs = dict(provider.request_kwargs(system_prompt, user_prompt, max_tokens, False), stream=True)
+            kwargs.update(provider.stream_kwargs())
+            start = time.monotonic()
+            try:
+                stream = provider.governor.call(lambda _timeout: provider.client.chat.completions.create(**kwargs), tokens=tokens)
+            except Exception as e:
+                provider.record(None)
+                print(f"LLM router: {provider.name} stream failed:", repr(e))
+                errors.append(f"{provider.name}: {e}")
+                continue
+            # A stream's latency is the time until it opens, not its length: that lasts as long as the reply
+            provider.record(time.monotonic() - start)
+            provider.count("wins")
+            for chunk in stream:
+                usage = _chunk_usage(chunk)
+                # The governor only sees the stream object, not the usage at its end
+                record_llm_usage(provider.name, usage)
+                provider.record_usage(usage)
+                text = _chunk_text(chunk)
+                if text:
+                    yield text
+            return
+        raise LLMUnavailable("; ".join(errors))
+
+    async def stream_async(self, system_prompt: str, user_prompt: str, max_tokens: int = 256) -> AsyncIterator[str]:
+        """Async stream()."""
+        tokens = estimate_tokens(system_prompt, user_prompt, max_tokens=max_tokens)
+        errors = []
+        for provider in self._first():
+            kwargs = dict(provider.request_kwargs(system_prompt, user_prompt, max_tokens, False), stream=True)
+            kwargs.update(provider.stream_kwargs())
+            start = time.monotonic()
+            try:
+                stream = await provider.governor.call_async(
+                    lambda _timeout: provider.async_client.chat.completions.create(**kwargs), tokens=tokens
+                )
+            except Exception as e:
+                provider.record(None)
+                print(f"LLM router: {provider.name} stream failed:", repr(e))
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.record(time.monotonic() - start)
+            provider.count("wins")
+            async for chunk in stream:
+                usage = _chunk_usage(chunk)
+                record_llm_usage(provider.name, usage)
+                provider.record_usage(usage)
+                text = _chunk_text(chunk)
+                if text:
+                    yield text
+            return
+        raise LLMUnavailable("; ".join(errors))
+
+
+def _configured_providers() -> List[Provider]:
+    # Retries are done by the governors, not the SDKs.
+    factories = {}
+    if GROQ_API_KEY:
+        factories["groq"] = lambda: Provider(
+            "groq", GROQ_MODEL, groq_governor,
+            Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0),
+            AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0),
+        )
+    if OPENAI_API_KEY:
+        factories["openai"] = lambda: Provider(
+            "openai", OPENAI_MODEL, openai_governor,
+            OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0),
+            AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0),
+        )
+    names = [n.strip() for n in LLM_PROVIDERS.split(",") if n.strip()]
+    providers = [factories[n]() for n in names if n in factories]
+    if not providers:
+        print("WARNING: no LLM provider configured (GROQ_API_KEY / OPENAI_API_KEY). AI features will be degraded.")
+    return providers
+
+
+llm_router = Router(_configured_providers())
@@ -0,0 +1,245 @@
+# app/mail_sync.py
+"""
+Incremental mailbox sync into the local `messages` table.
+
+The first sync for a user lists the newest inbox messages, fetches them with
+batched messages.get and remembers the mailbox historyId. Later syncs call
+users.history.list from that historyId and only apply what changed:
+- messagesAdded   -> fetch and store the new inbox messages
+- messagesDeleted -> delete them locally
+- labelsAdded / labelsRemoved -> update stored labels (fetching messages
+  that just moved into the inbox)
+If Gmail reports the stored historyId as too old (HTTP 404), we fall back to
+a full resync. New messages that could not be fetched are kept in
+sync_retries and fetched again by the next syncs (up to
+SYNC_FETCH_MAX_ATTEMPTS), since the historyId has already moved past them.
+
+Listing endpoints then read from the local store instead of making one
+Gmail round trip per message. With PREFETCH_ENABLED, newly stored inbox
+messages are also queued for a background summary (prefetch.py).
+"""
+
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from googleapiclient.errors import HttpError
+
+from . import db
+from .config import (
+    MESSAGE_BODY_MAX_CHARS,
+    PREFETCH_ENABLED,
+    PREFETCH_FULL_SYNC_DEPTH,
+    SYNC_FETCH_MAX_ATTEMPTS,
+    SYNC_FULL_SYNC_SIZE,
+    SYNC_MIN_INTERVAL_SECONDS,
+)
+from .gmail_service import batch_get_messages, get_attachment_data, get_header
+from .metrics import span
+from .mime_body import extract_body
+from .triage import TRIAGE_HEADERS
+
+# Sync locks, striped by email like auth_utils' refresh locks: a fixed pool,
+# so syncs of one user run one at a time without a lock per user ever seen.
+_USER_LOCK_STRIPES = 64
+_user_locks = [threading.Lock() for _ in range(_USER_LOCK_STRIPES)]
+
+
+def _user_lock(email: str) -> threading.Lock:
+    return _user_locks[hash(email) % _USER_LOCK_STRIPES]
+
+
+def message_to_row(
+    msg: Dict[str, Any],
+    fetch_attachment: Optional[Callable[[str], Optional[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    Turn a Gmail format=full message into a stored row.
+    `fetch_attachment` loads bodies Gmail stores as attachments (see mime_body.extract_body).
+    """
+    headers = msg.get("payload", {}).get("headers", [])
+    triage_headers = {name: get_header(headers, name) for name in TRIAGE_HEADERS}
+    with span("body_extract"):
+        body = extract_body(msg, max_chars=MESSAGE_BODY_MAX_CHARS, fetch_attachment=fetch_attachment)
+    return {
+        "id": msg["id"],
+        "thread_id": msg.get("threadId"),
+        "label_ids": msg.get("labelIds", []) or [],
+        "subject": get_header(headers, "Subject") or "(no subject)",
+        "from": get_header(headers, "From"),
+        "snippet": msg.get("snippet", ""),
+        "body": body,
+        "internal_date": int(msg.get("internalDate") or 0),
+        "headers": {name: value for name, value in triage_headers.items() if value},
+    }
+
+
+def _fetch_rows(service, message_ids: List[str]) -> List[Dict[str, Any]]:
+    fetched = batch_get_messages(service, message_ids)
+    rows = []
+    for msg_id in message_ids:
+        msg = fetched.get(msg_id)
+        if not msg:
+            continue
+        try:
+            rows.append(message_to_row(msg, partial(get_attachment_data, service, msg_id)))
+        except Exception as e:
+            print(f"mail_sync: failed to parse message {msg_id}", e)
+    return rows
+
+
+def _save_retries(email: str, to_fetch: List[str], rows: List[Dict[str, Any]], attempts: Dict[str, int]):
+    """Keep the ids of `to_fetch` that didn't come back for the next sync, counting their attempts."""
+    got = {row["id"] for row in rows}
+    retries = {}
+    for mid in to_fetch:
+        if mid in got:
+            continue
+        n = attempts.get(mid, 0) + 1
+        if n < SYNC_FETCH_MAX_ATTEMPTS:
+            retries[mid] = n
+        else:
+            print(f"mail_sync: giving up on message {mid} for {email} after {n} attempts")
+    db.replace_sync_retries(email, retries)
+
+
+def _queue_summaries(email: str, rows: List[Dict[str, Any]], limit: Optional[int] = None):
+    """Queue the newest `limit` (default all) inbox rows for a prefetched summary."""
+    if not PREFETCH_ENABLED:
+        return
+    inbox = sorted(
+        (r for r in rows if "INBOX" in (r.get("label_ids") or [])),
+        key=lambda r: r.get("internal_date") or 0,
+        reverse=True,
+    )
+    try:
+        db.enqueue_summary_jobs(email, [r["id"] for r in inbox[:limit]])
+    except Exception as e:
+        # Only a prefetch: the summaries are still made on demand.
+        print(f"mail_sync: failed to queue summaries for {email}", e)
+
+
+def full_sync(email: str, service, size: int = SYNC_FULL_SYNC_SIZE) -> Dict[str, int]:
+    """Replace the local copy with the newest `size` inbox messages."""
+    # Read the historyId first so changes made while we list are replayed next time.
+    with span("gmail_profile"):
+        history_id = service.users().getProfile(userId="me").execute().get("historyId")
+
+    ids: List[str] = []
+    page_token: Optional[str] = None
+    while len(ids) < size:
+        with span("gmail_list"):
+            resp = (
+                service.users()
+                .messages()
+                .list(userId="me", labelIds=["INBOX"], maxResults=min(500, size - len(ids)), pageToken=page_token)
+                .execute()
+            )
+        ids.extend(m["id"] for m in resp.get("messages", []) or [] if m.get("id"))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+    rows = _fetch_rows(service, ids)
+    db.replace_messages(email, rows)
+    _save_retries(email, ids, rows, {})
+    db.save_sync_state(email, history_id)
+    _queue_summaries(email, rows, PREFETCH_FULL_SYNC_DEPTH)
+    return {"full": 1, "added": len(rows), "deleted": 0, "relabeled": 0}
+
+
+def _read_history(service, start_history_id: str):
+    """All history records since start_history_id, plus the mailbox's current historyId."""
+    records: List[Dict[str, Any]] = []
+    page_token: Optional[str] = None
+    latest = start_history_id
+    while True:
+        with span("gmail_history"):
+            resp = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"],
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+        records.extend(resp.get("history", []) or [])
+        latest = resp.get("historyId", latest)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return records, latest
+
+
+def incremental_sync(email: str, service, start_history_id: str) -> Dict[str, int]:
+    records, latest = _read_history(service, start_history_id)
+
+    # Replay records in order, keeping only each message's final state.
+    added: Dict[str, List[str]] = {}
+    deleted = set()
+    labels: Dict[str, List[str]] = {}
+    for record in records:
+        for item in record.get("messagesAdded", []) or []:
+            msg = item.get("message", {})
+            if msg.get("id"):
+                added[msg["id"]] = msg.get("labelIds", []) or []
+                deleted.discard(msg["id"])
+        for item in record.get("messagesDeleted", []) or []:
+            msg_id = item.get("message", {}).get("id")
+            if msg_id:
+                deleted.add(msg_id)
+                added.pop(msg_id, None)
+                labels.pop(msg_id, None)
+        for kind in ("labelsAdded", "labelsRemoved"):
+            for item in record.get(kind, []) or []:
+                msg = item.get("message", {})
+                if msg.get("id") and msg["id"] not in deleted:
+                    # `message.labelIds` is the full label set after the change
+                    labels[msg["id"]] = msg.get("labelIds", []) or []
+
+    attempts = db.get_sync_retries(email)
+    stored = db.get_stored_message_ids(email, [*labels, *attempts])
+    # An added message's labels may have changed later in the same window.
+    to_fetch = [mid for mid, lbls in added.items() if "INBOX" in labels.get(mid, lbls)]
+    to_fetch += [mid for mid, lbls in labels.items() if mid not in stored and mid not in added and "INBOX" in lbls]
+    # Earlier failures, unless they have since been deleted or left the inbox
+    to_fetch += [
+        mid for mid in attempts
+        if mid not in stored and mid not in added and mid not in labels and mid not in deleted
+    ]
+    relabel = {mid: lbls for mid, lbls in labels.items() if mid in stored}
+
+    rows = _fetch_rows(service, to_fetch)
+    db.upsert_messages(email, rows)
+    _save_retries(email, to_fetch, rows, attempts)
+    db.update_message_labels(email, relabel)
+    db.delete_messages(email, deleted)
+    db.save_sync_state(email, latest)
+    _queue_summaries(email, rows)
+    return {"full": 0, "added": len(rows), "deleted": len(deleted), "relabeled": len(relabel)}
+
+
+def sync_mailbox(email: str, service, force: bool = False) -> Dict[str, int]:
+    """
+    Bring the local copy of a user's mailbox up to date.
+    Skipped if the last sync finished less than SYNC_MIN_INTERVAL_SECONDS ago
+    (unless `force`). Concurrent calls for one user run one at a time.
+    """
+    with _user_lock(email):
+        state = db.get_sync_state(email)
+        if state is None:
+            return full_sync(email, service)
+
+        if not force and time.time() - state["synced_at"] < SYNC_MIN_INTERVAL_SECONDS:
+            return {"full": 0, "added": 0, "deleted": 0, "relabeled": 0}
+
+        try:
+            return incremental_sync(email, service, state["history_id"])
+        except HttpError as e:
+            if getattr(e, "resp", None) is not None and e.resp.status == 404:
+                print(f"mail_sync: historyId expired for {email}, doing a full resync")
+                return full_sync(email, service)
+            raise
@@ -1,11 +1,20 @@
 # app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from .routers import auth, gmail
-from .config import FRONTEND_BASE_URL
+from .config import FRONTEND_BASE_URL, METRICS_TOKEN, OUTBOX_IN_APP, PREFETCH_ENABLED, PREFETCH_IN_APP
 
 # import db to initialize on startup
 from . import db as db_module
+from . import message_cache, metrics, prompt_builder, reply_drafts, summary_cache, summary_dedup, triage
+from .auth_utils import credential_refresher
+from .gmail_async import close_client
+from .llm_governor import groq_governor, openai_governor
+from .llm_router import llm_router
+from .outbox import outbox_worker
+from .prefetch import prefetch_worker
+from .routers.ai import CACHE_MODELS, SUMMARY_PROMPT_VERSION
 
 app = FastAPI(title="AI Email Assistant - Backend")
 
@@ -25,13 +34,202 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON listings; event streams are left alone by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# Outermost, so the request histogram and Server-Timing cover everything
+app.add_middleware(metrics.TimingMiddleware)
+
 app.include_router(auth.router, prefix="/auth")
 app.include_router(gmail.router, prefix="/gmail")
 
+
+def _governor_samples():
+    for governor in (groq_governor, openai_governor):
+        stats = governor.stats()
+        for outcome in ("calls", "retries", "throttled", "rejected", "failures"):
+            yield (governor.name, outcome), stats[outcome]
+
+
+def _circuit_samples():
+    for governor in (groq_governor, openai_governor):
+        yield (governor.name,), 0 if governor.breaker.state == "closed" else 1
+
+
+def _router_samples():
+    for name, stats in llm_router.stats().items():
+        for event in ("calls", "wins", "failures", "hedges", "hedge_wins", "cancelled"):
+            yield (name, stats["model"], event), stats[event]
+
+
+def _router_win_rate_samples():
+    providers = llm_router.stats()
+    total = sum(stats["wins"] for stats in providers.values())
+    for name, stats in providers.items():
+        yield (name, stats["model"]), stats["wins"] / total if total else 0
+
+
+def _router_latency_samples():
+    for name, stats in llm_router.stats().items():
+        for quantile in ("p50", "p95"):
+            if stats[quantile] is not None:
+                yield (name, stats["model"], quantile), stats[quantile]
+
+
+def _cache_samples():
+    summaries = summary_cache.stats()
+    yield ("summary", "hit"), summaries["memory_hits"] + summaries["db_hits"]
+    yield ("summary", "miss"), summaries["misses"]
+    messages = message_cache.stats()
+    yield ("message", "hit"), messages["hits"]
+    yield ("message", "miss"), messages["misses"]
+
+
+def _prefetch_samples():
+    for event, count in prefetch_worker.stats().items():
+        yield (event,), count
+
+
+def _outbox_samples():
+    for event, count in outbox_worker.stats().items():
+        yield (event,), count
+
+
+def _outbox_backlog_samples():
+    counts = db_module.count_outbox()
+    for status in ("queued", "sending"):
+        yield (status,), counts.get(status, 0)
+
+
+def _reply_draft_samples():
+    for event, count in reply_drafts.stats().items():
+        yield (event,), count
+
+
+def _summary_dedup_samples():
+    shared = summary_dedup.stats()
+    yield ("exact",), shared["exact"]
+    yield ("near",), shared["near"]
+
+
+def _triage_samples():
+    for category, count in triage.stats()["categories"].items():
+        yield (category, triage.routes[category]), count
+
+
+def _prompt_token_samples():
+    prompts = prompt_builder.stats()
+    yield ("original",), prompts["tokens_original"]
+    yield ("sent",), prompts["tokens_sent"]
+
+
+metrics.register_collector(
+    "email_assistant_llm_governor_total", "LLM governor events by provider.", "counter",
+    ("provider", "event"), _governor_samples,
+)
+metrics.register_collector(
+    "email_assistant_llm_circuit_open", "1 while the provider's circuit breaker is not closed.", "gauge",
+    ("provider",), _circuit_samples,
+)
+metrics.register_collector(
+    "email_assistant_llm_router_total", "LLM router events by provider and model.", "counter",
+    ("provider", "model", "event"), _router_samples,
+)
+metrics.register_collector(
+    "email_assistant_llm_win_rate", "Share of answered LLM calls each provider answered.", "gauge",
+    ("provider", "model"), _router_win_rate_samples,
+)
+metrics.register_collector(
+    "email_assistant_llm_latency_seconds", "Rolling LLM call latency the router ranks providers by.", "gauge",
+    ("provider", "model", "quantile"), _router_latency_samples,
+)
+metrics.register_collector(
+    "email_assistant_llm_spend_usd_total", "Estimated LLM spend from reported token usage.", "counter",
+    ("provider", "model"), lambda: [((n, s["model"]), s["spend_usd"]) for n, s in llm_router.stats().items()],
+)
+metrics.register_collector(
+    "email_assistant_cache_lookups_total", "Summary and message cache lookups.", "counter",
+    ("cache", "result"), _cache_samples,
+)
+metrics.register_collector(
+    "email_assistant_prefetch_total", "Summary prefetch worker events in this process.", "counter",
+    ("event",), _prefetch_samples,
+)
+metrics.register_collector(
+    "email_assistant_prefetch_backlog", "Messages waiting for a prefetched summary.", "gauge",
+    (), lambda: [((), db_module.count_summary_jobs())],
+)
+metrics.register_collector(
+    "email_assistant_outbox_total", "Reply outbox worker events in this process.", "counter",
+    ("event",), _outbox_samples,
+)
+metrics.register_collector(
+    "email_assistant_outbox_backlog", "Replies waiting to be sent, by status.", "gauge",
+    ("status",), _outbox_backlog_samples,
+)
+metrics.register_collector(
+    "email_assistant_reply_drafts_total", "Speculative reply draft events in this process.", "counter",
+    ("event",), _reply_draft_samples,
+)
+metrics.register_collector(
+    "email_assistant_summaries_shared_total", "Summaries reused from duplicate mail instead of a model call.", "counter",
+    ("match",), _summary_dedup_samples,
+)
+metrics.register_collector(
+    "email_assistant_triage_total", "Messages triaged before summarizing, by category and route.", "counter",
+    ("category", "route"), _triage_samples,
+)
+metrics.register_collector(
+    "email_assistant_triage_llm_skipped_total", "Emails given an extractive summary instead of a model call.",
+    "counter", (), lambda: [((), triage.stats()["llm_skipped"])],
+)
+metrics.register_collector(
+    "email_assistant_prompt_body_tokens_total", "Estimated email body tokens before and after prompt preparation.",
+    "counter", ("kind",), _prompt_token_samples,
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    """Prometheus metrics for this process."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.on_event("startup")
 def startup_event():
+    credential_refresher.start()
+
     try:
         db_module.init_db()
-        print("DB initialized (tokens table ensured).")
+        print("DB initialized (tables ensured).")
     except Exception as e:
         print("DB init failed:", e)
+        return
+
+    # Summaries made by a model no longer configured, or another prompt
+    # version, can't be served any more (with no provider, keep them all)
+    removed = summary_cache.invalidate_stale(CACHE_MODELS, SUMMARY_PROMPT_VERSION) if CACHE_MODELS else 0
+    if removed:
+        print(f"Summary cache: dropped {removed} stale entries.")
+
+    # Mail stored before search existed (a no-op afterwards)
+    try:
+        indexed = db_module.index_unindexed_messages()
+        if indexed:
+            print(f"Search index: indexed {indexed} stored messages.")
+    except Exception as e:
+        print("Search index backfill failed:", e)
+
+    if PREFETCH_ENABLED and PREFETCH_IN_APP:
+        prefetch_worker.start()
+    if OUTBOX_IN_APP:
+        outbox_worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    credential_refresher.stop()
+    prefetch_worker.stop()
+    outbox_worker.stop()
+    await close_client()
@@ -0,0 +1,115 @@
+# app/message_cache.py
+"""
+Per-user, memory-bounded cache of parsed Gmail messages.
+
+/last5 already downloads and parses every message it shows; the reply,
+send and body routes reuse those records instead of calling
+messages.get(format="full") and parsing the payload again.
+
+Records are compact ParsedMessage tuples (no raw Gmail JSON). Each user gets
+a byte budget (MESSAGE_CACHE_USER_BYTES) with size-aware LRU eviction, and
+at most MESSAGE_CACHE_MAX_USERS users are kept.
+"""
+
+import sys
+import threading
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from cachetools import LRUCache
+
+from .config import MESSAGE_CACHE_MAX_USERS, MESSAGE_CACHE_USER_BYTES
+
+
+class ParsedMessage(NamedTuple):
+    id: str
+    thread_id: Optional[str]
+    subject: str
+    from_line: str
+    snippet: str
+    body: str
+    label_ids: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "ParsedMessage":
+        """Build from the row shape used by mail_sync / db (id, thread_id, from, ...)."""
+        return cls(
+            id=row["id"],
+            thread_id=row.get("thread_id"),
+            subject=row.get("subject") or "(no subject)",
+            from_line=row.get("from") or "",
+            snippet=row.get("snippet") or "",
+            body=row.get("body") or "",
+            label_ids=tuple(row.get("label_ids") or ()),
+        )
+
+
+def _record_size(record: ParsedMessage) -> int:
+    """Approximate bytes held by a record (tuple + its strings)."""
+    size = sys.getsizeof(record)
+    for value in record:
+        if isinstance(value, tuple):
+            size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+        elif value is not None:
+            size += sys.getsizeof(value)
+    return size
+
+
+_lock = threading.Lock()
+_users: "LRUCache[str, LRUCache]" = LRUCache(maxsize=max(1, MESSAGE_CACHE_MAX_USERS))
+_stats = {"hits": 0, "misses": 0, "skipped_oversize": 0}
+
+
+def _user_cache(email: str, create: bool) -> Optional[LRUCache]:
+    cache = _users.get(email)
+    if cache is None and create:
+        cache = LRUCache(maxsize=max(1, MESSAGE_CACHE_USER_BYTES), getsizeof=_record_size)
+        _users[email] = cache
+    return cache
+
+
+def get(email: str, message_id: str) -> Optional[ParsedMessage]:
+    with _lock:
+        cache = _user_cache(email, create=False)
+        record = cache.get(message_id) if cache is not None else None
+        _stats["hits" if record is not None else "misses"] += 1
+        return record
+
+
+def put(email: str, record: ParsedMessage):
+    if not email:
+        return
+    with _lock:
+        cache = _user_cache(email, create=True)
+        try:
+            cache[record.id] = record
+        except ValueError:
+            # Larger than the whole per-user budget: don't cache it.
+            _stats["skipped_oversize"] += 1
+
+
+def put_many(email: str, records: Iterable[ParsedMessage]):
+    for record in records:
+        put(email, record)
+
+
+def invalidate(email: str, message_ids: Iterable[str]):
+    with _lock:
+        cache = _user_cache(email, create=False)
+        if cache is None:
+            return
+        for message_id in message_ids:
+            cache.pop(message_id, None)
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters and current memory use for this process."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(
+            _stats,
+            hit_rate=round(_stats["hits"] / lookups, 3) if lookups else None,
+            users=len(_users),
+            entries=sum(len(c) for c in _users.values()),
+            bytes=sum(c.currsize for c in _users.values()),
+            user_budget_bytes=MESSAGE_CACHE_USER_BYTES,
+        )
@@ -0,0 +1,222 @@
+# app/metrics.py
+"""
+Request-stage timing and Prometheus metrics.
+
+- span("stage") times a block (JWT decode, token lookup/refresh, discovery
+  build, Gmail calls, body extraction, LLM calls, ...). Every span goes into
+  the email_assistant_stage_seconds histogram. Inside a request it is also
+  listed in that response's Server-Timing header, with durations summed
+  per stage (so overlapping concurrent calls can add up to more than the
+  total).
+- TimingMiddleware sets up the per-request span list, adds the
+  Server-Timing header and observes email_assistant_request_seconds by
+  route template.
+- record_llm_usage() counts prompt/completion tokens per user and provider.
+  The user is the one whose session JWT the current request carries
+  (set_user(), called by auth_utils).
+- register_collector() adds samples computed at scrape time (governor and
+  cache counters, see main.py). render() is the /metrics text.
+
+No client library: the text exposition format is simple enough, and this
+keeps the backend's dependencies as they are.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits (sub-millisecond) up to slow LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("stage_timings", default=None)
+_user: ContextVar[Optional[str]] = ContextVar("metrics_user", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(self.label_names, k)} {_number(v)}" for k, v in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="{}"'.format("+Inf" if bound == float("inf") else _number(bound))
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, labels, le)} {int(cumulative)}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, labels)} {int(cumulative)}")
+        return lines
+
+
+stage_seconds = Histogram("email_assistant_stage_seconds", "Time spent in one stage of a request.", ("stage",))
+request_seconds = Histogram(
+    "email_assistant_request_seconds", "HTTP request duration by route.", ("method", "route", "status")
+)
+llm_tokens = Counter("email_assistant_llm_tokens_total", "LLM tokens used, by user.", ("user", "provider", "kind"))
+
+_metrics: List[Any] = [stage_seconds, request_seconds, llm_tokens]
+_collectors: List[Tuple[str, str, str, Sequence[str], Callable[[], Iterable[Tuple[Labels, float]]]]] = []
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe((stage,), elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def set_user(email: Optional[str]):
+    """Attribute LLM usage in the current request to `email`."""
+    _user.set(email)
+
+
+def record_llm_usage(provider: str, usage: Any):
+    """Count the prompt/completion tokens of one response's `usage` (if it has any)."""
+    if usage is None:
+        return
+    user = _user.get() or "anonymous"
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            llm_tokens.inc((user, provider, kind), tokens)
+
+
+def register_collector(
+    name: str,
+    help_text: str,
+    kind: str,
+    label_names: Sequence[str],
+    collect: Callable[[], Iterable[Tuple[Labels, float]]],
+):
+    """Add a metric whose samples `collect()` computes at scrape time."""
+    _collectors.append((name, help_text, kind, tuple(label_names), collect))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _metrics:
+        lines += metric.render()
+    for name, help_text, kind, label_names, collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception as e:
+            print(f"metrics: collector {name} failed", e)
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_label_text(label_names, labels)} {_number(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing header value: summed milliseconds per stage, then the total."""
+    summed: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        summed[stage] = summed.get(stage, 0.0) + elapsed
+    entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in summed.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class TimingMiddleware:
+    """ASGI middleware: per-request spans, Server-Timing header and request histogram."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                header = server_timing(timings, time.perf_counter() - start).encode("latin-1")
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")
+            request_seconds.observe(
+                (scope.get("method", ""), getattr(route, "path", "unmatched"), str(status["code"])),
+                time.perf_counter() - start,
+            )
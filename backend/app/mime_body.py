@@ -0,0 +1,305 @@
+# app/mime_body.py
+"""
+Body extraction from Gmail format=full message payloads.
+
+- Picks the best part. Inside multipart/alternative that is text/plain,
+  falling back to text/html when there's no plain part or it is only a
+  stub ("view this email in your browser"). In multipart/mixed or related
+  it is the first inline body part. Attachments (a filename or
+  Content-Disposition: attachment) are skipped, and forwarded
+  message/rfc822 parts are searched.
+- Honours the part's declared charset, falling back to UTF-8 for unknown
+  names; undecodable bytes are replaced rather than dropped. Gmail returns
+  transfer-decoded data, but a quoted-printable part that still carries
+  soft line breaks is decoded too.
+- Bodies Gmail stores separately (body.attachmentId instead of body.data)
+  are loaded through a caller-supplied fetch function.
+- Streams: base64url data is decoded chunk by chunk through an incremental
+  charset decoder into an incremental HTML-to-text parser (or straight
+  through for text/plain). It stops once `max_chars` of text are produced,
+  so a 2 MB newsletter costs about as much as its first few kilobytes.
+"""
+
+import base64
+import binascii
+import codecs
+import itertools
+import re
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# base64 characters decoded per step (a multiple of 4)
+_CHUNK_CHARS = 64 * 1024
+# HTML characters handed to the parser per step
+_PARSE_SLICE_CHARS = 8 * 1024
+
+# A text/plain alternative this much smaller than the HTML one is a stub.
+_PLAIN_STUB_BYTES = 200
+_PLAIN_STUB_RATIO = 20
+
+_CHARSET_RE = re.compile(r"""charset\s*=\s*["']?([^"';\s]+)""", re.I)
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SOFT_LINE_BREAK_RE = re.compile(rb"=\r?\n")
+
+
+def _headers(part: Dict[str, Any]) -> Dict[str, str]:
+    return {h.get("name", "").lower(): h.get("value", "") for h in part.get("headers", []) or []}
+
+
+def _mime_type(part: Dict[str, Any]) -> str:
+    return (part.get("mimeType") or "").lower()
+
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    disposition = _headers(part).get("content-disposition", "").lower()
+    return bool(part.get("filename")) or disposition.startswith("attachment")
+
+
+def _has_body(part: Dict[str, Any]) -> bool:
+    body = part.get("body") or {}
+    return bool(body.get("data") or body.get("attachmentId"))
+
+
+def _body_size(part: Dict[str, Any]) -> int:
+    body = part.get("body") or {}
+    return int(body.get("size") or len(body.get("data") or "") * 3 // 4)
+
+
+def _best_alternative(candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    plain = next((c for c in candidates if _mime_type(c) == "text/plain"), None)
+    html = next((c for c in candidates if _mime_type(c) == "text/html"), None)
+    if plain is not None and html is not None:
+        plain_size, html_size = _body_size(plain), _body_size(html)
+        if plain_size < _PLAIN_STUB_BYTES and plain_size * _PLAIN_STUB_RATIO < html_size:
+            return html
+    return plain or html or (candidates[0] if candidates else None)
+
+
+def select_body_part(part: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The MIME part holding the message body, or None."""
+    mime_type = _mime_type(part)
+    if mime_type.startswith("multipart/") or mime_type == "message/rfc822":
+        children = [p for p in part.get("parts", []) or [] if not _is_attachment(p)]
+        if mime_type == "multipart/alternative":
+            return _best_alternative([c for c in map(select_body_part, children) if c is not None])
+        for child in children:
+            found = select_body_part(child)
+            if found is not None:
+                return found
+        return None
+    if mime_type in ("text/plain", "text/html") and not _is_attachment(part) and _has_body(part):
+        return part
+    return None
+
+
+def part_charset(part: Dict[str, Any]) -> str:
+    """Declared charset of a part, as a Python codec name (utf-8 if missing or unknown)."""
+    match = _CHARSET_RE.search(_headers(part).get("content-type", ""))
+    name = match.group(1).lower() if match else "utf-8"
+    # "us-ascii" mail routinely contains UTF-8; UTF-8 is a superset anyway.
+    if name in ("us-ascii", "ascii"):
+        return "utf-8"
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return "utf-8"
+
+
+def pending_attachment_id(msg: Dict[str, Any]) -> Optional[str]:
+    """attachmentId of the body part if its data must be fetched separately."""
+    part = select_body_part(msg.get("payload") or {})
+    body = (part or {}).get("body") or {}
+    if body.get("data"):
+        return None
+    return body.get("attachmentId")
+
+
+def _iter_bytes(data: str) -> Iterator[bytes]:
+    """Decode base64url `data` a chunk at a time (Gmail may leave out the padding)."""
+    for start in range(0, len(data), _CHUNK_CHARS):
+        chunk = data[start:start + _CHUNK_CHARS]
+        if start + _CHUNK_CHARS >= len(data):
+            chunk += "=" * (-len(chunk) % 4)
+        yield base64.urlsafe_b64decode(chunk)
+
+
+def _undo_quoted_printable(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    carry = b""
+    for chunk in chunks:
+        chunk = carry + chunk
+        # an "=" in the last two bytes may be the start of an escape split across chunks
+        cut = chunk.rfind(b"=", max(0, len(chunk) - 2))
+        chunk, carry = (chunk[:cut], chunk[cut:]) if cut != -1 else (chunk, b"")
+        yield binascii.a2b_qp(chunk)
+    if carry:
+        yield binascii.a2b_qp(carry)
+
+
+class _TextSink:
+    """Collects text up to `max_chars`."""
+
+    def __init__(self, max_chars: Optional[int]):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.full = False
+
+    def emit(self, text: str):
+        if self.full or not text:
+            return
+        if self.max_chars is not None and self.length + len(text) >= self.max_chars:
+            text = text[:self.max_chars - self.length]
+            self.full = True
+        self.parts.append(text)
+        self.length += len(text)
+
+    def feed(self, text: str):
+        self.emit(text)
+
+    def close(self) -> str:
+        return "".join(self.parts)
+
+
+class _HTMLToText(HTMLParser):
+    """
+    Incremental HTML -> plain text. Block elements become line breaks,
+    <blockquote> content is prefixed with "> " (so it reads as quoted
+    history), and style/script/head content is dropped.
+    """
+
+    SKIP = {"style", "script", "head", "title", "noscript", "template"}
+    BLOCK = {
+        "p", "div", "br", "li", "tr", "table", "ul", "ol", "section", "article", "header",
+        "footer", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "dd", "dt", "pre", "blockquote",
+    }
+
+    def __init__(self, max_chars: Optional[int]):
+        super().__init__(convert_charrefs=True)
+        self.sink = _TextSink(max_chars)
+        self._skip = 0
+        self._quote = 0
+        self._pre = 0
+        self._line_start = True
+
+    @property
+    def full(self) -> bool:
+        return self.sink.full
+
+    def _newline(self):
+        if not self._line_start:
+            self.sink.emit("\n")
+            self._line_start = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag in self.BLOCK:
+            self._newline()
+            if tag == "blockquote":
+                self._quote += 1
+            elif tag == "pre":
+                self._pre += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK:
+            if tag == "blockquote":
+                self._quote = max(0, self._quote - 1)
+            elif tag == "pre":
+                self._pre = max(0, self._pre - 1)
+            self._newline()
+
+    def handle_data(self, data):
+        if self._skip or self.sink.full:
+            return
+        if self._pre:
+            lines = data.split("\n")
+        else:
+            lines = [_WHITESPACE_RE.sub(" ", data)]
+        for i, line in enumerate(lines):
+            if i:
+                self._newline()
+            if self._line_start:
+                line = line.lstrip()
+                if not line:
+                    continue
+                if self._quote:
+                    self.sink.emit("> " * self._quote)
+            self.sink.emit(line)
+            self._line_start = False
+
+    def feed(self, text: str):
+        # In slices, so parsing stops soon after the sink fills up.
+        for start in range(0, len(text), _PARSE_SLICE_CHARS):
+            if self.sink.full:
+                break
+            super().feed(text[start:start + _PARSE_SLICE_CHARS])
+
+    def close(self) -> str:
+        if not self.sink.full:
+            super().close()
+        text = _TRAILING_SPACE_RE.sub("\n", self.sink.close())
+        return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def html_to_text(html: str, max_chars: Optional[int] = None) -> str:
+    """Plain text from an HTML string (same rules as HTML bodies)."""
+    parser = _HTMLToText(max_chars)
+    parser.feed(html or "")
+    return parser.close()
+
+
+def _decode(chunks: Iterable[bytes], charset: str, is_html: bool, max_chars: Optional[int]) -> str:
+    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    sink = _HTMLToText(max_chars) if is_html else _TextSink(max_chars)
+    for chunk in chunks:
+        sink.feed(decoder.decode(chunk))
+        if sink.full:
+            break
+    else:
+        sink.feed(decoder.decode(b"", final=True))
+    return sink.close()
+
+
+def extract_body(
+    msg: Dict[str, Any],
+    max_chars: Optional[int] = None,
+    fetch_attachment: Optional[Callable[[str], Optional[str]]] = None,
+) -> str:
+    """
+    Readable text body of a Gmail format=full message, at most `max_chars`
+    characters. `fetch_attachment(attachment_id)` returns the base64url data
+    of a body stored as an attachment; without it such bodies come back empty.
+    """
+    part = select_body_part(msg.get("payload") or {})
+    if part is None:
+        return ""
+
+    body = part.get("body") or {}
+    data = body.get("data")
+    if not data and body.get("attachmentId") and fetch_attachment is not None:
+        try:
+            data = fetch_attachment(body["attachmentId"])
+        except Exception as e:
+            print(f"mime_body: failed to fetch body attachment of {msg.get('id')}", e)
+    if not data:
+        return ""
+
+    try:
+        chunks: Iterator[bytes] = _iter_bytes(data)
+        if "quoted-printable" in _headers(part).get("content-transfer-encoding", "").lower():
+            first = next(chunks, b"")
+            chunks = itertools.chain([first], chunks)
+            if _SOFT_LINE_BREAK_RE.search(first):
+                chunks = _undo_quoted_printable(chunks)
+        return _decode(chunks, part_charset(part), _mime_type(part) == "text/html", max_chars)
+    except (binascii.Error, ValueError) as e:
+        print(f"mime_body: undecodable body in {msg.get('id')}", e)
+        return ""
@@ -0,0 +1,214 @@
+# app/outbox.py
+"""
+Reply outbox.
+
+/gmail/send-reply used to look the message up, build the reply and call
+messages.send while the user waited, and a Gmail error lost the reply. Now
+the route only stores the reply in the outbox table (see db.py) and answers
+202 with the entry's id (poll GET /gmail/outbox/{id}); this worker sends it.
+
+- Persistence: entries are claimed with a lease in the database. An entry
+  whose worker dies comes back when its lease runs out. Several app
+  processes (or `python -m app.outbox`) can share the queue.
+- Retries: a failed send is retried with exponential backoff and jitter, at
+  most OUTBOX_MAX_ATTEMPTS times. A request Gmail rejects outright (400), or
+  a reply to a message that no longer exists (404), fails at once.
+- Idempotency: a repeated request with the same Idempotency-Key gets the same
+  entry. Each reply carries a Message-ID made from its outbox id, and before
+  trying again after an attempt that may have reached Gmail, the worker looks
+  for that Message-ID in the mailbox, so a reply is never sent twice.
+- Bursts: at most OUTBOX_CONCURRENCY sends run at once; the rest wait in the
+  table.
+
+Runs in a thread inside the app (OUTBOX_IN_APP), or on its own:
+
+    python -m app.outbox
+"""
+
+import random
+import threading
+import time
+from base64 import urlsafe_b64encode
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.mime.text import MIMEText
+from typing import Any, Dict, Optional, Set, Tuple
+
+from googleapiclient.errors import HttpError
+
+from . import db, gmail_service, metrics
+from .auth_utils import get_credentials_for_email
+from .config import (
+    OUTBOX_CONCURRENCY,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_SECONDS,
+    OUTBOX_RETENTION_SECONDS,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+)
+from .message_cache import ParsedMessage
+
+# Gmail answers that retrying can't fix
+PERMANENT_STATUSES = (400, 404)
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def rfc822_message_id(entry: Dict[str, Any]) -> str:
+    """The Message-ID header of an outbox entry's reply: the same for every attempt."""
+    domain = entry["email"].rpartition("@")[2] or "localhost"
+    return f"<outbox-{entry['id']}@{domain}>"
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before the next try after `attempts` failed ones: doubling, capped, with jitter."""
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxWorker:
+    """Sends queued replies in the background."""
+
+    def __init__(self, concurrency: int = OUTBOX_CONCURRENCY, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune: Optional[float] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"sent": 0, "deduplicated": 0, "retried": 0, "failed": 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="reply-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Look at the queue now rather than at the next poll (a reply was just queued)."""
+        self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _reply_to(self, email: str, service, message_id: str) -> Tuple[str, str, Optional[str]]:
+        """(To, Subject, thread id) for a reply to `message_id`, from the local store or Gmail."""
+        row = db.get_messages(email, [message_id]).get(message_id)
+        if row is not None:
+            record = ParsedMessage.from_row(row)
+            return record.from_line, record.subject, record.thread_id
+        msg = service.users().messages().get(
+            userId="me", id=message_id, format="metadata", metadataHeaders=["Subject", "From"],
+        ).execute()
+        headers = msg.get("payload", {}).get("headers", [])
+        subject = gmail_service.get_header(headers, "Subject") or "(no subject)"
+        return gmail_service.get_header(headers, "From"), subject, msg.get("threadId")
+
+    def _find_sent(self, service, entry: Dict[str, Any]) -> Optional[str]:
+        """Gmail id of the entry's reply if an earlier attempt sent it after all."""
+        resp = service.users().messages().list(
+            userId="me", q=f"rfc822msgid:{rfc822_message_id(entry)}", includeSpamTrash=True, maxResults=1,
+        ).execute()
+        found = resp.get("messages") or []
+        return found[0]["id"] if found else None
+
+    def send(self, entry: Dict[str, Any]):
+        """Send one claimed entry and record the outcome."""
+        email = entry["email"]
+        metrics.set_user(email)
+        try:
+            creds = get_credentials_for_email(email)
+            if not creds:
+                raise RuntimeError("no valid credentials")
+            service = gmail_service.get_service(email, creds)
+
+            # An earlier attempt may have been sent before it failed or its worker died.
+            if entry["attempts"] > 1:
+                sent_id = self._find_sent(service, entry)
+                if sent_id:
+                    db.finish_outbox(entry["id"], sent_id)
+                    self._count("deduplicated")
+                    return
+
+            to_addr, subject, thread_id = self._reply_to(email, service, entry["message_id"])
+            mime_msg = MIMEText(entry["body"])
+            mime_msg["To"] = to_addr
+            mime_msg["Subject"] = f"Re: {subject}"
+            mime_msg["Message-ID"] = rfc822_message_id(entry)
+            body = {"raw": urlsafe_b64encode(mime_msg.as_bytes()).decode("utf-8")}
+            if thread_id:
+                body["threadId"] = thread_id
+            resp = service.users().messages().send(userId="me", body=body).execute()
+        except Exception as e:
+            self._failed(entry, e)
+            return
+
+        db.finish_outbox(entry["id"], resp.get("id"))
+        self._count("sent")
+
+    def _failed(self, entry: Dict[str, Any], e: Exception):
+        status = e.resp.status if isinstance(e, HttpError) and getattr(e, "resp", None) is not None else None
+        error = f"Gmail error {status}" if status else f"{type(e).__name__}: {e}"
+        print(f"outbox: send {entry['id']} for {entry['email']} failed (attempt {entry['attempts']}):", e)
+        if status in PERMANENT_STATUSES or entry["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            db.fail_outbox(entry["id"], error)
+            self._count("failed")
+        else:
+            db.retry_outbox(entry["id"], retry_delay(entry["attempts"]), error)
+            self._count("retried")
+
+    def _prune(self):
+        if self._last_prune is not None and time.monotonic() - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = time.monotonic()
+        removed = db.delete_finished_outbox(OUTBOX_RETENTION_SECONDS)
+        if removed:
+            print(f"outbox: dropped {removed} finished entries")
+
+    def run(self):
+        in_flight: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reply-outbox") as pool:
+            while not self._stop.is_set():
+                # Cleared before the claim: a reply queued from here on wakes the next wait.
+                self._wake.clear()
+                try:
+                    self._prune()
+                    in_flight = {fut for fut in in_flight if not fut.done()}
+                    free = self.concurrency - len(in_flight)
+                    for entry in db.claim_outbox(free, OUTBOX_LEASE_SECONDS) if free > 0 else []:
+                        fut = pool.submit(self.send, entry)
+                        # A finished send frees a slot for the next entry.
+                        fut.add_done_callback(lambda _: self._wake.set())
+                        in_flight.add(fut)
+                except Exception as e:
+                    print("OutboxWorker error:", e)
+                self._wake.wait(self.poll_seconds)
+
+
+outbox_worker = OutboxWorker()
+
+
+def main():
+    from .auth_utils import credential_refresher
+
+    db.init_db()
+    credential_refresher.start()
+    print(f"Reply outbox worker running ({outbox_worker.concurrency} sends at a time).")
+    try:
+        outbox_worker.run()
+    except KeyboardInterrupt:
+        outbox_worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# app/prefetch.py
+"""
+Background summary prefetch.
+
+Summaries used to be made only while the user waited on /gmail/last5. With
+PREFETCH_ENABLED, mail_sync queues newly stored inbox messages in the
+summary_jobs table, and this worker summarizes them into the summary cache
+ahead of time, so dashboard loads are mostly cache hits.
+
+- Detection: every PREFETCH_SYNC_INTERVAL_SECONDS each user in the tokens
+  table gets an incremental sync, which queues what is new.
+- Fair scheduling: users take turns, least recently served first, one batch
+  (PREFETCH_BATCH_SIZE jobs, one JSON-mode call) per turn. At most
+  PREFETCH_CONCURRENCY batches run at once, never two for the same user.
+- LLM budget: a batch only starts while at least PREFETCH_MIN_HEADROOM of the
+  LLM rate budget is free at some provider. The rest is left for
+  interactive requests.
+- Persistence: jobs are claimed with a lease in the database. A job whose
+  worker dies comes back when its lease runs out, and failed jobs are retried
+  PREFETCH_MAX_ATTEMPTS times. Several app processes can share the backlog.
+
+Runs in a thread inside the app (PREFETCH_IN_APP), or on its own:
+
+    python -m app.prefetch
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+from . import db, gmail_service, mail_sync, metrics, triage
+from .auth_utils import get_credentials_for_email
+from .config import (
+    PREFETCH_BATCH_SIZE,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_MAX_ATTEMPTS,
+    PREFETCH_MIN_HEADROOM,
+    PREFETCH_POLL_SECONDS,
+    PREFETCH_RETRY_SECONDS,
+    PREFETCH_SYNC_INTERVAL_SECONDS,
+    SUMMARY_TIMEOUT_SECONDS,
+)
+from .llm_router import llm_router
+from .routers.ai import cached_summaries, summarize_many
+
+# A claimed batch that isn't finished by then is handed out again.
+LEASE_SECONDS = max(60.0, SUMMARY_TIMEOUT_SECONDS * 4)
+
+
+class PrefetchWorker:
+    """Syncs every mailbox now and then and drains the summary backlog in the background."""
+
+    def __init__(
+        self,
+        concurrency: int = PREFETCH_CONCURRENCY,
+        batch_size: int = PREFETCH_BATCH_SIZE,
+        poll_seconds: float = PREFETCH_POLL_SECONDS,
+        sync_interval: float = PREFETCH_SYNC_INTERVAL_SECONDS,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.sync_interval = sync_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_served: Dict[str, float] = {}
+        self._last_sync: Optional[float] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"syncs": 0, "batches": 0, "summarized": 0, "retried": 0, "dropped": 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="summary-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def sync_all(self):
+        """Incremental sync for every user with a token; this queues their new messages."""
+        for email in db.list_token_emails():
+            if self._stop.is_set():
+                return
+            try:
+                creds = get_credentials_for_email(email)
+                if not creds:
+                    continue
+                mail_sync.sync_mailbox(email, gmail_service.get_service(email, creds))
+                self._count("syncs")
+            except Exception as e:
+                print(f"prefetch: sync failed for {email}", e)
+
+    def process(self, email: str) -> int:
+        """Claim and summarize one batch of `email`'s jobs. Returns how many were claimed."""
+        metrics.set_user(email)
+        ids = db.claim_summary_jobs(email, self.batch_size, LEASE_SECONDS)
+        if not ids:
+            return 0
+        rows = db.get_messages(email, ids)
+        # Mail triage routes away from the model needs no prefetch
+        _, extracted = triage.route(rows.values())
+        bodies = {
+            mid: rows[mid]["body"] for mid in ids if mid in rows and rows[mid].get("body") and mid not in extracted
+        }
+        # Deleted since, triaged, or nothing to summarize
+        done = [mid for mid in ids if mid not in bodies]
+
+        if bodies:
+            summarize_many(bodies, {}, user_email=email)
+            # Failed summaries aren't cached, so the cache says what worked.
+            summarized = cached_summaries(bodies, email)
+            done += list(summarized)
+            failed = [mid for mid in bodies if mid not in summarized]
+            self._count("summarized", len(summarized))
+            if failed:
+                self._count("retried", len(failed))
+                self._count("dropped", db.retry_summary_jobs(email, failed, PREFETCH_RETRY_SECONDS, PREFETCH_MAX_ATTEMPTS))
+
+        db.finish_summary_jobs(email, done)
+        self._count("batches")
+        return len(ids)
+
+    def drain(self, pool: ThreadPoolExecutor):
+        """Run batches until nothing is due, the LLM budget is short, or we're stopped."""
+        in_flight: Dict[str, Future] = {}
+        while not self._stop.is_set():
+            for email, fut in list(in_flight.items()):
+                if fut.done():
+                    del in_flight[email]
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        print(f"prefetch: batch failed for {email}", e)
+
+            starved = llm_router.headroom() < PREFETCH_MIN_HEADROOM
+            waiting = [] if starved else [e for e in db.due_summary_job_emails() if e not in in_flight]
+            if not waiting and not in_flight:
+                return
+            # Least recently served first: a big backlog can't crowd out other users.
+            waiting.sort(key=lambda e: self._last_served.get(e, 0.0))
+            for email in waiting[:self.concurrency - len(in_flight)]:
+                self._last_served[email] = time.monotonic()
+                in_flight[email] = pool.submit(self.process, email)
+
+            if in_flight:
+                wait(list(in_flight.values()), timeout=self.poll_seconds, return_when=FIRST_COMPLETED)
+            else:
+                # Only waiting for LLM budget
+                return
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="summary-prefetch") as pool:
+            while not self._stop.is_set():
+                try:
+                    if self._last_sync is None or time.monotonic() - self._last_sync >= self.sync_interval:
+                        self._last_sync = time.monotonic()
+                        self.sync_all()
+                    self.drain(pool)
+                except Exception as e:
+                    print("PrefetchWorker error:", e)
+                self._stop.wait(self.poll_seconds)
+
+
+prefetch_worker = PrefetchWorker()
+
+
+def main():
+    from .auth_utils import credential_refresher
+
+    db.init_db()
+    credential_refresher.start()
+    print(f"Summary prefetch worker running ({prefetch_worker.concurrency} batches at a time).")
+    try:
+        prefetch_worker.run()
+    except KeyboardInterrupt:
+        prefetch_worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# app/prompt_builder.py
+"""
+Prepares email bodies before they go into an LLM prompt.
+
+Each body is:
+1. turned into plain text if it is still HTML (stored bodies are already
+   text, see mime_body.py),
+2. stripped of quoted replies ("On ... wrote:", "-----Original Message-----",
+   Outlook "From:/Sent:" header blocks, "> " lines), signatures ("-- ",
+   "Sent from my ...") and legal/confidentiality or unsubscribe footers,
+3. fitted to a token budget. Size is an estimate in tokens, not characters.
+   The cut falls at a paragraph or sentence boundary, keeping the top of the
+   message, which is the new content once the quotes are gone.
+
+Token counts before and after preparation are kept so the savings can be
+reported (/gmail/cache-stats).
+"""
+
+import re
+import threading
+from typing import Any, Dict, NamedTuple
+
+from . import mime_body
+from .config import PROMPT_TOKEN_BUDGET
+from .llm_governor import estimate_tokens
+
+# Bump when the cleaning rules change: part of the summary cache key.
+PROMPT_BUILDER_VERSION = "2"
+
+# Input-token budget per prompt, by model (PROMPT_TOKEN_BUDGET overrides).
+# Well below the context windows: this is about cost and latency per call.
+MODEL_INPUT_TOKEN_BUDGETS = {
+    "llama-3.1-8b-instant": 2000,
+    "gpt-4o-mini": 2000,
+}
+DEFAULT_INPUT_TOKEN_BUDGET = 2000
+# Never squeeze a body below this, whatever the prompt around it costs.
+MIN_BODY_TOKENS = 200
+
+TRUNCATION_MARKER = "\n\n[...truncated for AI processing...]"
+
+_HTML_HINT_RE = re.compile(r"<(html|body|div|p|br|table|span|blockquote)\b", re.I)
+
+_ON_WROTE_RE = re.compile(r"^\s*On\b.{0,300}\bwrote:\s*$", re.I | re.S)
+_ORIGINAL_MESSAGE_RE = re.compile(r"^\s*-{2,}\s*(Original Message|Reply message)\s*-{2,}\s*$", re.I)
+_OUTLOOK_FROM_RE = re.compile(r"^\s*\*?From:\*?\s+\S", re.I)
+_OUTLOOK_NEXT_RE = re.compile(r"^\s*\*?(Sent|Date|To|Subject):\*?\s", re.I)
+_SIGNATURE_DELIMITER_RE = re.compile(r"^--\s?$")
+_MOBILE_SIGNATURE_RE = re.compile(r"^\s*(Sent from my \w+|Sent from (Mail|Outlook) for|Get Outlook for)\b", re.I)
+_DISCLAIMER_RE = re.compile(
+    r"confidentiality notice|^\s*disclaimer\s*:"
+    r"|(confidential|privileged).{0,200}intended (solely )?(for|recipient)"
+    r"|if you (are not|have received this).{0,60}(intended recipient|in error)"
+    r"|\bunsubscribe\b|view (this email )?in (your|a) browser|manage (your )?(email )?preferences",
+    re.I | re.S,
+)
+
+
+class PreparedBody(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens: int
+    truncated: bool
+
+
+_lock = threading.Lock()
+_stats = {"prompts": 0, "truncated": 0, "tokens_original": 0, "tokens_sent": 0}
+
+
+def input_budget(model: str) -> int:
+    """Input-token budget for one prompt to `model`."""
+    if PROMPT_TOKEN_BUDGET > 0:
+        return PROMPT_TOKEN_BUDGET
+    return MODEL_INPUT_TOKEN_BUDGETS.get(model, DEFAULT_INPUT_TOKEN_BUDGET)
+
+
+def html_to_text(raw: str) -> str:
+    """Plain text from an HTML body; plain-text bodies are returned as they are."""
+    if not raw or not _HTML_HINT_RE.search(raw):
+        return raw or ""
+    # Blockquoted history comes out as "> " lines, dropped below.
+    return mime_body.html_to_text(raw)
+
+
+def _quote_start(lines) -> int:
+    """Index of the first line of quoted history, or len(lines) if none."""
+    for i, line in enumerate(lines):
+        if i and _ON_WROTE_RE.match(line):
+            return i
+        # Gmail wraps long attributions: "On Mon, ... Alex <" / "alex@example.com> wrote:"
+        if i and i + 1 < len(lines) and _ON_WROTE_RE.match(line + " " + lines[i + 1]):
+            return i
+        if i and _ORIGINAL_MESSAGE_RE.match(line):
+            return i
+        if i and _OUTLOOK_FROM_RE.match(line):
+            following = [l for l in lines[i + 1:i + 5] if l.strip()]
+            if sum(1 for l in following if _OUTLOOK_NEXT_RE.match(l)) >= 2:
+                return i
+    return len(lines)
+
+
+def strip_quoted_replies(text: str) -> str:
+    lines = text.split("\n")
+    kept = lines[:_quote_start(lines)]
+    kept = [l for l in kept if not l.lstrip().startswith(">")]
+    result = "\n".join(kept).strip()
+    # A message that is nothing but a quote (e.g. a bare forward) keeps its text.
+    return result or text
+
+
+def strip_signature(text: str) -> str:
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if i and _SIGNATURE_DELIMITER_RE.match(line):
+            lines = lines[:i]
+            break
+    result = "\n".join(l for l in lines if not _MOBILE_SIGNATURE_RE.match(l)).strip()
+    return result or text
+
+
+def strip_disclaimers(text: str) -> str:
+    paragraphs = re.split(r"\n\s*\n", text)
+    # The first paragraph always stays: a short email may be *about* unsubscribing.
+    kept = paragraphs[:1] + [p for p in paragraphs[1:] if not _DISCLAIMER_RE.search(p)]
+    return "\n\n".join(kept)
+
+
+def normalize_whitespace(text: str) -> str:
+    lines = [re.sub(r"[ \t ]+", " ", l).strip() for l in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _strip_extras(text: str) -> str:
+    text = strip_quoted_replies(text)
+    text = strip_signature(text)
+    text = strip_disclaimers(text)
+    return normalize_whitespace(text)
+
+
+def clean_body(raw: str) -> str:
+    """Plain text of the new content of a message, without quotes, signature or footers."""
+    text = normalize_whitespace(html_to_text(raw or ""))
+    return _strip_extras(text) if text else ""
+
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """Cut `text` to about `max_tokens` estimated tokens at a paragraph or sentence boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * 4 - len(TRUNCATION_MARKER))
+    head = text[:max_chars]
+    for boundary in ("\n\n", ". ", "\n", " "):
+        cut = head.rfind(boundary)
+        if cut >= max_chars // 2:
+            head = head[:cut + (1 if boundary == ". " else 0)]
+            break
+    return head.rstrip() + TRUNCATION_MARKER
+
+
+def prepare_body(raw: str, max_tokens: int, record_stats: bool = True) -> PreparedBody:
+    """
+    Clean a body for a prompt and fit it into `max_tokens` (estimated).
+    Pass record_stats=False when the result may not be sent, and record()
+    it once it is.
+    """
+    plain = normalize_whitespace(html_to_text(raw or ""))
+    text = _strip_extras(plain) if plain else ""
+    fitted = fit_to_budget(text, max(MIN_BODY_TOKENS, max_tokens))
+    prepared = PreparedBody(fitted, estimate_tokens(plain), estimate_tokens(fitted), fitted is not text)
+    if record_stats:
+        record(prepared)
+    return prepared
+
+
+def record(prepared: PreparedBody):
+    """Count a prepared body that went into a prompt."""
+    with _lock:
+        _stats["prompts"] += 1
+        _stats["truncated"] += int(prepared.truncated)
+        _stats["tokens_original"] += prepared.original_tokens
+        _stats["tokens_sent"] += prepared.tokens
+
+
+def stats() -> Dict[str, Any]:
+    """Estimated input tokens before/after preparation, for this process."""
+    with _lock:
+        saved = _stats["tokens_original"] - _stats["tokens_sent"]
+        return dict(
+            _stats,
+            tokens_saved=saved,
+            saved_ratio=round(saved / _stats["tokens_original"], 3) if _stats["tokens_original"] else None,
+        )
@@ -0,0 +1,191 @@
+# app/reply_drafts.py
+"""
+Speculative reply drafts.
+
+Users tend to open the dashboard and click "generate reply" on one of the
+top emails. With REPLY_SPECULATION_ENABLED, /gmail/last5 starts drafting
+replies for its newest REPLY_SPECULATION_COUNT messages in the background,
+and /gmail/generate-reply hands out the finished draft instead of calling
+the model while the user waits.
+
+- Drafts live in an in-process TTLCache (REPLY_DRAFT_TTL_SECONDS), keyed by
+  (user email, message id, reply prompt version, user name); any configured
+  provider may have written one. A draft is served once; asking again
+  generates a fresh reply.
+- A click while the draft is still being written waits for that call
+  instead of starting a second one.
+- Given credentials, drafts get the same thread context as a click (see
+  thread_context.py).
+- Automated mail (no-reply senders, Promotions/Social/Updates/Forums) is
+  skipped: nobody answers it.
+- Spend: each user may use REPLY_SPECULATION_TOKENS_PER_HOUR estimated
+  tokens per clock hour on drafts, thread folds for their context included
+  (a draft whose folds don't fit goes ahead with the stored thread summary),
+  and a draft only starts while at least REPLY_SPECULATION_MIN_HEADROOM of
+  the LLM rate budget is free.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from cachetools import TTLCache
+from google.oauth2.credentials import Credentials
+
+from . import thread_context
+from .config import (
+    REPLY_DRAFT_CACHE_SIZE,
+    REPLY_DRAFT_TTL_SECONDS,
+    REPLY_SPECULATION_COUNT,
+    REPLY_SPECULATION_ENABLED,
+    REPLY_SPECULATION_MIN_HEADROOM,
+    REPLY_SPECULATION_TOKENS_PER_HOUR,
+)
+from .llm_governor import estimate_tokens
+from .llm_router import llm_router
+from .message_cache import ParsedMessage
+from .prompt_builder import input_budget
+from .routers.ai import MODEL_NAME, REPLY_MAX_TOKENS, REPLY_PROMPT_VERSION, draft_reply_async
+from .triage import AUTOMATED_SENDER_RE
+
+_AUTOMATED_LABELS = {"CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL", "CATEGORY_UPDATES", "CATEGORY_FORUMS", "SPAM"}
+_WINDOW_SECONDS = 3600
+
+
+class DraftKey(NamedTuple):
+    email: str
+    message_id: str
+    prompt_version: str
+    user_name: Optional[str]
+
+
+def make_key(email: str, message_id: str, user_name: Optional[str] = None) -> DraftKey:
+    return DraftKey(email, message_id, REPLY_PROMPT_VERSION, user_name)
+
+
+_lock = threading.Lock()
+_drafts: "TTLCache[DraftKey, str]" = TTLCache(maxsize=max(1, REPLY_DRAFT_CACHE_SIZE), ttl=REPLY_DRAFT_TTL_SECONDS)
+_pending: Dict[DraftKey, "asyncio.Task[Optional[str]]"] = {}
+# (email, hour) -> estimated tokens spent on drafts
+_spent: Dict[Tuple[str, int], int] = {}
+_stats = {"started": 0, "served": 0, "joined": 0, "failed": 0, "skipped_automated": 0, "skipped_budget": 0}
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats)
+
+
+def is_automated(record: ParsedMessage) -> bool:
+    """Mail nobody replies to: no-reply style senders and Gmail's bulk categories."""
+    return bool(AUTOMATED_SENDER_RE.search(record.from_line or "")) or bool(_AUTOMATED_LABELS & set(record.label_ids))
+
+
+def _cost(record: ParsedMessage) -> int:
+    """
+    Estimated tokens of one draft call (the body is cut to the model's input
+    budget); its thread folds are charged separately, once they are known.
+    """
+    return min(estimate_tokens(record.subject, record.body), input_budget(MODEL_NAME)) + REPLY_MAX_TOKENS
+
+
+def _charge(email: str, tokens: int) -> bool:
+    """Book `tokens` against the user's hourly draft budget; False if it would overrun it."""
+    hour = int(time.time() // _WINDOW_SECONDS)
+    with _lock:
+        for stale in [k for k in _spent if k[1] != hour]:
+            del _spent[stale]
+        spent = _spent.get((email, hour), 0)
+        if spent + tokens > REPLY_SPECULATION_TOKENS_PER_HOUR:
+            return False
+        _spent[(email, hour)] = spent + tokens
+        return True
+
+
+async def _draft(key: DraftKey, record: ParsedMessage, creds: Optional[Credentials]) -> Optional[str]:
+    try:
+        thread_summary = None
+        if creds is not None:
+            thread_summary = await thread_context.summary_for_reply(
+                key.email, creds, record.thread_id, record.id, charge=lambda tokens: _charge(key.email, tokens),
+            )
+        reply = await draft_reply_async(
+            record.subject, record.from_line, record.body, key.user_name, thread_summary=thread_summary,
+        )
+    except Exception as e:
+        print(f"reply_drafts: draft failed for {key.message_id}", repr(e))
+        reply = None
+    with _lock:
+        _pending.pop(key, None)
+        if reply:
+            _drafts[key] = reply
+        else:
+            _stats["failed"] += 1
+    return reply
+
+
+def speculate(
+    email: str,
+    records: Iterable[ParsedMessage],
+    user_name: Optional[str] = None,
+    creds: Optional[Credentials] = None,
+) -> int:
+    """
+    Start background drafts for the first REPLY_SPECULATION_COUNT records
+    (newest first) that need a reply. Call from the event loop. Returns how
+    many were started.
+    """
+    if not REPLY_SPECULATION_ENABLED or not email:
+        return 0
+
+    started = 0
+    candidates = 0
+    for record in records:
+        if candidates >= REPLY_SPECULATION_COUNT:
+            break
+        if is_automated(record):
+            with _lock:
+                _stats["skipped_automated"] += 1
+            continue
+        candidates += 1
+
+        key = make_key(email, record.id, user_name)
+        with _lock:
+            if key in _drafts or key in _pending:
+                continue
+        if llm_router.headroom() < REPLY_SPECULATION_MIN_HEADROOM or not _charge(email, _cost(record)):
+            with _lock:
+                _stats["skipped_budget"] += 1
+            break
+
+        task = asyncio.get_running_loop().create_task(_draft(key, record, creds))
+        with _lock:
+            _pending[key] = task
+            _stats["started"] += 1
+        started += 1
+    return started
+
+
+async def take(email: str, message_id: str, user_name: Optional[str] = None) -> Optional[str]:
+    """
+    The speculative draft for a message, waiting for it if it is still being
+    written; None if there is none (or it failed). A draft is handed out once.
+    """
+    key = make_key(email, message_id, user_name)
+    with _lock:
+        draft = _drafts.pop(key, None)
+        task = _pending.get(key) if draft is None else None
+        if draft is not None:
+            _stats["served"] += 1
+            return draft
+    if task is None:
+        return None
+
+    # Shielded: if this request goes away the draft still lands in the cache.
+    draft = await asyncio.shield(task)
+    with _lock:
+        _drafts.pop(key, None)
+        if draft:
+            _stats["joined"] += 1
+    return draft
@@ -1,178 +1,900 @@
 # app/ai.py
-from typing import Optional
+from typing import Optional, Dict, AsyncIterator, Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio
+import hashlib
+import json
 import textwrap
 import re
 
-from groq import Groq
-from ..config import GROQ_API_KEY
+from anyio import to_thread
+from ..config import (
+  GROQ_MODEL,
+  SUMMARY_BATCH_SIZE,
+  SUMMARY_BATCH_TOKEN_BUDGET,
+  SUMMARY_CONCURRENCY,
+  SUMMARY_TIMEOUT_SECONDS,
+)
+from .. import prompt_builder, summary_cache, summary_dedup
+from ..llm_governor import LLMUnavailable, estimate_tokens
+from ..llm_router import llm_router
+from ..prompt_builder import PROMPT_BUILDER_VERSION, input_budget
 
 # ============================
-# Groq client setup
+# Models
 # ============================
 
-groq_client: Optional[Groq] = None
-if GROQ_API_KEY:
-  groq_client = Groq(api_key=GROQ_API_KEY)
-else:
-  print("WARNING: GROQ_API_KEY not set. AI features will be degraded.")
+# Calls go to whichever provider llm_router picks (Groq or OpenAI). Prompts
+# are sized for the Groq model.
+MODEL_NAME = GROQ_MODEL
+# Model output is stored with the "provider:model" that wrote it
+# (Completion.source), and output by any of these is served again.
+CACHE_MODELS = llm_router.sources()
+
+SUMMARY_SYSTEM_PROMPT = (
+  "You are an assistant that summarizes email messages for a Gmail AI assistant. "
+  "Write a short, clear, 1–2 sentence summary in plain English. "
+  "Do not include greetings or signatures."
+)
+SUMMARY_USER_TEMPLATE = """
+Please summarize the following email in 1–2 sentences:
+
+---
+{body}
+---
+"""
+# Several emails in one call (see summarize_many): the model answers with a
+# JSON object {"<email id>": "<summary>", ...}.
+SUMMARY_BATCH_SYSTEM_PROMPT = (
+  "You are an assistant that summarizes email messages for a Gmail AI assistant. "
+  "For every email you are given, write a short, clear, 1–2 sentence summary in plain English. "
+  "Do not include greetings or signatures. "
+  "Answer only with a JSON object that maps each email id to its summary."
+)
+SUMMARY_BATCH_ITEM_TEMPLATE = """
+=== Email id: {id} ===
+{body}
+"""
+SUMMARY_BATCH_USER_TEMPLATE = """
+Summarize each of the following emails in 1–2 sentences.
+{items}
+Return a JSON object with exactly these keys: {ids}
+"""
+# Part of every summary cache key: editing any prompt above (or the body
+# cleaning rules) changes the version, so summaries made with the old
+# prompts are no longer served.
+SUMMARY_PROMPT_VERSION = hashlib.sha256(
+  (
+    PROMPT_BUILDER_VERSION
+    + SUMMARY_SYSTEM_PROMPT
+    + SUMMARY_USER_TEMPLATE
+    + SUMMARY_BATCH_SYSTEM_PROMPT
+    + SUMMARY_BATCH_ITEM_TEMPLATE
+    + SUMMARY_BATCH_USER_TEMPLATE
+  ).encode("utf-8")
+).hexdigest()[:12]
+# Completion tokens allowed per summary
+SUMMARY_MAX_TOKENS = 120
+
+REPLY_SYSTEM_PROMPT = (
+  "You are an AI email assistant. You write polite, concise, and professional email replies. "
+  "Assume the user wants to respond helpfully, unless the email is spam or irrelevant."
+)
+REPLY_USER_TEMPLATE = textwrap.dedent(
+  """
+  You are replying to this email.
+
+  From: {from_line}
+  Subject: {subject}
+  {thread_part}
+  Email body:
+  ---
+  {body}
+  ---
+
+  {name_part}
+
+  Write a clear, professional reply that:
+  - Is appropriate for the context
+  - Uses a friendly but professional tone
+  - Can be sent as-is from the user
+  - Does NOT include a subject line (only the email body)
 
-# Use a supported, fast model
-MODEL_NAME = "llama-3.1-8b-instant"  # or "llama-3.1-70b-instant" if you want higher quality
+  Reply:
+  """
+)
+# Part of every reply-draft key (see reply_drafts.py), like SUMMARY_PROMPT_VERSION.
+REPLY_PROMPT_VERSION = hashlib.sha256(
+  (PROMPT_BUILDER_VERSION + REPLY_SYSTEM_PROMPT + REPLY_USER_TEMPLATE).encode("utf-8")
+).hexdigest()[:12]
+# Completion tokens allowed per reply
+REPLY_MAX_TOKENS = 300
+
+# Rolling thread summaries (see thread_context.py): the stored summary of a
+# thread is rewritten to cover each batch of messages it hasn't seen yet.
+THREAD_SYSTEM_PROMPT = (
+  "You keep a running summary of an email thread for an AI email assistant. "
+  "Keep who asked or promised what, decisions, open questions, dates and numbers. "
+  "Write at most 150 words of plain text, oldest points first. "
+  "Do not include greetings or signatures."
+)
+THREAD_FOLD_USER_TEMPLATE = """
+Summary of the thread so far:
+---
+{summary}
+---
+
+New messages in the thread, oldest first:
+{messages}
+Rewrite the summary so it also covers the new messages. Answer with the summary only.
+"""
+THREAD_MESSAGE_TEMPLATE = """
+=== From: {from_line} ===
+{body}
+"""
+THREAD_PROMPT_VERSION = hashlib.sha256(
+  (PROMPT_BUILDER_VERSION + THREAD_SYSTEM_PROMPT + THREAD_FOLD_USER_TEMPLATE + THREAD_MESSAGE_TEMPLATE).encode("utf-8")
+).hexdigest()[:12]
+# Completion tokens allowed per thread summary, and body tokens per folded message
+THREAD_SUMMARY_MAX_TOKENS = 250
+THREAD_MESSAGE_MAX_TOKENS = 400
+
+# Shared, bounded pool for inbox summaries so one page never fans out
+# into more than SUMMARY_CONCURRENCY concurrent model calls.
+_summary_pool = ThreadPoolExecutor(
+  max_workers=max(1, SUMMARY_CONCURRENCY),
+  thread_name_prefix="summarize",
+)
 
 
 # ============================
 # Helpers
 # ============================
 
-def clean_email_body(raw: str) -> str:
-  """
-  Very rough cleaner:
-  - Remove HTML tags
-  - Collapse multiple whitespace
-  """
-  if not raw:
-    return ""
-
-  # Remove HTML tags
-  text = re.sub(r"<[^>]+>", " ", raw)
-  # Collapse whitespace
-  text = re.sub(r"\s+", " ", text)
-  return text.strip()
+def _body_budget(system_prompt: str, user_prompt_without_body: str) -> int:
+  """Estimated tokens left for the email body in a prompt to MODEL_NAME."""
+  return input_budget(MODEL_NAME) - estimate_tokens(system_prompt, user_prompt_without_body)
 
 
-def truncate_for_model(text: str, max_chars: int = 8000) -> str:
+def _complete(
+  system_prompt: str,
+  user_prompt: str,
+  max_tokens: int = 256,
+  timeout: Optional[float] = None,
+  json_mode: bool = False,
+) -> Tuple[str, Optional[str]]:
   """
-  Truncate text to a maximum number of characters.
-  This is a crude but effective way to avoid huge token counts.
+  Small helper for one chat completion through the provider router
+  (fastest healthy provider, failover; rate limits, retries and circuit
+  breakers per provider).
+  `timeout` (seconds) bounds the whole call, retries included; None keeps
+  the client default per attempt. `json_mode` asks for a JSON object reply.
+  Prompts are expected to be sized already (see prompt_builder.py).
+  Returns (text, "provider:model" that wrote it), or (fallback text, None)
+  when the call failed.
   """
-  if not text:
-    return ""
-  text = text.strip()
-  if len(text) <= max_chars:
-    return text
-  return text[:max_chars] + "\n\n[...truncated for AI processing...]"
+  if not llm_router.available():
+    # Fallback if no key is set
+    return "AI model unavailable (missing GROQ_API_KEY / OPENAI_API_KEY).", None
 
-
-def _call_groq(system_prompt: str, user_prompt: str, max_tokens: int = 256) -> str:
+  try:
+    completion = llm_router.complete(system_prompt, user_prompt, max_tokens=max_tokens, timeout=timeout, json_mode=json_mode)
+    return completion.text, completion.source
+  except LLMUnavailable as e:
+    print("LLM call not made:", e)
+    return "AI model error. Please try again later.", None
+  except Exception as e:
+    print("LLM API error:", repr(e))
+    return "AI model error. Please try again later.", None
+
+
+def _call_llm(
+  system_prompt: str,
+  user_prompt: str,
+  max_tokens: int = 256,
+  timeout: Optional[float] = None,
+  json_mode: bool = False,
+) -> str:
+  """_complete, text only."""
+  return _complete(system_prompt, user_prompt, max_tokens, timeout, json_mode)[0]
+
+
+async def _complete_async(
+  system_prompt: str,
+  user_prompt: str,
+  max_tokens: int = 256,
+  timeout: Optional[float] = None,
+  json_mode: bool = False,
+  hedge: bool = False,
+) -> Tuple[str, Optional[str]]:
   """
-  Small helper to call Groq chat completion.
+  Async _complete (same router, fallbacks and return value). `hedge` races
+  a second provider when the first is slower than usual; for calls a user
+  waits on.
   """
-  if not groq_client:
-    # Fallback if key missing
-    return "AI model unavailable (missing GROQ_API_KEY)."
-
-  # Truncate the user prompt defensively as well
-  user_prompt = truncate_for_model(user_prompt, max_chars=8000)
+  if not llm_router.available():
+    return "AI model unavailable (missing GROQ_API_KEY / OPENAI_API_KEY).", None
 
   try:
-    resp = groq_client.chat.completions.create(
-      model=MODEL_NAME,
-      messages=[
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-      ],
-      temperature=0.4,
-      max_tokens=max_tokens,
+    completion = await llm_router.complete_async(
+      system_prompt, user_prompt, max_tokens=max_tokens, timeout=timeout, json_mode=json_mode, hedge=hedge,
     )
-    return (resp.choices[0].message.content or "").strip()
+    return completion.text, completion.source
+  except LLMUnavailable as e:
+    print("LLM call not made:", e)
+    return "AI model error. Please try again later.", None
   except Exception as e:
-    print("Groq API error:", repr(e))
-    # Generic graceful fallback
-    return "AI model error. Please try again later."
+    print("LLM API error:", repr(e))
+    return "AI model error. Please try again later.", None
+
+
+async def _call_llm_async(
+  system_prompt: str,
+  user_prompt: str,
+  max_tokens: int = 256,
+  timeout: Optional[float] = None,
+  json_mode: bool = False,
+  hedge: bool = False,
+) -> str:
+  """_complete_async, text only."""
+  return (await _complete_async(system_prompt, user_prompt, max_tokens, timeout, json_mode, hedge))[0]
 
 
 # ============================
 # Public functions
 # ============================
 
-def summarize_email(body: str) -> str:
-  """
-  Summarize an email into a short, human-friendly summary (not just truncation).
-  We:
-  - Clean HTML
-  - Truncate long bodies to keep under token limits
-  """
-  body = clean_email_body(body or "")
-  if not body:
-    return "No content to summarize."
+def _prepare_summary_body(body: str, record_stats: bool = True) -> prompt_builder.PreparedBody:
+  return prompt_builder.prepare_body(
+    body,
+    _body_budget(SUMMARY_SYSTEM_PROMPT, SUMMARY_USER_TEMPLATE.format(body="")),
+    record_stats=record_stats,
+  )
 
-  body = truncate_for_model(body, max_chars=8000)
 
-  system = (
-    "You are an assistant that summarizes email messages for a Gmail AI assistant. "
-    "Write a short, clear, 1–2 sentence summary in plain English. "
-    "Do not include greetings or signatures."
-  )
-  user = textwrap.dedent(
-    f"""
-    Please summarize the following email in 1–2 sentences:
-
-    ---
-    {body}
-    ---
-    """
-  )
+def _summary_prompt(body: str) -> Tuple[str, str]:
+  """(cleaned body, user prompt); the body is empty when there's nothing to summarize."""
+  body = _prepare_summary_body(body).text
+  if not body:
+    return "", ""
+  return body, SUMMARY_USER_TEMPLATE.format(body=body)
 
-  summary = _call_groq(system, user, max_tokens=120)
 
+def _summary_or_preview(body: str, summary: str) -> str:
   # If something went wrong and we got a generic error, at least give a preview
   if summary.startswith("AI model error"):
     preview = body[:280]
     return f"AI summary unavailable. Preview: {preview}"
+  return summary
+
+
+def _summarize_uncached(body: str, timeout: Optional[float] = None) -> Tuple[str, Optional[str]]:
+  """(summary, model that wrote it); the model is None for previews and placeholders."""
+  body, user = _summary_prompt(body)
+  if not body:
+    return "No content to summarize.", None
+
+  summary, model = _complete(SUMMARY_SYSTEM_PROMPT, user, max_tokens=SUMMARY_MAX_TOKENS, timeout=timeout)
+  return _summary_or_preview(body, summary), model
+
+
+async def _summarize_uncached_async(body: str, timeout: Optional[float] = None) -> Tuple[str, Optional[str]]:
+  body, user = _summary_prompt(body)
+  if not body:
+    return "No content to summarize.", None
+
+  # Someone is waiting on the page: hedge slow calls
+  summary, model = await _complete_async(
+    SUMMARY_SYSTEM_PROMPT, user, max_tokens=SUMMARY_MAX_TOKENS, timeout=timeout, hedge=True,
+  )
+  return _summary_or_preview(body, summary), model
+
+
+def _is_cacheable(summary: str) -> bool:
+  """Only real model output is cached, never fallbacks or placeholders."""
+  return bool(summary) and not summary.startswith(
+    ("AI summary unavailable", "AI model unavailable", "No content to summarize")
+  )
+
+
+def _summary_key(user_email: Optional[str], message_id: Optional[str], body: str):
+  if not user_email or not message_id:
+    return None
+  return summary_cache.make_key(user_email, message_id, body, SUMMARY_PROMPT_VERSION)
 
+
+def _cache_summary(key, summary: str, model: str):
+  """Cache a summary `model` wrote, and share it with later duplicates of the email."""
+  summary_cache.put(key, summary, model)
+  summary_dedup.remember(key, summary, model)
+
+
+def _shared_summaries(bodies: Dict[str, str], keys, user_email: Optional[str]) -> Dict[str, str]:
+  """Summaries of earlier duplicate mail (summary_dedup.py), cached under these messages' keys."""
+  shared = summary_dedup.find_shared(user_email, bodies, keys, CACHE_MODELS)
+  for msg_id, (summary, model) in shared.items():
+    summary_cache.put(keys[msg_id], summary, model)
+  return {msg_id: summary for msg_id, (summary, _) in shared.items()}
+
+
+def _summarize_and_store(body: str, timeout: Optional[float], key) -> str:
+  summary, model = _summarize_uncached(body, timeout)
+  if key is not None and model is not None and _is_cacheable(summary):
+    _cache_summary(key, summary, model)
   return summary
 
 
-def generate_reply(subject: str, from_line: str, body: str, user_name: Optional[str] = None) -> str:
+# A batched "summary" longer than this is treated as malformed
+SUMMARY_MAX_CHARS = 1000
+
+
+def _plan_summary_batches(bodies: Dict[str, str]) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+  """
+  Split {message_id: body} into batches for one-call summarization.
+  Returns ([{message_id: cleaned body}, ...], {message_id: body} left to
+  summarize one by one): empty bodies, bodies larger than the token budget
+  and batches that would hold a single email take the per-message path.
+  """
+  if SUMMARY_BATCH_SIZE <= 1 or len(bodies) < 2:
+    return [], dict(bodies)
+
+  batches: List[Dict[str, str]] = []
+  singles: Dict[str, str] = {}
+  current: Dict[str, str] = {}
+  prepared: Dict[str, prompt_builder.PreparedBody] = {}
+  used = 0
+  for msg_id, body in bodies.items():
+    prepared[msg_id] = _prepare_summary_body(body, record_stats=False)
+    cleaned = prepared[msg_id].text
+    tokens = estimate_tokens(SUMMARY_BATCH_ITEM_TEMPLATE.format(id=msg_id, body=cleaned))
+    if not cleaned or tokens > SUMMARY_BATCH_TOKEN_BUDGET:
+      singles[msg_id] = body
+      continue
+    if current and (len(current) >= SUMMARY_BATCH_SIZE or used + tokens > SUMMARY_BATCH_TOKEN_BUDGET):
+      batches.append(current)
+      current, used = {}, 0
+    current[msg_id] = cleaned
+    used += tokens
+  if current:
+    batches.append(current)
+
+  for batch in [b for b in batches if len(b) == 1]:
+    batches.remove(batch)
+    msg_id = next(iter(batch))
+    singles[msg_id] = bodies[msg_id]
+  # Singles are counted when their own prompt is built
+  for batch in batches:
+    for msg_id in batch:
+      prompt_builder.record(prepared[msg_id])
+  return batches, singles
+
+
+def _batch_summary_prompt(batch: Dict[str, str]) -> str:
+  items = "".join(SUMMARY_BATCH_ITEM_TEMPLATE.format(id=msg_id, body=body) for msg_id, body in batch.items())
+  return SUMMARY_BATCH_USER_TEMPLATE.format(items=items, ids=", ".join(batch))
+
+
+def _parse_batch_summaries(text: str, message_ids) -> Dict[str, str]:
+  """Valid summaries from a batched JSON answer; missing or malformed entries are left out."""
+  try:
+    data = json.loads(text)
+  except ValueError:
+    # Models sometimes wrap the object in prose or a code fence
+    match = re.search(r"\{.*\}", text, re.S)
+    try:
+      data = json.loads(match.group(0)) if match else None
+    except ValueError:
+      data = None
+  if isinstance(data, dict) and isinstance(data.get("summaries"), dict):
+    data = data["summaries"]
+  if not isinstance(data, dict):
+    return {}
+
+  results = {}
+  for msg_id in message_ids:
+    summary = data.get(msg_id)
+    if not isinstance(summary, str):
+      continue
+    summary = summary.strip()
+    if summary and len(summary) <= SUMMARY_MAX_CHARS and _is_cacheable(summary):
+      results[msg_id] = summary
+  return results
+
+
+def _store_batch_summaries(batch: Dict[str, str], text: str, model: Optional[str], keys) -> Optional[Dict[str, str]]:
+  """Parse and cache a batched answer by `model`; None if the call itself failed (no model)."""
+  if model is None:
+    return None
+  summaries = _parse_batch_summaries(text, batch)
+  if len(summaries) < len(batch):
+    print(f"summarize batch: {len(batch) - len(summaries)} of {len(batch)} summaries missing or malformed")
+  for msg_id, summary in summaries.items():
+    if keys.get(msg_id) is not None:
+      _cache_summary(keys[msg_id], summary, model)
+  return summaries
+
+
+def _summarize_batch_and_store(batch: Dict[str, str], timeout: Optional[float], keys) -> Optional[Dict[str, str]]:
+  """
+  Summarize a batch of cleaned bodies with one model call.
+  Returns {message_id: summary} for the valid entries, or None if the call failed.
+  """
+  text, model = _complete(
+    SUMMARY_BATCH_SYSTEM_PROMPT,
+    _batch_summary_prompt(batch),
+    max_tokens=SUMMARY_MAX_TOKENS * len(batch),
+    timeout=timeout,
+    json_mode=True,
+  )
+  return _store_batch_summaries(batch, text, model, keys)
+
+
+def summarize_email(
+  body: str,
+  timeout: Optional[float] = None,
+  user_email: Optional[str] = None,
+  message_id: Optional[str] = None,
+) -> str:
   """
-  Generate a professional reply to an email using LLaMA 3.1 via Groq.
+  Summarize an email into a short, human-friendly summary (not just truncation).
   We:
   - Clean HTML
-  - Truncate long threads
+  - Truncate long bodies to keep under token limits
+  When `user_email` and `message_id` are given, the summary cache is read
+  first (then summaries of duplicate mail), and successful summaries are
+  written back to it.
+  """
+  key = _summary_key(user_email, message_id, body)
+  if key is not None:
+    cached = summary_cache.get(key, CACHE_MODELS)
+    if cached is not None:
+      return cached
+    shared = _shared_summaries({message_id: body}, {message_id: key}, user_email)
+    if shared:
+      return shared[message_id]
+  return _summarize_and_store(body, timeout, key)
+
+
+def cached_summaries(bodies: Dict[str, str], user_email: Optional[str]) -> Dict[str, str]:
+  """Summaries already in the cache for these {message_id: body}; never calls the model."""
+  keys = {msg_id: _summary_key(user_email, msg_id, body) for msg_id, body in bodies.items()}
+  found = summary_cache.get_many([k for k in keys.values() if k is not None], CACHE_MODELS)
+  return {msg_id: found[key] for msg_id, key in keys.items() if key in found}
+
+
+def summarize_many(
+  bodies: Dict[str, str],
+  fallbacks: Dict[str, str],
+  timeout: float = SUMMARY_TIMEOUT_SECONDS,
+  user_email: Optional[str] = None,
+) -> Tuple[Dict[str, str], Dict[str, int]]:
+  """
+  Summarize several emails concurrently on the shared summary pool.
+
+  `bodies` and `fallbacks` are keyed by message id. Cached summaries, and
+  summaries of duplicate mail (summary_dedup.py), are returned straight
+  away. The rest are packed into batches summarized with
+  one model call each (see _plan_summary_batches); emails that don't fit a
+  batch, or whose batched summary is missing or malformed, get their own
+  call. Every call gets `timeout` seconds, and anything that fails or isn't
+  done by then gets its fallback (usually a snippet preview) so one slow
+  summary never holds up the page.
+
+  Returns (summaries, {"hits": n, "shared": n, "misses": n}); misses are
+  the emails that needed the model.
   """
-  cleaned_body = clean_email_body(body or "")
-  cleaned_body = truncate_for_model(cleaned_body, max_chars=8000)
+  if not bodies:
+    return {}, {"hits": 0, "shared": 0, "misses": 0}
+
+  keys = {msg_id: _summary_key(user_email, msg_id, body) for msg_id, body in bodies.items()}
+  cached = summary_cache.get_many([k for k in keys.values() if k is not None], CACHE_MODELS)
+
+  results: Dict[str, str] = {}
+  for msg_id, key in keys.items():
+    if key is not None and key in cached:
+      results[msg_id] = cached[key]
+  pending = {msg_id: body for msg_id, body in bodies.items() if msg_id not in results}
+  shared = _shared_summaries(pending, keys, user_email)
+  stats = {"hits": len(results), "shared": len(shared), "misses": len(pending) - len(shared)}
+  results.update(shared)
+
+  pending = {msg_id: body for msg_id, body in pending.items() if msg_id not in shared}
+  batches, singles = _plan_summary_batches(pending)
+  if batches:
+    batch_futures = {
+      _summary_pool.submit(_summarize_batch_and_store, batch, timeout, keys): batch
+      for batch in batches
+    }
+    waves = -(-len(batch_futures) // max(1, SUMMARY_CONCURRENCY))
+    done, not_done = wait(batch_futures, timeout=timeout * waves)
+    for fut, batch in batch_futures.items():
+      if fut not in done:
+        # Slow provider: more calls won't be faster, show the previews
+        print(f"summarize_many: batch of {len(batch)} timed out")
+        for msg_id in batch:
+          results[msg_id] = fallbacks.get(msg_id, "")
+        continue
+      # None means the batch call failed: every email gets its own call
+      summaries = fut.result() or {}
+      results.update(summaries)
+      singles.update({msg_id: pending[msg_id] for msg_id in batch if msg_id not in summaries})
+
+  futures = {
+    _summary_pool.submit(_summarize_and_store, body, timeout, keys[msg_id]): msg_id
+    for msg_id, body in singles.items()
+  }
+  if not futures:
+    return results, stats
+
+  # Calls beyond the pool size queue up, so give the page one extra
+  # timeout per "wave" of SUMMARY_CONCURRENCY calls.
+  waves = -(-len(futures) // max(1, SUMMARY_CONCURRENCY))
+  done, not_done = wait(futures, timeout=timeout * waves)
+
+  for fut, msg_id in futures.items():
+    if fut in done:
+      try:
+        results[msg_id] = fut.result()
+        continue
+      except Exception as e:
+        print(f"summarize_many: summary failed for {msg_id}", repr(e))
+    else:
+      # Left running on purpose: when it finishes, the summary still lands
+      # in the cache for the next page load.
+      print(f"summarize_many: summary timed out for {msg_id}")
+    results[msg_id] = fallbacks.get(msg_id, "")
+
+  return results, stats
+
+
+def _reply_prompts(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  thread_summary: Optional[str] = None,
+) -> Tuple[str, str]:
+  """
+  (system, user) prompts for a reply to one email, with the summary of the
+  earlier messages in its thread when there is one.
+  """
+  name_part = f" The user's name is {user_name}." if user_name else ""
+  thread_part = f"\nEarlier in this thread (summary):\n{thread_summary}\n" if thread_summary else ""
 
-  system = (
-    "You are an AI email assistant. You write polite, concise, and professional email replies. "
-    "Assume the user wants to respond helpfully, unless the email is spam or irrelevant."
+  def user_prompt(email_body: str) -> str:
+    return REPLY_USER_TEMPLATE.format(
+      from_line=from_line, subject=subject, thread_part=thread_part, body=email_body, name_part=name_part,
+    )
+
+  cleaned_body = prompt_builder.prepare_body(body, _body_budget(REPLY_SYSTEM_PROMPT, user_prompt(""))).text
+  return REPLY_SYSTEM_PROMPT, user_prompt(cleaned_body)
+
+
+def _reply_fallback(user_name: Optional[str] = None) -> str:
+  """Template reply used when the model can't produce one."""
+  return (
+    "Hi,\n\n"
+    "Thank you for your email. I will review the details and get back to you soon.\n\n"
+    "Best regards,\n"
+    f"{user_name or 'Regards'}"
   )
 
-  name_part = f" The user's name is {user_name}." if user_name else ""
 
-  user = textwrap.dedent(
-    f"""
-    You are replying to this email.
+async def _summarize_and_store_async(body: str, timeout: Optional[float], key) -> str:
+  summary, model = await _summarize_uncached_async(body, timeout)
+  if key is not None and model is not None and _is_cacheable(summary):
+    await to_thread.run_sync(_cache_summary, key, summary, model)
+  return summary
+
+
+async def _summarize_batch_and_store_async(
+  batch: Dict[str, str],
+  timeout: Optional[float],
+  keys,
+) -> Optional[Dict[str, str]]:
+  text, model = await _complete_async(
+    SUMMARY_BATCH_SYSTEM_PROMPT,
+    _batch_summary_prompt(batch),
+    max_tokens=SUMMARY_MAX_TOKENS * len(batch),
+    timeout=timeout,
+    json_mode=True,
+    hedge=True,
+  )
+  return await to_thread.run_sync(_store_batch_summaries, batch, text, model, keys)
+
+
+# Shared across requests like _summary_pool, but for the event loop.
+_async_summary_slots: Optional[asyncio.Semaphore] = None
 
-    From: {from_line}
-    Subject: {subject}
 
-    Email body:
-    ---
-    {cleaned_body}
-    ---
+def _summary_slots() -> asyncio.Semaphore:
+  global _async_summary_slots
+  if _async_summary_slots is None:
+    _async_summary_slots = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+  return _async_summary_slots
 
-    {name_part}
 
-    Write a clear, professional reply that:
-    - Is appropriate for the context
-    - Uses a friendly but professional tone
-    - Can be sent as-is from the user
-    - Does NOT include a subject line (only the email body)
+async def summarize_many_async(
+  bodies: Dict[str, str],
+  fallbacks: Dict[str, str],
+  timeout: float = SUMMARY_TIMEOUT_SECONDS,
+  user_email: Optional[str] = None,
+) -> Tuple[Dict[str, str], Dict[str, int]]:
+  """
+  Async summarize_many: same cache, batching, fallbacks and return value,
+  with the model calls bounded by an asyncio semaphore instead of the thread pool.
+  """
+  if not bodies:
+    return {}, {"hits": 0, "shared": 0, "misses": 0}
 
-    Reply:
-    """
+  keys = {msg_id: _summary_key(user_email, msg_id, body) for msg_id, body in bodies.items()}
+  cached = await to_thread.run_sync(
+    summary_cache.get_many, [k for k in keys.values() if k is not None], CACHE_MODELS,
   )
 
-  reply = _call_groq(system, user, max_tokens=300)
+  results: Dict[str, str] = {}
+  for msg_id, key in keys.items():
+    if key is not None and key in cached:
+      results[msg_id] = cached[key]
+  pending = {msg_id: body for msg_id, body in bodies.items() if msg_id not in results}
+  shared = await to_thread.run_sync(_shared_summaries, pending, keys, user_email)
+  stats = {"hits": len(results), "shared": len(shared), "misses": len(pending) - len(shared)}
+  results.update(shared)
+
+  async def run_batch(batch: Dict[str, str]) -> Optional[Dict[str, str]]:
+    async with _summary_slots():
+      return await _summarize_batch_and_store_async(batch, timeout, keys)
+
+  async def run(body: str, key) -> str:
+    async with _summary_slots():
+      return await _summarize_and_store_async(body, timeout, key)
+
+  pending = {msg_id: body for msg_id, body in pending.items() if msg_id not in shared}
+  batches, singles = _plan_summary_batches(pending)
+  if batches:
+    batch_tasks = {asyncio.ensure_future(run_batch(batch)): i for i, batch in enumerate(batches)}
+    waves = -(-len(batch_tasks) // max(1, SUMMARY_CONCURRENCY))
+    done, not_done = await asyncio.wait(batch_tasks, timeout=timeout * waves)
+    for task, i in batch_tasks.items():
+      batch = batches[i]
+      if task not in done:
+        print(f"summarize_many_async: batch of {len(batch)} timed out")
+        for msg_id in batch:
+          results[msg_id] = fallbacks.get(msg_id, "")
+        continue
+      summaries = task.result() or {}
+      results.update(summaries)
+      singles.update({msg_id: pending[msg_id] for msg_id in batch if msg_id not in summaries})
+
+  tasks = {
+    asyncio.ensure_future(run(body, keys[msg_id])): msg_id
+    for msg_id, body in singles.items()
+  }
+  if not tasks:
+    return results, stats
+
+  waves = -(-len(tasks) // max(1, SUMMARY_CONCURRENCY))
+  done, not_done = await asyncio.wait(tasks, timeout=timeout * waves)
+
+  for task, msg_id in tasks.items():
+    if task in done:
+      try:
+        results[msg_id] = task.result()
+        continue
+      except Exception as e:
+        print(f"summarize_many_async: summary failed for {msg_id}", repr(e))
+    else:
+      # Left running so the summary still lands in the cache.
+      print(f"summarize_many_async: summary timed out for {msg_id}")
+    results[msg_id] = fallbacks.get(msg_id, "")
+
+  return results, stats
+
+
+def generate_reply(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  thread_summary: Optional[str] = None,
+) -> str:
+  """
+  Generate a professional reply to an email (LLaMA 3.1 via Groq, or OpenAI; see llm_router.py).
+  We:
+  - Clean HTML
+  - Truncate long threads
+  """
+  system, user = _reply_prompts(subject, from_line, body, user_name, thread_summary)
+
+  reply = _call_llm(system, user, max_tokens=REPLY_MAX_TOKENS)
 
   if reply.startswith("AI model error"):
     # Fallback: at least give the user a template instead of nothing
-    return (
-      "Hi,\n\n"
-      "Thank you for your email. I will review the details and get back to you soon.\n\n"
-      "Best regards,\n"
-      f"{user_name or 'Regards'}"
-    )
+    return _reply_fallback(user_name)
 
   return reply
+
+
+def stream_reply(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  thread_summary: Optional[str] = None,
+) -> Iterator[Tuple[str, str]]:
+  """
+  Streaming version of generate_reply. Yields (event, text) pairs:
+  - ("token", chunk) for each piece of text as the model produces it
+  - ("done", full_reply) at the end
+  If the model fails, before or partway through, it yields ("error", message)
+  and ("fallback", template) before ("done", template), so the client can
+  replace whatever it has shown so far.
+  """
+  if not llm_router.available():
+    yield "error", "AI model unavailable (missing GROQ_API_KEY / OPENAI_API_KEY)."
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+
+  system, user = _reply_prompts(subject, from_line, body, user_name, thread_summary)
+
+  parts = []
+  try:
+    # Retries and failover only happen before the first token.
+    for text in llm_router.stream(system, user, max_tokens=REPLY_MAX_TOKENS):
+      parts.append(text)
+      yield "token", text
+  except Exception as e:
+    print("LLM API stream error:", repr(e))
+    yield "error", "AI model error. Please try again later."
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+
+  reply = "".join(parts).strip()
+  if not reply:
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+  yield "done", reply
+
+
+async def draft_reply_async(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  hedge: bool = False,
+  thread_summary: Optional[str] = None,
+) -> Optional[str]:
+  """
+  The model's reply to an email, or None if it couldn't make one
+  (no fallback template, so callers can tell the two apart).
+  """
+  system, user = _reply_prompts(subject, from_line, body, user_name, thread_summary)
+
+  reply = await _call_llm_async(system, user, max_tokens=REPLY_MAX_TOKENS, hedge=hedge)
+
+  if reply.startswith("AI model error"):
+    return None
+
+  return reply
+
+
+async def generate_reply_async(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  thread_summary: Optional[str] = None,
+) -> str:
+  """
+  Async generate_reply.
+  """
+  # The user is waiting on this one
+  reply = await draft_reply_async(subject, from_line, body, user_name, hedge=True, thread_summary=thread_summary)
+  if reply is None:
+    return _reply_fallback(user_name)
+
+  return reply
+
+
+async def stream_reply_async(
+  subject: str,
+  from_line: str,
+  body: str,
+  user_name: Optional[str] = None,
+  thread_summary: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, str]]:
+  """
+  Async stream_reply: same (event, text) sequence, read from the async clients so a
+  long-running stream doesn't hold a worker thread.
+  """
+  if not llm_router.available():
+    yield "error", "AI model unavailable (missing GROQ_API_KEY / OPENAI_API_KEY)."
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+
+  system, user = _reply_prompts(subject, from_line, body, user_name, thread_summary)
+
+  parts = []
+  try:
+    async for text in llm_router.stream_async(system, user, max_tokens=REPLY_MAX_TOKENS):
+      parts.append(text)
+      yield "token", text
+  except Exception as e:
+    print("LLM API stream error:", repr(e))
+    yield "error", "AI model error. Please try again later."
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+
+  reply = "".join(parts).strip()
+  if not reply:
+    fallback = _reply_fallback(user_name)
+    yield "fallback", fallback
+    yield "done", fallback
+    return
+  yield "done", reply
+
+
+def _thread_item(row: Dict[str, str]) -> str:
+  body = prompt_builder.prepare_body(row.get("body") or "", THREAD_MESSAGE_MAX_TOKENS, record_stats=False).text
+  return THREAD_MESSAGE_TEMPLATE.format(from_line=row.get("from") or "", body=body or "(no text)")
+
+
+def plan_thread_folds(rows: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+  """
+  Split thread messages (oldest first, in the stored-row shape) into the
+  batches fold_thread_async takes one at a time: each fits the model's
+  input budget next to a full-size running summary.
+  """
+  budget = (
+    input_budget(MODEL_NAME)
+    - estimate_tokens(THREAD_SYSTEM_PROMPT, THREAD_FOLD_USER_TEMPLATE.format(summary="", messages=""))
+    - THREAD_SUMMARY_MAX_TOKENS
+  )
+  batches: List[List[Dict[str, str]]] = []
+  used = 0
+  for row in rows:
+    tokens = estimate_tokens(_thread_item(row))
+    if not batches or used + tokens > budget:
+      batches.append([])
+      used = 0
+    batches[-1].append(row)
+    used += tokens
+  return batches
+
+
+def thread_fold_tokens(batches: List[List[Dict[str, str]]]) -> int:
+  """Estimated tokens of folding these batches: each prompt with a full-size summary, and its answer."""
+  return sum(
+    estimate_tokens(
+      THREAD_SYSTEM_PROMPT,
+      THREAD_FOLD_USER_TEMPLATE.format(summary="", messages="".join(_thread_item(row) for row in batch)),
+    )
+    + 2 * THREAD_SUMMARY_MAX_TOKENS
+    for batch in batches
+  )
+
+
+async def fold_thread_async(summary: str, rows: List[Dict[str, str]]) -> Optional[Tuple[str, str]]:
+  """
+  (the thread summary rewritten to also cover `rows` (one batch from
+  plan_thread_folds), model that wrote it), or None if the model failed.
+  """
+  user = THREAD_FOLD_USER_TEMPLATE.format(
+    summary=summary or "(no messages yet)",
+    messages="".join(_thread_item(row) for row in rows),
+  )
+  # Someone is waiting for the reply this is for
+  text, model = await _complete_async(THREAD_SYSTEM_PROMPT, user, max_tokens=THREAD_SUMMARY_MAX_TOKENS, hedge=True)
+  if model is None or not text.strip():
+    return None
+  return text.strip(), model
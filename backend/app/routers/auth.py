@@ -3,7 +3,8 @@ from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse, JSONResponse
 from google.oauth2.credentials import Credentials
 from jose import jwt
-import requests, time, traceback
+from datetime import datetime, timedelta
+import time, traceback
 
 from ..config import (
     GOOGLE_CLIENT_ID,
@@ -13,8 +14,10 @@ from ..config import (
     JWT_SECRET,
     JWT_ALG,
 )
-from ..db import save_token
-from ..auth_utils import get_session_token
+from ..db import save_token_async
+from ..auth_utils import get_session_token, forget_credentials, token_entry_from_credentials
+from ..gmail_async import get_client
+from ..metrics import span
 
 router = APIRouter()
 
@@ -53,7 +56,7 @@ def login():
 
 
 @router.get("/callback")
-def callback(request: Request):
+async def callback(request: Request):
     # Handle OAuth errors
     params = dict(request.query_params)
     if "error" in params:
@@ -80,7 +83,7 @@ def callback(request: Request):
     }
 
     try:
-        token_resp = requests.post(token_url, data=data, timeout=10)
+        token_resp = await get_client().post(token_url, data=data, timeout=10)
         token_json = token_resp.json()
     except Exception as e:
         print("Token POST failed:", e)
@@ -98,11 +101,16 @@ def callback(request: Request):
         client_id=GOOGLE_CLIENT_ID,
         client_secret=GOOGLE_CLIENT_SECRET,
         scopes=token_json.get("scope").split() if token_json.get("scope") else None,
+        expiry=(
+            datetime.utcnow() + timedelta(seconds=int(token_json["expires_in"]))
+            if token_json.get("expires_in")
+            else None
+        ),
     )
 
     # Fetch userinfo
     try:
-        resp = requests.get(
+        resp = await get_client().get(
             "https://www.googleapis.com/oauth2/v2/userinfo",
             headers={"Authorization": f"Bearer {creds.token}"},
             timeout=10,
@@ -123,15 +131,8 @@ def callback(request: Request):
 
     # Save tokens in DB
     try:
-        token_entry = {
-            "token": creds.token,
-            "refresh_token": creds.refresh_token,
-            "token_uri": creds.token_uri,
-            "client_id": GOOGLE_CLIENT_ID,
-            "client_secret": GOOGLE_CLIENT_SECRET,
-            "scopes": creds.scopes or [],
-        }
-        save_token(user_email, token_entry)
+        await save_token_async(user_email, token_entry_from_credentials(creds))
+        forget_credentials(user_email)
     except Exception as e:
         print("Failed to save token to DB:", e)
         traceback.print_exc()
@@ -159,7 +160,7 @@ def callback(request: Request):
 
 
 @router.get("/me")
-def me(request: Request):
+async def me(request: Request):
     """
     Return basic user info from the session.
     Accepts session from cookie OR Authorization header.
@@ -169,7 +170,8 @@ def me(request: Request):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        with span("jwt_decode"):
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
     except Exception as e:
         print("auth /me decode error:", e)
         raise HTTPException(status_code=401, detail="Invalid session")
@@ -1,169 +1,373 @@
 # app/routers/gmail.py
-from typing import List, Dict, Any, Optional
-from base64 import urlsafe_b64decode, urlsafe_b64encode
-from email.mime.text import MIMEText
+import hashlib
+import json
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+
+from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from google.oauth2.credentials import Credentials
+from ..auth_utils import (
+    get_session_token,
+    get_session_email,
+    get_credentials_for_email_async,
+)
+from ..config import GMAIL_MAX_PAGE_SIZE
+from .. import (
+    db, gmail_async, gmail_service, mail_sync, message_cache, mime_body, prompt_builder, reply_drafts, summary_cache,
+    summary_dedup, thread_context, triage,
+)
+from ..message_cache import ParsedMessage
+from ..outbox import outbox_worker
+from ..metrics import span
+from ..gmail_async import GmailAPIError
+from ..gmail_service import get_header
+from .ai import cached_summaries, summarize_many_async, generate_reply_async, stream_reply_async
 
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse
-from googleapiclient.discovery import build
+router = APIRouter()
 
-from ..auth_utils import get_session_token, refresh_credentials_if_needed
-from .ai import summarize_email, generate_reply
 
-router = APIRouter()
+def _get_user_email(request: Request) -> Optional[str]:
+    """Email of the signed-in user, used to key per-user caches."""
+    return get_session_email(get_session_token(request))
 
 
-def _get_gmail_service(request: Request):
+async def _get_credentials(request: Request) -> Tuple[str, Credentials]:
     """
-    Build an authenticated Gmail service using the session token (cookie or Authorization header).
+    (user email, valid credentials) for the signed-in user, or a 401.
     """
-    session_token = get_session_token(request)
-    creds = refresh_credentials_if_needed(session_token)
+    user_email = _get_user_email(request)
+    creds = await get_credentials_for_email_async(user_email) if user_email else None
     if not creds:
         raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
-    service = build("gmail", "v1", credentials=creds)
-    return service, creds
-
+    return user_email, creds
 
-def _get_header(headers: List[Dict[str, str]], name: str) -> str:
-    for h in headers:
-        if h.get("name", "").lower() == name.lower():
-            return h.get("value", "")
-    return ""
 
+def _gmail_http_error(e: Exception, route: str, default_status: int, detail: str) -> HTTPException:
+    print(f"DEBUG {route} error:", e)
+    if isinstance(e, GmailAPIError) and e.status == 401:
+        return HTTPException(status_code=401, detail="Not authenticated or token invalid.")
+    return HTTPException(status_code=default_status, detail=detail)
 
-def _extract_body_from_message(msg: Dict[str, Any]) -> str:
-    """
-    Try to extract a readable body from a Gmail message payload.
-    Prefers text/plain, falls back to text/html (stripped) if needed.
-    """
-    payload = msg.get("payload", {})
-    body = ""
 
-    def walk_parts(part: Dict[str, Any]) -> Optional[str]:
-        mime_type = part.get("mimeType", "")
-        data = part.get("body", {}).get("data")
-        if data and ("text/plain" in mime_type or "text/html" in mime_type):
-            try:
-                decoded = urlsafe_b64decode(data.encode("utf-8")).decode("utf-8", errors="ignore")
-                return decoded
-            except Exception:
-                return None
+def _sync_and_list(user_email: str, creds: Credentials, limit: int) -> List[Dict[str, Any]]:
+    """Incremental sync + local listing; blocking, so run in a worker thread."""
+    service = gmail_service.get_service(user_email, creds)
+    mail_sync.sync_mailbox(user_email, service)
+    with span("store_read"):
+        return db.list_messages(user_email, label="INBOX", limit=limit)
 
-        for sub in part.get("parts", []) or []:
-            res = walk_parts(sub)
-            if res:
-                return res
-        return None
 
-    body = walk_parts(payload) or ""
-    return body
+async def _message_row(creds: Credentials, msg: Dict[str, Any]) -> Dict[str, Any]:
+    """mail_sync.message_to_row, first loading a body Gmail stores as an attachment."""
+    attachment_id = mime_body.pending_attachment_id(msg)
+    data = None
+    if attachment_id:
+        try:
+            data = (await gmail_async.get_attachment(creds, msg["id"], attachment_id)).get("data")
+        except Exception as e:
+            print(f"DEBUG failed to fetch body attachment of {msg.get('id')}", e)
+    return mail_sync.message_to_row(msg, fetch_attachment=(lambda _id: data) if data else None)
 
 
-@router.get("/last5")
-def last5(request: Request):
+async def _fetch_inbox_direct(creds: Credentials, limit: int) -> List[Dict[str, Any]]:
     """
-    Fetch the 5 most recent emails from the user's inbox.
-    For each email, return: id, subject, from, snippet, body, and AI summary.
+    List + batch-fetch the newest inbox messages straight from Gmail.
+    Used when the local store can't be synced.
     """
     try:
-        service, creds = _get_gmail_service(request)
-    except HTTPException:
-        raise
-    except Exception as e:
-        print("DEBUG /gmail/last5: failed to build service", e)
-        raise HTTPException(status_code=500, detail="Failed to initialize Gmail service")
-
-    try:
-        list_resp = (
-            service.users()
-            .messages()
-            .list(userId="me", labelIds=["INBOX"], maxResults=5)
-            .execute()
-        )
+        list_resp = await gmail_async.list_messages(creds, labelIds=["INBOX"], maxResults=limit)
     except Exception as e:
-        print("DEBUG /gmail/last5 list error:", e)
-        raise HTTPException(status_code=500, detail="Failed to list emails")
+        raise _gmail_http_error(e, "/gmail/last5 list", 500, "Failed to list emails")
 
     msgs_meta = list_resp.get("messages", []) or []
+    msg_ids = [meta["id"] for meta in msgs_meta if meta.get("id")]
+    fetched = await gmail_async.batch_get_messages(creds, msg_ids)
 
     results = []
-    for meta in msgs_meta:
-        msg_id = meta.get("id")
-        if not msg_id:
+    for msg_id in msg_ids:
+        full = fetched.get(msg_id)
+        if not full:
             continue
 
         try:
-            full = (
-                service.users()
-                .messages()
-                .get(userId="me", id=msg_id, format="full")
-                .execute()
-            )
-            headers = full.get("payload", {}).get("headers", [])
-            subject = _get_header(headers, "Subject") or "(no subject)"
-            from_line = _get_header(headers, "From")
-            snippet = full.get("snippet", "")
-
-            body_text = _extract_body_from_message(full)
-
-            # AI summary via Groq
-            try:
-                summary = summarize_email(body_text)
-            except Exception as ai_err:
-                print(f"DEBUG /gmail/last5: AI summarize failed for {msg_id}", ai_err)
-                summary = f"AI summary unavailable. Preview: {snippet[:140]}"
-
-            results.append(
-                {
-                    "id": msg_id,
-                    "subject": subject,
-                    "from": from_line,
-                    "snippet": snippet,
-                    "body": body_text,
-                    "summary": summary,
-                }
-            )
-
+            results.append(await _message_row(creds, full))
         except Exception as e:
             print(f"DEBUG /gmail/last5: failed to parse message {msg_id}", e)
             continue
 
-    return {"messages": results}
+    return results
 
 
-@router.post("/generate-reply/{message_id}")
-def generate_reply_for_message(message_id: str, request: Request):
+@router.get("/last5")
+async def last5(
+    request: Request,
+    limit: int = Query(5, ge=1, le=GMAIL_MAX_PAGE_SIZE),
+):
     """
-    Generate a proposed reply (AI) for a given email message ID.
+    Fetch the most recent emails from the user's inbox (5 by default, `limit` to change).
+    For each email, return: id, subject, from, snippet, body, triage category
+    and AI summary. The inbox is read from the local store after an
+    incremental sync. Categories routed away from the model (see triage.py)
+    get an extractive summary instead.
     """
+    user_email, creds = await _get_credentials(request)
+
     try:
-        service, creds = _get_gmail_service(request)
-    except HTTPException:
-        raise
+        # The sync engine is built on googleapiclient, so it runs in a worker thread.
+        rows = await run_in_threadpool(_sync_and_list, user_email, creds, limit)
     except Exception as e:
-        print("DEBUG /gmail/generate-reply: failed to build service", e)
-        raise HTTPException(status_code=500, detail="Failed to initialize Gmail service")
+        print("DEBUG /gmail/last5: sync failed, fetching from Gmail directly", e)
+        rows = await _fetch_inbox_direct(creds, limit)
+
+    # Reply/send/body routes reuse these instead of refetching the message
+    records = [ParsedMessage.from_row(row) for row in rows]
+    message_cache.put_many(user_email, records)
+    # Opt-in: draft replies to the top few in the background
+    reply_drafts.speculate(user_email, records, creds=creds)
+
+    results = [
+        {
+            "id": row["id"],
+            "subject": row["subject"] or "(no subject)",
+            "from": row["from"] or "",
+            "snippet": row["snippet"] or "",
+            "body": row["body"] or "",
+        }
+        for row in rows
+    ]
+
+    with span("triage"):
+        triaged, extracted = triage.route(rows)
+
+    # AI summaries for the rest: cached ones first, the others run
+    # concurrently with a per-call timeout
+    summaries, cache_stats = await summarize_many_async(
+        {m["id"]: m["body"] for m in results if m["id"] not in extracted},
+        {m["id"]: f"AI summary unavailable. Preview: {m['snippet'][:140]}" for m in results},
+        user_email=user_email,
+    )
+    summaries.update(extracted)
+    cache_stats["triaged"] = len(extracted)
+    for m in results:
+        m["summary"] = summaries.get(m["id"], "")
+        m["category"] = triaged[m["id"]].category if m["id"] in triaged else None
+
+    return {"messages": results, "summary_cache": cache_stats}
+
+
+# Gmail partial responses: only what the listing shows
+_LIST_FIELDS = "messages(id),nextPageToken,resultSizeEstimate"
+_METADATA_FIELDS = "id,threadId,labelIds,snippet,internalDate,payload/headers"
+
+
+@router.get("/messages")
+async def list_messages(
+    request: Request,
+    page_token: Optional[str] = Query(None, alias="pageToken"),
+    page_size: int = Query(20, alias="pageSize", ge=1, le=GMAIL_MAX_PAGE_SIZE),
+    q: Optional[str] = Query(None),
+    label: Optional[str] = Query("INBOX"),
+):
+    """
+    Paginated inbox listing without bodies: id, threadId, subject, from, date,
+    snippet, labels, and the AI summary if one is already cached.
+    Accepts Gmail search syntax in `q`; pass `nextPageToken` back as `pageToken`.
+    Use /gmail/messages/{id}/body to load a body when a message is opened.
+    """
+    user_email, creds = await _get_credentials(request)
 
+    list_params: Dict[str, Any] = {"maxResults": page_size, "fields": _LIST_FIELDS}
+    if page_token:
+        list_params["pageToken"] = page_token
+    if q:
+        list_params["q"] = q
+    if label:
+        list_params["labelIds"] = [label]
+
+    try:
+        list_resp = await gmail_async.list_messages(creds, **list_params)
+    except Exception as e:
+        raise _gmail_http_error(e, "/gmail/messages list", 500, "Failed to list emails")
+
+    msg_ids = [m["id"] for m in list_resp.get("messages", []) or [] if m.get("id")]
+    fetched = await gmail_async.batch_get_messages(
+        creds,
+        msg_ids,
+        fmt="metadata",
+        metadataHeaders=["Subject", "From", "Date"],
+        fields=_METADATA_FIELDS,
+    )
+
+    # Summaries are only attached when already cached for the stored body;
+    # listing a page never triggers LLM calls.
     try:
-        full = (
-            service.users()
-            .messages()
-            .get(userId="me", id=message_id, format="full")
-            .execute()
+        stored = await db.get_messages_async(user_email, msg_ids)
+    except Exception as e:
+        print("DEBUG /gmail/messages: local store lookup failed", e)
+        stored = {}
+    summaries = await run_in_threadpool(
+        cached_summaries,
+        {mid: row["body"] for mid, row in stored.items() if row.get("body")},
+        user_email,
+    )
+
+    results = []
+    for msg_id in msg_ids:
+        meta = fetched.get(msg_id)
+        if not meta:
+            continue
+        headers = meta.get("payload", {}).get("headers", [])
+        results.append(
+            {
+                "id": msg_id,
+                "threadId": meta.get("threadId"),
+                "subject": get_header(headers, "Subject") or "(no subject)",
+                "from": get_header(headers, "From"),
+                "date": get_header(headers, "Date"),
+                "snippet": meta.get("snippet", ""),
+                "labelIds": meta.get("labelIds", []),
+                "summary": summaries.get(msg_id),
+            }
         )
+
+    return {
+        "messages": results,
+        "nextPageToken": list_resp.get("nextPageToken"),
+        "resultSizeEstimate": list_resp.get("resultSizeEstimate"),
+    }
+
+
+@router.get("/search")
+async def search_messages(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    page_size: int = Query(20, alias="pageSize", ge=1, le=GMAIL_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    label: Optional[str] = Query(None),
+):
+    """
+    Full-text search over the locally synced mail (subject, sender, body and
+    AI summary), best match first. No Gmail calls: only messages the sync has
+    stored are found. `q` takes words, "quoted phrases", OR and -excluded
+    words; pass `nextOffset` back as `offset` for the next page.
+    """
+    user_email = _get_user_email(request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
+
+    try:
+        with span("search"):
+            # One extra row says whether there is a next page
+            rows = await run_in_threadpool(db.search_messages, user_email, q, page_size + 1, offset, label)
+    except Exception as e:
+        print("DEBUG /gmail/search error:", e)
+        raise HTTPException(status_code=500, detail="Search failed")
+
+    results = [
+        {
+            "id": row["id"],
+            "threadId": row["thread_id"],
+            "subject": row["subject"] or "(no subject)",
+            "from": row["from"] or "",
+            "internalDate": row["internal_date"],
+            "snippet": row["snippet"] or "",
+            "labelIds": row["label_ids"],
+            "summary": row["summary"],
+            "rank": row["rank"],
+        }
+        for row in rows[:page_size]
+    ]
+    return {
+        "messages": results,
+        "nextOffset": offset + page_size if len(rows) > page_size else None,
+    }
+
+
+@router.get("/messages/{message_id}/body")
+async def message_body(message_id: str, request: Request):
+    """
+    Body of a single message, loaded on demand (cache, local store, then Gmail).
+    """
+    msg = await _get_parsed_message(request, message_id, "/gmail/messages/body")
+    return {"id": message_id, "threadId": msg.thread_id, "body": msg.body}
+
+
+@router.get("/cache-stats")
+async def cache_stats(request: Request):
+    """
+    Cumulative cache counters for this backend process, plus the input
+    tokens saved by prompt preparation, the summaries shared between
+    duplicate emails and the triage decisions.
+    """
+    if not _get_user_email(request):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return {
+        "summaries": summary_cache.stats(),
+        "messages": message_cache.stats(),
+        "prompts": prompt_builder.stats(),
+        "reply_drafts": reply_drafts.stats(),
+        "shared_summaries": summary_dedup.stats(),
+        "triage": triage.stats(),
+    }
+
+
+async def _get_parsed_message(
+    request: Request,
+    message_id: str,
+    route: str,
+    creds: Optional[Credentials] = None,
+) -> ParsedMessage:
+    """
+    Return a parsed message from the shared message cache, the local store,
+    or (last resort) Gmail, caching whatever had to be loaded.
+    """
+    user_email = _get_user_email(request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
+
+    record = message_cache.get(user_email, message_id)
+    if record is not None:
+        return record
+
+    try:
+        row = (await db.get_messages_async(user_email, [message_id])).get(message_id)
     except Exception as e:
-        print("DEBUG /gmail/generate-reply get message error:", e)
-        raise HTTPException(status_code=404, detail="Email not found")
+        print(f"DEBUG {route}: local store lookup failed", e)
+        row = None
+
+    if row is None:
+        if creds is None:
+            user_email, creds = await _get_credentials(request)
+
+        try:
+            full = await gmail_async.get_message(creds, message_id, fmt="full")
+        except Exception as e:
+            raise _gmail_http_error(e, f"{route} get message", 404, "Email not found")
+        row = await _message_row(creds, full)
 
-    headers = full.get("payload", {}).get("headers", [])
-    subject = _get_header(headers, "Subject") or "(no subject)"
-    from_line = _get_header(headers, "From")
-    body_text = _extract_body_from_message(full)
+    record = ParsedMessage.from_row(row)
+    message_cache.put(user_email, record)
+    return record
 
-    # Generate reply using Groq
+
+@router.post("/generate-reply/{message_id}")
+async def generate_reply_for_message(message_id: str, request: Request):
+    """
+    Generate a proposed reply (AI) for a given email message ID, with a
+    summary of the earlier messages in its thread as context.
+    """
+    user_email, creds = await _get_credentials(request)
+    msg = await _get_parsed_message(request, message_id, "/gmail/generate-reply", creds=creds)
+
+    # Drafted speculatively after /last5?
+    draft = await reply_drafts.take(user_email, message_id)
+    if draft:
+        return {"reply": draft}
+
+    thread_summary = await thread_context.summary_for_reply(user_email, creds, msg.thread_id, message_id)
     try:
-        reply_text = generate_reply(subject, from_line, body_text)
+        reply_text = await generate_reply_async(msg.subject, msg.from_line, msg.body, thread_summary=thread_summary)
     except Exception as e:
         print("ERROR /gmail/generate-reply AI error:", e)
         raise HTTPException(
@@ -174,79 +378,215 @@ def generate_reply_for_message(message_id: str, request: Request):
     return {"reply": reply_text}
 
 
-@router.post("/send-reply/{message_id}")
-def send_reply(message_id: str, request: Request, payload: Dict[str, str]):
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/generate-reply/{message_id}/stream")
+async def generate_reply_stream(message_id: str, request: Request):
+    """
+    Stream a proposed reply as Server-Sent Events while the model writes it
+    (with the same thread context as /generate-reply).
+
+    Events:
+    - `token`    {"text": "..."}   next piece of the reply
+    - `error`    {"detail": "..."} the model failed (possibly partway)
+    - `fallback` {"reply": "..."}  template reply replacing the partial text
+    - `done`     {"reply": "..."}  final reply text, always the last event
     """
-    Send a reply via Gmail for a given message, using the reply text from the client.
+    user_email, creds = await _get_credentials(request)
+    msg = await _get_parsed_message(request, message_id, "/gmail/generate-reply/stream", creds=creds)
+    thread_summary = await thread_context.summary_for_reply(user_email, creds, msg.thread_id, message_id)
+
+    async def events() -> AsyncIterator[str]:
+        async for event, text in stream_reply_async(msg.subject, msg.from_line, msg.body, thread_summary=thread_summary):
+            if event == "token":
+                yield _sse("token", {"text": text})
+            elif event == "error":
+                yield _sse("error", {"detail": text})
+            else:
+                yield _sse(event, {"reply": text})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/send-reply/{message_id}", status_code=202)
+async def send_reply(message_id: str, request: Request, payload: Dict[str, str]):
+    """
+    Queue a reply to a given message, using the reply text from the client.
+    The outbox worker sends it (see outbox.py); poll GET /gmail/outbox/{id}.
+    A repeated request with the same Idempotency-Key header (or, without one,
+    the same text for the same message) returns the entry queued first.
     """
     reply_text = payload.get("reply_text")
     if not reply_text:
         raise HTTPException(status_code=400, detail="Missing reply_text")
 
-    try:
-        service, creds = _get_gmail_service(request)
-    except HTTPException:
-        raise
-    except Exception as e:
-        print("DEBUG /gmail/send-reply: failed to build service", e)
-        raise HTTPException(status_code=500, detail="Failed to initialize Gmail service")
+    user_email = _get_user_email(request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
 
+    idempotency_key = request.headers.get("Idempotency-Key") or hashlib.sha256(
+        f"{message_id}\n{reply_text}".encode("utf-8")
+    ).hexdigest()
     try:
-        full = (
-            service.users()
-            .messages()
-            .get(userId="me", id=message_id, format="full")
-            .execute()
-        )
+        with span("outbox_enqueue"):
+            outbox_id = await run_in_threadpool(db.enqueue_outbox, user_email, message_id, idempotency_key, reply_text)
     except Exception as e:
-        print("DEBUG /gmail/send-reply get message error:", e)
-        raise HTTPException(status_code=404, detail="Email not found")
-
-    headers = full.get("payload", {}).get("headers", [])
-    subject = _get_header(headers, "Subject") or "(no subject)"
-    from_line = _get_header(headers, "From")
-    # Extract the actual email address from From:
-    to_addr = from_line
+        print("DEBUG /gmail/send-reply enqueue error:", e)
+        raise HTTPException(status_code=500, detail="Failed to queue email")
+    outbox_worker.wake()
 
-    # Build MIME message
-    mime_msg = MIMEText(reply_text)
-    mime_msg["To"] = to_addr
-    mime_msg["Subject"] = f"Re: {subject}"
+    return {"id": outbox_id, "status": "queued"}
 
-    raw = urlsafe_b64encode(mime_msg.as_bytes()).decode("utf-8")
 
-    try:
-        send_resp = (
-            service.users()
-            .messages()
-            .send(userId="me", body={"raw": raw, "threadId": full.get("threadId")})
-            .execute()
-        )
-        print("DEBUG /gmail/send-reply sent:", send_resp.get("id"))
-    except Exception as e:
-        print("DEBUG /gmail/send-reply send error:", e)
-        raise HTTPException(status_code=500, detail="Failed to send email")
+@router.get("/outbox/{outbox_id}")
+async def outbox_status(outbox_id: str, request: Request):
+    """
+    Where a queued reply is: queued, sending (retried as long as attempts
+    remain), sent (with Gmail's id of the sent message) or failed.
+    """
+    user_email = _get_user_email(request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
 
-    return {"status": "sent"}
+    entry = await run_in_threadpool(db.get_outbox, user_email, outbox_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Outbox entry not found")
+    return {
+        "id": entry["id"],
+        "messageId": entry["message_id"],
+        "status": entry["status"],
+        "attempts": entry["attempts"],
+        "sentMessageId": entry["sent_message_id"],
+        "error": entry["error"],
+    }
 
 
 @router.delete("/delete/{message_id}")
-def delete_message(message_id: str, request: Request):
+async def delete_message(message_id: str, request: Request):
     """
     Delete an email message from the user's inbox.
     """
+    user_email, creds = await _get_credentials(request)
+
     try:
-        service, creds = _get_gmail_service(request)
-    except HTTPException:
-        raise
+        await gmail_async.delete_message(creds, message_id)
     except Exception as e:
-        print("DEBUG /gmail/delete: failed to build service", e)
-        raise HTTPException(status_code=500, detail="Failed to initialize Gmail service")
+        raise _gmail_http_error(e, "/gmail/delete", 500, "Failed to delete email")
+
+    await run_in_threadpool(_forget_deleted, user_email, [message_id], "/gmail/delete")
+
+    return {"status": "deleted"}
+
 
+def _forget_deleted(user_email: Optional[str], message_ids: List[str], route: str):
+    """Keep the local store and caches in step without waiting for the next sync."""
+    if not user_email or not message_ids:
+        return
+    message_cache.invalidate(user_email, message_ids)
+    try:
+        db.delete_messages(user_email, message_ids)
+    except Exception as e:
+        print(f"DEBUG {route}: failed to update local store", e)
+
+
+def _apply_label_changes(
+    user_email: Optional[str],
+    message_ids: List[str],
+    add_label_ids: List[str],
+    remove_label_ids: List[str],
+    route: str,
+):
+    """Mirror a successful batchModify into the local store and caches."""
+    if not user_email or not message_ids:
+        return
+    message_cache.invalidate(user_email, message_ids)
     try:
-        service.users().messages().delete(userId="me", id=message_id).execute()
+        stored = db.get_messages(user_email, message_ids)
+        labels = {}
+        for msg_id, row in stored.items():
+            new_labels = [l for l in row["label_ids"] if l not in remove_label_ids]
+            new_labels += [l for l in add_label_ids if l not in new_labels]
+            labels[msg_id] = new_labels
+        db.update_message_labels(user_email, labels)
     except Exception as e:
-        print("DEBUG /gmail/delete error:", e)
-        raise HTTPException(status_code=500, detail="Failed to delete email")
+        print(f"DEBUG {route}: failed to update local store", e)
 
-    return {"status": "deleted"}
+
+def _bulk_ids(payload: Dict[str, Any]) -> List[str]:
+    ids = payload.get("ids")
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) and i for i in ids):
+        raise HTTPException(status_code=400, detail="Expected a non-empty list of message ids in 'ids'")
+    # de-duplicate, keep order
+    return list(dict.fromkeys(ids))
+
+
+def _bulk_labels(payload: Dict[str, Any], key: str) -> List[str]:
+    labels = payload.get(key) or []
+    if not isinstance(labels, list) or not all(isinstance(l, str) and l for l in labels):
+        raise HTTPException(status_code=400, detail=f"'{key}' must be a list of label ids")
+    return labels
+
+
+def _bulk_response(results: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    failed = sum(1 for err in results.values() if err)
+    return {
+        "results": [
+            {"id": msg_id, "status": "error" if err else "ok", **({"error": err} if err else {})}
+            for msg_id, err in results.items()
+        ],
+        "succeeded": len(results) - failed,
+        "failed": failed,
+    }
+
+
+async def _bulk_modify(request: Request, ids: List[str], add: List[str], remove: List[str], route: str):
+    user_email, creds = await _get_credentials(request)
+    results = await gmail_async.batch_modify(creds, ids, add_label_ids=add, remove_label_ids=remove)
+    await run_in_threadpool(
+        _apply_label_changes, user_email, [i for i, err in results.items() if not err], add, remove, route
+    )
+    return _bulk_response(results)
+
+
+@router.post("/bulk/delete")
+async def bulk_delete(request: Request, payload: Dict[str, Any]):
+    """
+    Permanently delete many messages: {"ids": [...]}.
+    Uses users.messages.batchDelete in chunks of up to 1000 ids.
+    """
+    ids = _bulk_ids(payload)
+    user_email, creds = await _get_credentials(request)
+    results = await gmail_async.batch_delete(creds, ids)
+    await run_in_threadpool(
+        _forget_deleted, user_email, [i for i, err in results.items() if not err], "/gmail/bulk/delete"
+    )
+    return _bulk_response(results)
+
+
+@router.post("/bulk/archive")
+async def bulk_archive(request: Request, payload: Dict[str, Any]):
+    """
+    Archive many messages (remove the INBOX label): {"ids": [...]}.
+    """
+    ids = _bulk_ids(payload)
+    return await _bulk_modify(request, ids, [], ["INBOX"], "/gmail/bulk/archive")
+
+
+@router.post("/bulk/label")
+async def bulk_label(request: Request, payload: Dict[str, Any]):
+    """
+    Add and/or remove labels on many messages:
+    {"ids": [...], "add_label_ids": [...], "remove_label_ids": [...]}.
+    """
+    ids = _bulk_ids(payload)
+    add = _bulk_labels(payload, "add_label_ids")
+    remove = _bulk_labels(payload, "remove_label_ids")
+    if not add and not remove:
+        raise HTTPException(status_code=400, detail="Nothing to do: give add_label_ids and/or remove_label_ids")
+    return await _bulk_modify(request, ids, add, remove, "/gmail/bulk/label")
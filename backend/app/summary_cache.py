@@ -0,0 +1,113 @@
+# app/summary_cache.py
+"""
+Two-tier cache for AI email summaries.
+
+Tier 1 is an in-process LRU with a TTL, tier 2 is the `summaries` table in
+Postgres (see db.py). Entries are keyed by
+  (user email, Gmail message id, body hash, prompt version)
+and stored with the model that wrote them ("provider:model", see
+llm_router.Completion.source). Lookups only take summaries by one of the
+configured models, so a changed body, a changed model or an edited prompt
+never serves an old summary. Rows for other models/prompt versions are
+purged on startup. The memory tier only holds this process's summaries,
+all by configured models.
+"""
+
+import hashlib
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from cachetools import TTLCache
+
+from .config import SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL_SECONDS
+from . import db
+
+
+class SummaryKey(NamedTuple):
+    email: str
+    message_id: str
+    body_hash: str
+    prompt_version: str
+
+
+def body_hash(body: str) -> str:
+    return hashlib.sha256((body or "").encode("utf-8", errors="ignore")).hexdigest()
+
+
+def make_key(email: str, message_id: str, body: str, prompt_version: str) -> SummaryKey:
+    return SummaryKey(email, message_id, body_hash(body), prompt_version)
+
+
+_lock = threading.Lock()
+_memory: "TTLCache[SummaryKey, str]" = TTLCache(
+    maxsize=max(1, SUMMARY_CACHE_SIZE), ttl=SUMMARY_CACHE_TTL_SECONDS
+)
+_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+
+def get_many(keys: List[SummaryKey], models: List[str]) -> Dict[SummaryKey, str]:
+    """
+    Look up several keys: memory first, then one DB query for the rest
+    (summaries by any of `models`). DB hits are promoted into memory.
+    Missing keys are absent from the result.
+    """
+    found: Dict[SummaryKey, str] = {}
+    remaining: List[SummaryKey] = []
+
+    with _lock:
+        for key in keys:
+            value = _memory.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                remaining.append(key)
+        _stats["memory_hits"] += len(found)
+
+    if remaining:
+        # All keys of one lookup share user/prompt in practice, but
+        # group anyway so mixed batches stay correct.
+        groups: Dict[tuple, List[SummaryKey]] = {}
+        for key in remaining:
+            groups.setdefault((key.email, key.prompt_version), []).append(key)
+
+        db_found: Dict[SummaryKey, str] = {}
+        for (email, prompt_version), group in groups.items():
+            rows = db.get_summaries(email, [k.message_id for k in group], models, prompt_version)
+            for key in group:
+                value = rows.get((key.message_id, key.body_hash))
+                if value is not None:
+                    db_found[key] = value
+
+        with _lock:
+            for key, value in db_found.items():
+                _memory[key] = value
+            _stats["db_hits"] += len(db_found)
+            _stats["misses"] += len(remaining) - len(db_found)
+        found.update(db_found)
+
+    return found
+
+
+def get(key: SummaryKey, models: List[str]) -> Optional[str]:
+    return get_many([key], models).get(key)
+
+
+def put(key: SummaryKey, summary: str, model: str):
+    """Store a summary written by `model` in both tiers."""
+    with _lock:
+        _memory[key] = summary
+    db.save_summary(key.email, key.message_id, key.body_hash, model, key.prompt_version, summary)
+
+
+def invalidate_stale(models: List[str], prompt_version: str) -> int:
+    """Forget everything not produced by one of the current models with the current prompt version."""
+    with _lock:
+        for key in [k for k in _memory.keys() if k.prompt_version != prompt_version]:
+            _memory.pop(key, None)
+    return db.delete_stale_summaries(models, prompt_version)
+
+
+def stats() -> Dict[str, int]:
+    """Cumulative hit/miss counters for this process."""
+    with _lock:
+        return dict(_stats, memory_entries=len(_memory))
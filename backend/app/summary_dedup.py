@@ -0,0 +1,205 @@
+# app/summary_dedup.py
+"""
+Shared summaries for duplicate mail.
+
+Newsletters and notifications reach many users as (nearly) the same text,
+and every copy used to cost its own summary. Before the model is asked,
+each body is fingerprinted and compared with the bodies summarized before:
+
+- Text: prompt_builder.clean_body (quotes, signatures and footers gone),
+  lowercased and split into words.
+- Exact duplicates have the same hash of those words. They share a
+  summary across users: the text, and so the summary, is the same.
+- Near duplicates have a 64-bit SimHash over 2-word shingles at most
+  SUMMARY_DEDUP_MAX_DISTANCE bits away. They only match within one user's
+  mail: a near copy may differ by a name, a link or an amount, and a
+  summary of one user's personalized copy must not reach another user.
+  They are looked for among the sender's NEAR_CANDIDATES newest
+  fingerprints in that user's mail (summary_fingerprints table, see db.py):
+  repeated mailings arrive close together. The candidates of a whole page
+  come from one query. Bodies shorter than
+  MIN_NEAR_WORDS words only match exactly: their SimHash moves too much.
+- Guards: only mail from the same sender address matches, and a near
+  duplicate must contain the same numbers, so transactional mail (amounts,
+  dates, codes) never borrows another copy's summary.
+
+A shared summary is cached under the message's own key (summary_cache.py),
+with the model that wrote it, so later page loads are plain cache hits.
+Only summaries by a currently configured model are shared. stats() counts the summaries the
+model didn't have to write.
+"""
+
+import hashlib
+import re
+import threading
+from collections import Counter
+from email.utils import parseaddr
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from cachetools import TTLCache
+
+from . import db, prompt_builder
+from .config import SUMMARY_DEDUP_ENABLED, SUMMARY_DEDUP_MAX_DISTANCE
+from .summary_cache import SummaryKey
+
+SHINGLE_WORDS = 2
+MIN_NEAR_WORDS = 30
+NEAR_CANDIDATES = 200
+
+_WORD_RE = re.compile(r"\w+")
+_MASK64 = (1 << 64) - 1
+
+
+class Fingerprint(NamedTuple):
+    sender: str
+    exact_hash: str
+    simhash: int
+    digits_hash: str
+    words: int
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(words: List[str]) -> int:
+    """64-bit SimHash of a word list, over overlapping SHINGLE_WORDS-word shingles."""
+    if len(words) <= SHINGLE_WORDS:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    weights = [0] * 64
+    for shingle, count in Counter(shingles).items():
+        h = _hash64(shingle)
+        for bit in range(64):
+            weights[bit] += count if (h >> bit) & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def distance(a: int, b: int) -> int:
+    """Hamming distance between two 64-bit hashes."""
+    return bin((a ^ b) & _MASK64).count("1")
+
+
+def sender_address(from_line: str) -> str:
+    return parseaddr(from_line or "")[1].lower()
+
+
+def fingerprint(body: str, from_line: str) -> Optional[Fingerprint]:
+    """None when there is no sender address or no text."""
+    sender = sender_address(from_line)
+    words = _WORD_RE.findall(prompt_builder.clean_body(body).lower())
+    if not sender or not words:
+        return None
+    digits = " ".join(w for w in words if any(c.isdigit() for c in w))
+    return Fingerprint(
+        sender,
+        hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest(),
+        simhash(words),
+        hashlib.sha256(digits.encode("utf-8")).hexdigest()[:16],
+        len(words),
+    )
+
+
+def _signed(h: int) -> int:
+    """A 64-bit hash as the signed value a BIGINT column holds."""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _match(fp: Fingerprint, rows: List[dict]) -> Optional[Tuple[str, dict]]:
+    """("exact" | "near", row) of the best candidate row, or None."""
+    best: Optional[Tuple[int, dict]] = None
+    for row in rows:
+        if row["exact_hash"] == fp.exact_hash:
+            return "exact", row
+        if fp.words < MIN_NEAR_WORDS or row["digits_hash"] != fp.digits_hash:
+            continue
+        d = distance(fp.simhash, row["simhash"])
+        if d <= SUMMARY_DEDUP_MAX_DISTANCE and (best is None or d < best[0]):
+            best = (d, row)
+    return ("near", best[1]) if best else None
+
+
+_lock = threading.Lock()
+# Fingerprints of bodies on their way to the model, until remember() stores them
+_waiting: "TTLCache[SummaryKey, Fingerprint]" = TTLCache(maxsize=4096, ttl=600)
+_stats = {"exact": 0, "near": 0, "stored": 0}
+
+
+def stats() -> Dict[str, int]:
+    """`llm_calls_saved` counts emails (a batched call covers several)."""
+    with _lock:
+        return dict(_stats, llm_calls_saved=_stats["exact"] + _stats["near"])
+
+
+def find_shared(
+    email: str, bodies: Dict[str, str], keys: Dict[str, Optional[SummaryKey]], models: List[str],
+) -> Dict[str, Tuple[str, str]]:
+    """
+    (summary, model that wrote it) of earlier duplicates for these
+    {message_id: body}, by message id; only summaries by one of `models`.
+    Only messages in the mailbox copy take part (the sender comes from
+    there). The fingerprints of the others are kept for remember().
+    """
+    ids = [msg_id for msg_id in bodies if keys.get(msg_id) is not None]
+    if not SUMMARY_DEDUP_ENABLED or not email or not ids:
+        return {}
+    try:
+        senders = db.get_message_senders(email, ids)
+    except Exception as e:
+        print("summary_dedup: sender lookup failed", e)
+        return {}
+
+    fps: Dict[str, Fingerprint] = {}
+    for msg_id in ids:
+        fp = fingerprint(bodies[msg_id], senders[msg_id]) if msg_id in senders else None
+        if fp is not None:
+            fps[msg_id] = fp
+    if not fps:
+        return {}
+    # One prompt version per page in practice; one query per version otherwise
+    versions: Dict[str, List[str]] = {}
+    for msg_id in fps:
+        versions.setdefault(keys[msg_id].prompt_version, []).append(msg_id)
+    candidates: Dict[Tuple[str, str], List[dict]] = {}
+    for prompt_version, group in versions.items():
+        rows = db.find_summary_fingerprints(
+            models, prompt_version, email,
+            {fps[msg_id].sender for msg_id in group}, {fps[msg_id].exact_hash for msg_id in group},
+            NEAR_CANDIDATES,
+        )
+        for row in rows:
+            candidates.setdefault((prompt_version, row["sender"]), []).append(row)
+
+    shared: Dict[str, Tuple[str, str]] = {}
+    for msg_id, fp in fps.items():
+        key = keys[msg_id]
+        # Another user's fingerprint only counts as an exact copy
+        rows = [
+            row for row in candidates.get((key.prompt_version, fp.sender), [])
+            if row["email"] == email or row["exact_hash"] == fp.exact_hash
+        ]
+        match = _match(fp, rows)
+        with _lock:
+            if match:
+                kind, row = match
+                _stats[kind] += 1
+                shared[msg_id] = (row["summary"], row["model"])
+            else:
+                _waiting[key] = fp
+    return shared
+
+
+def remember(key: Optional[SummaryKey], summary: str, model: str):
+    """Store the fingerprint find_shared() took of this message's body, now that `model` summarized it."""
+    if key is None:
+        return
+    with _lock:
+        fp = _waiting.pop(key, None)
+    if fp is None:
+        return
+    db.save_summary_fingerprint(
+        model, key.prompt_version, fp.sender, key.email, fp.exact_hash, _signed(fp.simhash), fp.digits_hash, summary,
+    )
+    with _lock:
+        _stats["stored"] += 1
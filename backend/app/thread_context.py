@@ -0,0 +1,158 @@
+# app/thread_context.py
+"""
+Rolling per-thread summaries for replies.
+
+A reply used to see only the message being answered. Sending the whole
+conversation instead would grow the prompt (and the bill) with every
+message, so each thread gets one stored summary (thread_summaries table,
+see db.py) of its messages up to the one being answered:
+
+- The thread is listed with a single users.threads.get call in minimal
+  format (ids and dates, no bodies). Only the messages newer than the
+  stored summary's folded_until are loaded in full: from the local mailbox
+  copy, or one batched Gmail call for the rest. A reply in a thread whose
+  summary is current loads no bodies at all.
+- Those messages are sent to the model together with that summary, and the
+  model rewrites it to cover them. A long backlog (first reply in an old
+  thread) is folded in batches that each fit the input budget (routers/ai.py
+  plan_thread_folds). The reply waits for at most THREAD_FOLD_INLINE_BATCHES
+  of them; the rest are folded in the background for the next reply.
+- The summary is capped at THREAD_SUMMARY_MAX_TOKENS, so the reply prompt
+  stays the same size however long the thread gets.
+
+Answering an older message of the thread uses the stored summary as it is,
+even if it already covers later messages. The summary is stored with the
+model that last folded it; one by a model that is no longer configured, or
+by another fold prompt, is rebuilt from scratch. When the fetch or a fold fails, the
+reply goes ahead with whatever summary there is (or none).
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from anyio import to_thread
+from google.oauth2.credentials import Credentials
+
+from . import db, gmail_async, mail_sync
+from .config import THREAD_CONTEXT_ENABLED, THREAD_FOLD_INLINE_BATCHES
+from .routers.ai import CACHE_MODELS, THREAD_PROMPT_VERSION, fold_thread_async, plan_thread_folds, thread_fold_tokens
+
+# Background folds in flight, by (email, thread id): one per thread at a time
+_folding: Dict[Tuple[str, str], "asyncio.Task"] = {}
+
+
+def _date(msg: Dict[str, Any]) -> int:
+    return int(msg.get("internalDate") or 0)
+
+
+def _earlier_messages(thread: Dict[str, Any], message_id: str) -> List[Dict[str, Any]]:
+    """The thread's messages before `message_id`, oldest first (all of them if it isn't there)."""
+    messages = sorted(thread.get("messages") or [], key=_date)
+    ids = [m.get("id") for m in messages]
+    return messages[:ids.index(message_id)] if message_id in ids else messages
+
+
+async def _load_rows(email: str, creds: Credentials, message_ids: List[str]) -> List[Dict[str, Any]]:
+    """Stored-row shape of these messages, oldest first: local copy first, then Gmail."""
+    try:
+        stored = await to_thread.run_sync(db.get_messages, email, message_ids)
+    except Exception as e:
+        print("thread_context: local store lookup failed", e)
+        stored = {}
+    missing = [mid for mid in message_ids if mid not in stored]
+    fetched = await gmail_async.batch_get_messages(creds, missing) if missing else {}
+
+    rows = []
+    for mid in message_ids:
+        if mid in stored:
+            rows.append(stored[mid])
+            continue
+        if mid not in fetched:
+            continue
+        try:
+            rows.append(mail_sync.message_to_row(fetched[mid]))
+        except Exception as e:
+            print(f"thread_context: failed to parse message {mid}", e)
+    return sorted(rows, key=lambda row: row["internal_date"] or 0)
+
+
+async def _fold(
+    email: str, thread_id: str, summary: str, folded_until: int, count: int, batches: List[List[Dict[str, Any]]],
+) -> Tuple[str, int, int, bool]:
+    """
+    Fold the batches into the summary one at a time, saving after each.
+    Returns (summary, folded_until, message_count, whether every batch was
+    folded): it stops at the first failure.
+    """
+    for batch in batches:
+        folded = await fold_thread_async(summary, batch)
+        if folded is None:
+            return summary, folded_until, count, False
+        summary, model = folded
+        folded_until = max(folded_until, max(row["internal_date"] for row in batch))
+        count += len(batch)
+        await to_thread.run_sync(
+            db.save_thread_summary,
+            email, thread_id, model, THREAD_PROMPT_VERSION, summary, folded_until, count, CACHE_MODELS,
+        )
+    return summary, folded_until, count, True
+
+
+async def _fold_in_background(key: Tuple[str, str], *args):
+    try:
+        await _fold(*key, *args)
+    except Exception as e:
+        print(f"thread_context: background fold failed for thread {key[1]}", e)
+    finally:
+        _folding.pop(key, None)
+
+
+async def summary_for_reply(
+    email: str,
+    creds: Credentials,
+    thread_id: Optional[str],
+    message_id: str,
+    charge: Optional[Callable[[int], bool]] = None,
+) -> Optional[str]:
+    """
+    Summary of the messages before `message_id` in its thread, brought up to
+    date first (as far as THREAD_FOLD_INLINE_BATCHES allows); None for a
+    thread of one message.
+    `charge(tokens)` is asked first for the estimated tokens of every fold
+    (inline and background); if it says no, nothing is folded and the stored
+    summary is used as it is.
+    """
+    if not THREAD_CONTEXT_ENABLED or not email or not thread_id:
+        return None
+
+    stored = await to_thread.run_sync(db.get_thread_summary, email, thread_id)
+    if stored and (stored["model"] not in CACHE_MODELS or stored["prompt_version"] != THREAD_PROMPT_VERSION):
+        stored = None
+    summary = stored["summary"] if stored else ""
+    key = (email, thread_id)
+    if key in _folding:
+        # The backlog is being folded already; don't fold it twice.
+        return summary or None
+
+    try:
+        thread = await gmail_async.get_thread(creds, thread_id, fmt="minimal")
+    except Exception as e:
+        print(f"thread_context: failed to fetch thread {thread_id}", e)
+        return summary or None
+
+    folded_until = stored["folded_until"] if stored else 0
+    count = stored["message_count"] if stored else 0
+    new = [m["id"] for m in _earlier_messages(thread, message_id) if _date(m) > folded_until]
+    if not new:
+        return summary or None
+
+    batches = plan_thread_folds(await _load_rows(email, creds, new))
+    if charge is not None and batches and not charge(thread_fold_tokens(batches)):
+        return summary or None
+    inline = max(0, THREAD_FOLD_INLINE_BATCHES)
+    summary, folded_until, count, ok = await _fold(email, thread_id, summary, folded_until, count, batches[:inline])
+    if ok and batches[inline:]:
+        _folding[key] = asyncio.get_running_loop().create_task(
+            _fold_in_background(key, summary, folded_until, count, batches[inline:])
+        )
+    return summary or None
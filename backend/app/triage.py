@@ -0,0 +1,292 @@
+# app/triage.py
+"""
+Local triage before summaries.
+
+Promotions, receipts and no-reply notifications don't need an LLM summary:
+their first sentence or Gmail's snippet says enough. Every message is put
+in a category first, on the CPU, and each category is routed to the model
+("llm") or to a cheap extractive summary ("extractive"), per TRIAGE_ROUTES.
+
+Signals, strongest first:
+1. Gmail's category labels (CATEGORY_PROMOTIONS, _SOCIAL, _FORUMS).
+2. Automated mail: CATEGORY_UPDATES, an Auto-Submitted header or a no-reply
+   style sender -> notification or receipt.
+3. Mailing-list headers (List-Unsubscribe, List-Id, Precedence: bulk/list)
+   -> newsletter, promotion, notification or receipt.
+4. CATEGORY_PERSONAL -> personal.
+5. Otherwise a small multinomial naive Bayes model over subject + snippet
+   (trained at import from TRAINING_EXAMPLES, plus TRIAGE_TRAINING_FILE if
+   set). Below TRIAGE_MIN_CONFIDENCE the message stays personal. The model
+   alone only labels: its category always goes to the model ("llm"), since
+   a personal email without a real summary costs more than one summary too
+   many, and a model trained on a few dozen examples is overconfident.
+   Cases 2 and 3 use the same model to pick among their categories; there a
+   header, label or sender signal agrees, so their routes apply.
+
+Classifying one message takes tens of microseconds (no body is read).
+stats() counts the decisions, including the emails summarized without the model.
+"""
+
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import prompt_builder
+from .config import (
+    TRIAGE_ENABLED,
+    TRIAGE_EXTRACTIVE_MAX_CHARS,
+    TRIAGE_MIN_CONFIDENCE,
+    TRIAGE_ROUTES,
+    TRIAGE_TRAINING_FILE,
+)
+
+CATEGORIES = ("personal", "newsletter", "notification", "receipt", "promotion", "social")
+ROUTES = ("llm", "extractive")
+
+# Stored with each message (mail_sync.message_to_row) for classify()
+TRIAGE_HEADERS = ("List-Unsubscribe", "List-Id", "Precedence", "Auto-Submitted")
+
+AUTOMATED_SENDER_RE = re.compile(
+    r"(no[-_.]?reply|do[-_.]?not[-_.]?reply|notifications?@|mailer-daemon|postmaster@|bounces?[@+-])",
+    re.I,
+)
+_WORD_RE = re.compile(r"[a-z0-9$%]+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+# (category, subject + snippet) pairs the built-in model is trained on.
+TRAINING_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    ("personal", "Lunch tomorrow? Are you free around noon, I'd like to talk about the project"),
+    ("personal", "Re: draft proposal Thanks for the comments, I updated section two, can you take another look"),
+    ("personal", "Quick question about the contract Could you check whether the dates work for you"),
+    ("personal", "Meeting notes Here is what we agreed on today, let me know if I missed anything"),
+    ("personal", "Re: weekend plans We are thinking of driving up on Saturday, would you like to join us"),
+    ("personal", "Can you review my pull request when you have a minute, I need your opinion on the approach"),
+    ("personal", "Following up on our call, I'm attaching the slides and would appreciate your feedback"),
+    ("personal", "Hi, are we still on for Thursday? I can move it if that works better for you"),
+    ("personal", "Interview schedule Please let me know which time slot suits you next week"),
+    ("personal", "Re: budget question I think we should discuss this with the team before deciding"),
+    ("newsletter", "This week in tech: the stories you missed, plus our editor's picks"),
+    ("newsletter", "Weekly digest Top posts from your communities this week"),
+    ("newsletter", "Issue 142 of the newsletter: articles, tutorials and community news"),
+    ("newsletter", "The Monday briefing What you need to know to start your week"),
+    ("newsletter", "Our monthly roundup New features, upcoming events and reading recommendations"),
+    ("newsletter", "Daily headlines World news, business and opinion from today's edition"),
+    ("newsletter", "Release notes and community highlights from this month's blog"),
+    ("notification", "Your password was changed. If this wasn't you, secure your account"),
+    ("notification", "New sign-in to your account from a new device"),
+    ("notification", "Your verification code is 123456. It expires in 10 minutes"),
+    ("notification", "Build failed on main: 3 tests failing in the pipeline"),
+    ("notification", "Reminder: your appointment is scheduled for tomorrow at 10 am"),
+    ("notification", "You have a new comment on your issue, reply to this email to respond"),
+    ("notification", "Your package has shipped and is on its way, track your delivery"),
+    ("notification", "Security alert: review recent activity on your account"),
+    ("notification", "Your subscription will renew soon, no action is needed"),
+    ("notification", "Calendar invitation updated: the event time has changed"),
+    ("receipt", "Your receipt from the store Order total $42.99 paid with Visa"),
+    ("receipt", "Order confirmation Thank you for your order, order number 1042 total"),
+    ("receipt", "Payment received Invoice paid, amount $120.00, thank you for your payment"),
+    ("receipt", "Your invoice for March is available, amount due and billing period"),
+    ("receipt", "Booking confirmed Your reservation details and receipt"),
+    ("receipt", "Thanks for your purchase, here is your receipt and order summary"),
+    ("receipt", "Your ride receipt Trip total, fare and tip"),
+    ("promotion", "50% off everything this weekend only, shop the sale now"),
+    ("promotion", "Last chance: free shipping on orders over $50 ends tonight"),
+    ("promotion", "New arrivals just for you, discover the collection and save 20%"),
+    ("promotion", "Exclusive offer for members, use code SAVE10 at checkout"),
+    ("promotion", "Flash sale! Deals up to 70% off, limited time only"),
+    ("promotion", "Upgrade to premium today and get your first month free"),
+    ("promotion", "Don't miss our biggest discount of the year, buy now"),
+    ("social", "You have a new friend request, see who wants to connect"),
+    ("social", "Someone liked your photo and commented on your post"),
+    ("social", "You were mentioned in a post, see what they said"),
+    ("social", "New followers this week and people you may know"),
+    ("social", "Your friend shared a memory with you, view it now"),
+    ("social", "Congratulate your connection on their work anniversary"),
+)
+
+
+class Triage(NamedTuple):
+    category: str
+    reason: str  # label, sender, header, model or default
+    route: str
+
+
+def _tokens(text: str) -> List[str]:
+    return _WORD_RE.findall((text or "").lower())
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes with add-one smoothing, over word counts."""
+
+    def __init__(self, examples: Iterable[Tuple[str, str]]):
+        docs: Counter = Counter()
+        words: Dict[str, Counter] = {}
+        for category, text in examples:
+            docs[category] += 1
+            words.setdefault(category, Counter()).update(_tokens(text))
+        vocabulary = set().union(*words.values()) if words else set()
+        total_docs = sum(docs.values())
+        self.categories = tuple(c for c in CATEGORIES if c in docs)
+        self._prior = {c: math.log(docs[c] / total_docs) for c in self.categories}
+        self._log_prob: Dict[str, Dict[str, float]] = {}
+        self._unseen: Dict[str, float] = {}
+        for c in self.categories:
+            denominator = sum(words[c].values()) + len(vocabulary)
+            self._log_prob[c] = {w: math.log((n + 1) / denominator) for w, n in words[c].items()}
+            self._unseen[c] = math.log(1 / denominator)
+        self._vocabulary = vocabulary
+
+    def probabilities(self, text: str, among: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """Posterior per category (restricted to `among` if given)."""
+        tokens = [t for t in _tokens(text) if t in self._vocabulary]
+        categories = [c for c in (among or self.categories) if c in self._prior]
+        scores = {}
+        for c in categories:
+            log_prob, unseen = self._log_prob[c], self._unseen[c]
+            scores[c] = self._prior[c] + sum(log_prob.get(t, unseen) for t in tokens)
+        if not scores:
+            return {}
+        top = max(scores.values())
+        exp = {c: math.exp(s - top) for c, s in scores.items()}
+        total = sum(exp.values())
+        return {c: v / total for c, v in exp.items()}
+
+    def predict(self, text: str, among: Optional[Sequence[str]] = None) -> Tuple[str, float]:
+        probs = self.probabilities(text, among)
+        if not probs:
+            return "personal", 0.0
+        category = max(probs, key=probs.get)
+        return category, probs[category]
+
+
+def _load_training_file(path: str) -> List[Tuple[str, str]]:
+    """Extra examples, one JSON object per line: {"category": ..., "text": ...}."""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("category") in CATEGORIES and item.get("text"):
+                examples.append((item["category"], item["text"]))
+    return examples
+
+
+def _parse_routes(value: str) -> Dict[str, str]:
+    """"promotion:extractive,newsletter:llm" -> {category: route}; categories left out go to the model."""
+    routes = {c: "llm" for c in CATEGORIES}
+    for part in value.split(","):
+        category, _, route = part.strip().partition(":")
+        if category in CATEGORIES and route.strip() in ROUTES:
+            routes[category] = route.strip()
+        elif part.strip():
+            print(f"triage: ignoring TRIAGE_ROUTES entry {part.strip()!r}")
+    return routes
+
+
+def _build_model() -> NaiveBayes:
+    examples = list(TRAINING_EXAMPLES)
+    if TRIAGE_TRAINING_FILE:
+        try:
+            examples += _load_training_file(TRIAGE_TRAINING_FILE)
+        except (OSError, ValueError) as e:
+            print(f"triage: could not read {TRIAGE_TRAINING_FILE}", e)
+    return NaiveBayes(examples)
+
+
+model = _build_model()
+routes = _parse_routes(TRIAGE_ROUTES)
+
+_lock = threading.Lock()
+_stats: Counter = Counter()
+
+
+def stats() -> Dict[str, Any]:
+    """Decisions per category, and how many emails were summarized without the model."""
+    with _lock:
+        return {
+            "categories": {c: _stats[c] for c in CATEGORIES},
+            "llm_skipped": _stats["extractive"],
+            "routes": dict(routes),
+        }
+
+
+def classify(row: Dict[str, Any]) -> Triage:
+    """Category of a stored message row (label_ids, from, subject, snippet, headers)."""
+    labels = set(row.get("label_ids") or ())
+    headers = {k.lower(): (v or "").strip().lower() for k, v in (row.get("headers") or {}).items()}
+    text = f"{row.get('subject') or ''} {row.get('snippet') or ''}"
+
+    def decide(category: str, reason: str) -> Triage:
+        return Triage(category, reason, routes[category])
+
+    if "CATEGORY_PROMOTIONS" in labels:
+        return decide("promotion", "label")
+    if "CATEGORY_SOCIAL" in labels:
+        return decide("social", "label")
+    if "CATEGORY_FORUMS" in labels:
+        return decide("newsletter", "label")
+
+    automated = [
+        reason
+        for reason, present in (
+            ("label", "CATEGORY_UPDATES" in labels),
+            ("header", headers.get("auto-submitted", "no") != "no"),
+            ("sender", bool(AUTOMATED_SENDER_RE.search(row.get("from") or ""))),
+        )
+        if present
+    ]
+    if automated:
+        return decide(model.predict(text, ("notification", "receipt"))[0], automated[0])
+
+    if "list-unsubscribe" in headers or "list-id" in headers or headers.get("precedence") in ("bulk", "list", "junk"):
+        return decide(model.predict(text, ("newsletter", "promotion", "notification", "receipt"))[0], "header")
+
+    if "CATEGORY_PERSONAL" in labels:
+        return decide("personal", "label")
+
+    category, probability = model.predict(text)
+    if category != "personal" and probability >= TRIAGE_MIN_CONFIDENCE:
+        # No header, label or sender backs the model up: label only, keep the summary
+        return Triage(category, "model", "llm")
+    return decide("personal", "default")
+
+
+def extractive_summary(row: Dict[str, Any], max_chars: int = TRIAGE_EXTRACTIVE_MAX_CHARS) -> str:
+    """The leading sentences of the cleaned body (or the snippet), up to `max_chars`."""
+    text = prompt_builder.clean_body(row.get("body") or "")
+    text = " ".join(text.split()) or " ".join((row.get("snippet") or "").split())
+    if not text:
+        return row.get("subject") or ""
+    summary = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        if summary and len(summary) + 1 + len(sentence) > max_chars:
+            break
+        summary = f"{summary} {sentence}".strip()
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit(" ", 1)[0].rstrip(",;:") + "…"
+    return summary
+
+
+def route(rows: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Triage], Dict[str, str]]:
+    """
+    Triage message rows. Returns ({message_id: Triage}, {message_id:
+    extractive summary}) where the second holds the rows routed away from
+    the model. Both are empty with TRIAGE_ENABLED off.
+    """
+    if not TRIAGE_ENABLED:
+        return {}, {}
+    triaged: Dict[str, Triage] = {}
+    extracted: Dict[str, str] = {}
+    for row in rows:
+        decision = classify(row)
+        triaged[row["id"]] = decision
+        if decision.route == "extractive":
+            extracted[row["id"]] = extractive_summary(row)
+    with _lock:
+        _stats.update(t.category for t in triaged.values())
+        _stats["extractive"] += len(extracted)
+    return triaged, extracted
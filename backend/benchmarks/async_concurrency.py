@@ -0,0 +1,101 @@
+# benchmarks/async_concurrency.py
+"""
+Concurrency benchmark for the async request path.
+
+Starts fake Gmail and Groq upstreams (benchmarks/fakes.py) with fixed
+latencies, runs the backend under uvicorn against them (SQLite token store,
+seeded session), then fires requests at increasing concurrency and prints
+throughput and latency per level.
+
+Two backends are measured against the same fakes: the real app (async
+handlers) and benchmarks/sync_app.py, the handlers as they were before, as
+plain `def` routes that hold a threadpool worker for the whole upstream
+wait. Run from the backend folder:
+
+    python -m benchmarks.async_concurrency --concurrency 1,10,50,100,200
+    python -m benchmarks.async_concurrency --mode sync --endpoint last5
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List
+
+from .fakes import make_fake_gmail, make_fake_groq
+from .harness import backend_env, free_port, run_level, seed_token_store, serve_in_thread, start_backend
+
+APPS = {
+    "async": "app.main:app",
+    "sync": "benchmarks.sync_app:app",
+}
+
+ENDPOINTS = {
+    "me": ("GET", "/auth/me"),
+    "reply": ("POST", "/gmail/generate-reply/m00000"),
+    "body": ("GET", "/gmail/messages/m00001/body"),
+    "last5": ("GET", "/gmail/last5"),
+}
+
+
+def _measure(mode: str, args, levels: List[int], env: dict, session: str) -> Dict[int, Dict[str, Any]]:
+    """Run every level against a fresh backend of this mode."""
+    method, path = ENDPOINTS[args.endpoint]
+    results = {}
+    backend_port = free_port()
+    backend = start_backend(env, backend_port, APPS[mode])
+    try:
+        base_url = f"http://127.0.0.1:{backend_port}"
+        # warm-up: connection pools, message cache
+        asyncio.run(run_level(base_url, session, method, path, 1, 3))
+        for level in levels:
+            results[level] = asyncio.run(run_level(base_url, session, method, path, level, max(args.requests, level)))
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="reply")
+    parser.add_argument("--mode", choices=("both", *APPS), default="both", help="which handlers to measure")
+    parser.add_argument("--concurrency", default="1,10,50,100,200", help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=400, help="requests per level (at least the concurrency)")
+    parser.add_argument("--gmail-latency", type=float, default=0.05, help="seconds per fake Gmail call")
+    parser.add_argument("--groq-latency", type=float, default=0.3, help="seconds per fake Groq call")
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    modes = list(APPS) if args.mode == "both" else [args.mode]
+
+    gmail_port, groq_port = free_port(), free_port()
+    serve_in_thread(make_fake_gmail(args.gmail_latency), gmail_port)
+    serve_in_thread(make_fake_groq(args.groq_latency), groq_port)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded = os.path.join(tmp, "seeded.db")
+        session = seed_token_store(backend_env("sqlite:///" + seeded, gmail_port, groq_port))
+        for mode in modes:
+            # Each backend starts from its own copy: no mailbox or summaries stored by the other
+            db_path = os.path.join(tmp, f"{mode}.db")
+            shutil.copyfile(seeded, db_path)
+            env = backend_env("sqlite:///" + db_path, gmail_port, groq_port)
+            results[mode] = _measure(mode, args, levels, env, session)
+
+    method, path = ENDPOINTS[args.endpoint]
+    print(f"{method} {path}  (gmail {args.gmail_latency * 1000:.0f} ms, groq {args.groq_latency * 1000:.0f} ms)")
+    print(f"{'conc':>5} " + " ".join(
+        f"{mode + ' req/s':>12} {mode + ' p50 ms':>12} {mode + ' p95 ms':>12} {'errors':>7}" for mode in modes
+    ))
+    for level in levels:
+        cells = []
+        for mode in modes:
+            r = results[mode][level]
+            cells.append(f"{r['rps']:>12.1f} {r['p50'] * 1000:>12.1f} {r['p95'] * 1000:>12.1f} {r['errors']:>7}")
+        print(f"{level:>5} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
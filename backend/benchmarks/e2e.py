@@ -0,0 +1,174 @@
+# benchmarks/e2e.py
+"""
+End-to-end benchmark of the main user paths against local Gmail and Groq
+stand-ins (benchmarks/fakes.py).
+
+The real backend runs under uvicorn against the fakes and a seeded token
+store (a throwaway SQLite file, or --database-url for Postgres). The suite
+drives /gmail/last5, /gmail/generate-reply, /gmail/send-reply and /auth/me
+at each concurrency level and reports throughput and p50/p95/p99 latency
+(/gmail/send-reply measures queueing the reply; the outbox worker sends it
+afterwards).
+The fakes can add latency jitter, 5xx errors and 429s (random, or from a
+requests/second quota) to show how retries and fallbacks behave under load.
+
+Run from the backend folder:
+
+    python -m benchmarks.e2e --concurrency 1,10,50 --requests 200
+    python -m benchmarks.e2e --groq-429-rate 0.1 --groq-error-rate 0.02 --jitter 0.05
+
+To catch regressions before a deploy, save a baseline once and compare
+later runs against it. The run exits with status 1 when p50/p95 latency
+or throughput is worse than the baseline by more than --tolerance:
+
+    python -m benchmarks.e2e --output baseline.json
+    python -m benchmarks.e2e --baseline baseline.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from .fakes import Faults, make_fake_gmail, make_fake_groq
+from .harness import backend_env, free_port, run_level, seed_token_store, serve_in_thread, start_backend
+
+ENDPOINTS = {
+    "last5": ("GET", "/gmail/last5", None),
+    "generate-reply": ("POST", "/gmail/generate-reply/m00000", None),
+    "send-reply": ("POST", "/gmail/send-reply/m00001", {"reply_text": "Thanks, I'll take a look today."}),
+    "me": ("GET", "/auth/me", None),
+}
+
+# lower is better for latencies, higher for throughput
+COMPARED = {"p50": -1, "p95": -1, "rps": 1}
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,10,50", help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and level (at least the concurrency)")
+    parser.add_argument("--gmail-latency", type=float, default=0.05, help="seconds per fake Gmail call")
+    parser.add_argument("--groq-latency", type=float, default=0.3, help="seconds per fake Groq call")
+    parser.add_argument(
+        "--openai-latency", type=float,
+        help="seconds per fake OpenAI call, on a fake of its own (default: OpenAI shares the Groq fake)",
+    )
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency per upstream call, up to this many seconds")
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0, help="fraction of Gmail calls answered 503")
+    parser.add_argument("--gmail-429-rate", type=float, default=0.0, help="fraction of Gmail calls answered 429")
+    parser.add_argument("--groq-error-rate", type=float, default=0.0, help="fraction of Groq calls answered 503")
+    parser.add_argument("--groq-429-rate", type=float, default=0.0, help="fraction of Groq calls answered 429")
+    parser.add_argument("--groq-rps", type=float, default=0.0, help="Groq calls per second before 429s (0 = no quota)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--llm-budgets", action="store_true", help="keep the backend's configured LLM rate budgets")
+    parser.add_argument("--database-url", help="token store to seed (default: a temporary SQLite file)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for injected faults")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare with results saved by --output")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression against the baseline")
+    return parser.parse_args()
+
+
+def _compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for endpoint, levels in results.items():
+        for level, current in levels.items():
+            before = baseline.get(endpoint, {}).get(level)
+            if not before:
+                continue
+            for metric, direction in COMPARED.items():
+                old, new = before[metric], current[metric]
+                if not old:
+                    continue
+                change = (new - old) / old * direction
+                if change < -tolerance:
+                    regressions.append(
+                        f"{endpoint} @ {level}: {metric} {old * (1000 if metric != 'rps' else 1):.1f} -> "
+                        f"{new * (1000 if metric != 'rps' else 1):.1f} ({abs(change):.0%} worse)"
+                    )
+    return regressions
+
+
+def main():
+    args = _parse_args()
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        sys.exit(f"unknown endpoint(s): {', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    gmail_faults = Faults(
+        error_rate=args.gmail_error_rate, throttle_rate=args.gmail_429_rate,
+        retry_after=args.retry_after, jitter=args.jitter, seed=args.seed,
+    )
+    groq_faults = Faults(
+        error_rate=args.groq_error_rate, throttle_rate=args.groq_429_rate, requests_per_second=args.groq_rps,
+        retry_after=args.retry_after, jitter=args.jitter, seed=args.seed + 1,
+    )
+    gmail_port, groq_port, backend_port = free_port(), free_port(), free_port()
+    gmail = make_fake_gmail(args.gmail_latency, faults=gmail_faults)
+    groq = make_fake_groq(args.groq_latency, faults=groq_faults)
+    serve_in_thread(gmail, gmail_port)
+    serve_in_thread(groq, groq_port)
+    openai_port = openai = None
+    if args.openai_latency is not None:
+        openai_port = free_port()
+        openai = make_fake_groq(args.openai_latency)
+        serve_in_thread(openai, openai_port)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or "sqlite:///" + os.path.join(tmp, "bench.db")
+        env = backend_env(database_url, gmail_port, groq_port, llm_budgets=args.llm_budgets, openai_port=openai_port)
+        session = seed_token_store(env)
+        backend = start_backend(env, backend_port)
+        try:
+            base_url = f"http://127.0.0.1:{backend_port}"
+            print(
+                f"gmail {args.gmail_latency * 1000:.0f} ms, groq {args.groq_latency * 1000:.0f} ms, "
+                f"jitter {args.jitter * 1000:.0f} ms, {args.requests} requests per level"
+            )
+            print(f"{'endpoint':<15} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+            for endpoint in endpoints:
+                method, path, body = ENDPOINTS[endpoint]
+                # warm-up: connection pools, message and summary caches
+                asyncio.run(run_level(base_url, session, method, path, 1, 3, json_body=body))
+                results[endpoint] = {}
+                for level in levels:
+                    r = asyncio.run(run_level(base_url, session, method, path, level, max(args.requests, level), json_body=body))
+                    results[endpoint][str(level)] = r
+                    print(
+                        f"{endpoint:<15} {level:>5} {r['rps']:>9.1f} {r['p50'] * 1000:>9.1f} {r['p95'] * 1000:>9.1f} "
+                        f"{r['p99'] * 1000:>9.1f} {r['errors']:>7}"
+                    )
+        finally:
+            backend.terminate()
+            backend.wait(timeout=10)
+
+    print(f"injected: gmail {gmail.state.faults}, groq {groq.state.faults}; groq calls {groq.state.calls}")
+    if openai is not None:
+        print(f"openai calls {openai.state.calls}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = _compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against", args.baseline)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
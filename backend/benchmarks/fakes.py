@@ -0,0 +1,286 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for Gmail and Groq, so the backend can be load-tested
+without real accounts or API quota.
+
+- make_fake_gmail(): the Gmail REST endpoints the backend uses, including
+  multipart batch requests, with a configurable per-call latency.
+- make_fake_groq(): an OpenAI-compatible /chat/completions endpoint
+  (plain and streamed, under both the Groq and the OpenAI SDK paths) with
+  a configurable latency.
+
+Both take a Faults to inject latency jitter, 5xx errors and 429s (random,
+or from a requests/second quota). What was injected is counted in
+app.state.faults.
+
+Point the backend at them with GMAIL_API_BASE_URL, GROQ_BASE_URL and
+OPENAI_BASE_URL.
+"""
+
+import asyncio
+import base64
+import json
+import random
+import re
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class Faults(NamedTuple):
+    """What a fake should do wrong, and how often."""
+
+    # fraction of calls answered 503
+    error_rate: float = 0.0
+    # fraction of calls answered 429
+    throttle_rate: float = 0.0
+    # calls per second above which the rest are answered 429 (0 = no quota)
+    requests_per_second: float = 0.0
+    # Retry-After sent with every 429, in seconds
+    retry_after: float = 1.0
+    # extra latency per call, uniform in [0, jitter] seconds
+    jitter: float = 0.0
+    seed: int = 0
+
+
+NO_FAULTS = Faults()
+
+
+def _gmail_error(status: int, message: str) -> dict:
+    return {"error": {"code": status, "message": message}}
+
+
+def _openai_error(status: int, message: str) -> dict:
+    kind = "rate_limit_exceeded" if status == 429 else "server_error"
+    return {"error": {"message": message, "type": kind, "code": kind}}
+
+
+def _install_faults(app: FastAPI, faults: Faults, error_body: Callable[[int, str], dict]):
+    app.state.faults = {"errors": 0, "throttled": 0}
+    rng = random.Random(faults.seed)
+    window = {"second": 0, "calls": 0}
+
+    def over_quota() -> bool:
+        if faults.requests_per_second <= 0:
+            return False
+        second = int(time.monotonic())
+        if second != window["second"]:
+            window.update(second=second, calls=0)
+        window["calls"] += 1
+        return window["calls"] > faults.requests_per_second
+
+    @app.middleware("http")
+    async def inject(request: Request, call_next):
+        if faults.jitter:
+            await asyncio.sleep(rng.uniform(0, faults.jitter))
+        roll = rng.random()
+        if over_quota() or roll < faults.throttle_rate:
+            app.state.faults["throttled"] += 1
+            return JSONResponse(
+                error_body(429, "Rate limit exceeded"),
+                status_code=429,
+                headers={"Retry-After": f"{faults.retry_after:g}"},
+            )
+        if roll < faults.throttle_rate + faults.error_rate:
+            app.state.faults["errors"] += 1
+            return JSONResponse(error_body(503, "Service unavailable"), status_code=503)
+        return await call_next(request)
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def make_messages(count: int = 50) -> Dict[str, dict]:
+    """Deterministic inbox of `count` format=full messages, newest first."""
+    now_ms = int(time.time() * 1000)
+    messages = {}
+    for i in range(count):
+        msg_id = f"m{i:05d}"
+        body = (
+            f"Hi,\n\nThis is test message {i}. Could you review the attached report "
+            "and confirm the numbers before Friday's meeting?\n\nThanks,\nAlex\n"
+        ) * 3
+        messages[msg_id] = {
+            "id": msg_id,
+            "threadId": f"t{i:05d}",
+            "labelIds": ["INBOX", "UNREAD"],
+            "snippet": f"This is test message {i}. Could you review the attached report",
+            "historyId": "1",
+            "internalDate": str(now_ms - i * 60_000),
+            "payload": {
+                "mimeType": "multipart/alternative",
+                "headers": [
+                    {"name": "Subject", "value": f"Report review #{i}"},
+                    {"name": "From", "value": f"Alex Example <alex{i % 7}@example.com>"},
+                    {"name": "Date", "value": "Mon, 1 Jan 2024 10:00:00 +0000"},
+                ],
+                "parts": [
+                    {"mimeType": "text/plain", "body": {"data": _b64(body)}},
+                    {"mimeType": "text/html", "body": {"data": _b64(f"<p>{body}</p>")}},
+                ],
+            },
+        }
+    return messages
+
+
+def _metadata_view(msg: dict) -> dict:
+    view = {k: v for k, v in msg.items() if k != "payload"}
+    view["payload"] = {"headers": msg["payload"]["headers"]}
+    return view
+
+
+def make_fake_gmail(latency: float = 0.05, messages: Dict[str, dict] = None, faults: Optional[Faults] = None) -> FastAPI:
+    """Fake Gmail API; every call (and every batch) waits `latency` seconds."""
+    app = FastAPI()
+    _install_faults(app, faults or NO_FAULTS, _gmail_error)
+    store = messages if messages is not None else make_messages()
+    app.state.calls = {"get": 0, "list": 0, "batch": 0, "send": 0, "delete": 0, "thread": 0}
+    # Message-ID header -> id of every sent message, for rfc822msgid: searches
+    app.state.sent = {}
+
+    def get_one(msg_id: str, fmt: str):
+        msg = store.get(msg_id)
+        if msg is None:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        return 200, (_metadata_view(msg) if fmt == "metadata" else msg)
+
+    @app.get("/gmail/v1/users/me/profile")
+    async def profile():
+        await asyncio.sleep(latency)
+        return {"emailAddress": "bench@example.com", "historyId": "1"}
+
+    @app.get("/gmail/v1/users/me/history")
+    async def history():
+        await asyncio.sleep(latency)
+        return {"historyId": "1", "history": []}
+
+    @app.get("/gmail/v1/users/me/messages")
+    async def list_messages(maxResults: int = 100, q: str = ""):
+        await asyncio.sleep(latency)
+        app.state.calls["list"] += 1
+        if q.startswith("rfc822msgid:"):
+            sent_id = app.state.sent.get(q[len("rfc822msgid:"):])
+            return {"messages": [{"id": sent_id}] if sent_id else [], "resultSizeEstimate": 1 if sent_id else 0}
+        ids = list(store)[:maxResults]
+        return {"messages": [{"id": i, "threadId": store[i]["threadId"]} for i in ids], "resultSizeEstimate": len(store)}
+
+    @app.get("/gmail/v1/users/me/messages/{msg_id}")
+    async def get_message(msg_id: str, format: str = "full"):
+        await asyncio.sleep(latency)
+        app.state.calls["get"] += 1
+        status, body = get_one(msg_id, format)
+        return JSONResponse(body, status_code=status)
+
+    @app.get("/gmail/v1/users/me/threads/{thread_id}")
+    async def get_thread(thread_id: str, format: str = "full"):
+        await asyncio.sleep(latency)
+        app.state.calls["thread"] += 1
+        messages = [get_one(i, format)[1] for i, m in store.items() if m["threadId"] == thread_id]
+        if not messages:
+            return JSONResponse({"error": {"code": 404, "message": "Not Found"}}, status_code=404)
+        return {"id": thread_id, "historyId": "1", "messages": messages}
+
+    @app.delete("/gmail/v1/users/me/messages/{msg_id}")
+    async def delete_message(msg_id: str):
+        await asyncio.sleep(latency)
+        app.state.calls["delete"] += 1
+        return Response(status_code=204)
+
+    @app.post("/gmail/v1/users/me/messages/send")
+    async def send(request: Request):
+        await asyncio.sleep(latency)
+        app.state.calls["send"] += 1
+        payload = await request.json()
+        sent_id = f"sent{app.state.calls['send']}"
+        mime = BytesParser(policy=HTTP).parsebytes(base64.urlsafe_b64decode(payload["raw"]))
+        if mime["Message-ID"]:
+            app.state.sent[mime["Message-ID"]] = sent_id
+        return {"id": sent_id, "threadId": payload.get("threadId")}
+
+    @app.post("/gmail/v1/users/me/messages/batchModify")
+    @app.post("/gmail/v1/users/me/messages/batchDelete")
+    async def batch_modify():
+        await asyncio.sleep(latency)
+        return Response(status_code=204)
+
+    async def batch(request: Request):
+        await asyncio.sleep(latency)
+        app.state.calls["batch"] += 1
+        content_type = request.headers["content-type"]
+        envelope = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + await request.body()
+        )
+        boundary = "batch_fake_boundary"
+        out: List[str] = []
+        for part in envelope.iter_parts():
+            content_id = (part.get("Content-ID") or "").strip("<>")
+            request_line = (part.get_payload(decode=True) or b"").decode().split("\n", 1)[0].strip()
+            _method, url = request_line.split(" ")[:2]
+            path, _, query = url.partition("?")
+            fmt = "metadata" if "format=metadata" in query else "full"
+            status, body = get_one(path.rsplit("/", 1)[-1], fmt)
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(body)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return Response("".join(out), media_type=f"multipart/mixed; boundary={boundary}")
+
+    app.add_api_route("/batch", batch, methods=["POST"])
+    app.add_api_route("/batch/gmail/v1", batch, methods=["POST"])
+    return app
+
+
+def make_fake_groq(
+    latency: float = 0.3,
+    reply: str = "Thanks for the update, I'll review it and reply by Friday.",
+    faults: Optional[Faults] = None,
+) -> FastAPI:
+    """
+    Fake OpenAI-compatible chat completions with a fixed latency, served on
+    the Groq SDK path and the OpenAI one. JSON-mode requests (batched
+    summaries) get one summary per "Email id:" in the prompt.
+    """
+    app = FastAPI()
+    _install_faults(app, faults or NO_FAULTS, _openai_error)
+    app.state.calls = 0
+
+    async def completions(request: Request):
+        payload = await request.json()
+        app.state.calls += 1
+        await asyncio.sleep(latency)
+        usage = {"prompt_tokens": 200, "completion_tokens": 20, "total_tokens": 220}
+        content = reply
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            prompt = payload["messages"][-1]["content"]
+            ids = re.findall(r"=== Email id: (\S+) ===", prompt)
+            content = json.dumps({msg_id: f"Summary of {msg_id}: {reply}" for msg_id in ids})
+
+        if payload.get("stream"):
+            async def events():
+                for word in reply.split(" "):
+                    chunk = {
+                        "id": "fake", "object": "chat.completion.chunk", "created": 0,
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {
+            "id": "fake", "object": "chat.completion", "created": 0, "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    app.add_api_route("/openai/v1/chat/completions", completions, methods=["POST"])
+    app.add_api_route("/v1/chat/completions", completions, methods=["POST"])
+    return app
@@ -0,0 +1,166 @@
+# benchmarks/harness.py
+"""
+Shared plumbing for the benchmarks: serving the fakes, seeding the token
+store, starting the real backend under uvicorn and driving it with a fixed
+concurrency.
+"""
+
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+BENCH_EMAIL = "bench@example.com"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def backend_env(
+    database_url: str,
+    gmail_port: int,
+    groq_port: int,
+    llm_budgets: bool = False,
+    openai_port: Optional[int] = None,
+) -> dict:
+    """
+    Environment for a backend talking to the fakes. OpenAI calls go to the
+    Groq fake unless `openai_port` is given. Unless `llm_budgets`, the LLM
+    rate budgets are switched off so the request path is measured rather
+    than the configured quota.
+    """
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=database_url,
+        GMAIL_API_BASE_URL=f"http://127.0.0.1:{gmail_port}",
+        GROQ_BASE_URL=f"http://127.0.0.1:{groq_port}",
+        GROQ_API_KEY="bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port or groq_port}/v1",
+        OPENAI_API_KEY="bench",
+        JWT_SECRET="bench-secret",
+        GOOGLE_CLIENT_ID="bench-client",
+        GOOGLE_CLIENT_SECRET="bench-secret",
+    )
+    if not llm_budgets:
+        env.update(
+            GROQ_REQUESTS_PER_MINUTE="0",
+            GROQ_TOKENS_PER_MINUTE="0",
+            OPENAI_REQUESTS_PER_MINUTE="0",
+            OPENAI_TOKENS_PER_MINUTE="0",
+        )
+    return env
+
+
+def seed_token_store(env: dict) -> str:
+    """Store a long-lived token for BENCH_EMAIL in env's DATABASE_URL and return a session JWT."""
+    os.environ.update(env)
+    from jose import jwt
+    from app import db
+
+    db.init_db()
+    db.save_token(
+        BENCH_EMAIL,
+        {
+            "token": "bench-access-token",
+            "refresh_token": "bench-refresh-token",
+            "token_uri": "http://127.0.0.1:9/token",
+            "client_id": env["GOOGLE_CLIENT_ID"],
+            "client_secret": env["GOOGLE_CLIENT_SECRET"],
+            "scopes": [],
+            "expiry": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        },
+    )
+    return jwt.encode({"sub": BENCH_EMAIL, "email": BENCH_EMAIL, "name": "Bench"}, env["JWT_SECRET"], algorithm="HS256")
+
+
+def start_backend(env: dict, port: int, app_target: str = "app.main:app") -> subprocess.Popen:
+    """Serve `app_target` (the real app by default) under uvicorn and wait until it answers."""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_target, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("backend did not start")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+async def run_level(
+    base_url: str,
+    session: str,
+    method: str,
+    path: str,
+    concurrency: int,
+    total: int,
+    json_body: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Send `total` requests from `concurrency` workers; latency percentiles in seconds."""
+    latencies = []
+    statuses: Counter = Counter()
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        headers = {"Authorization": f"Bearer {session}"}
+
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    resp = await client.request(method, path, headers=headers, json=json_body)
+                    status = resp.status_code
+                except httpx.HTTPError:
+                    status = "conn"
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "errors": sum(n for s, n in statuses.items() if s == "conn" or s >= 400),
+        "statuses": {str(s): n for s, n in sorted(statuses.items(), key=str)},
+    }
@@ -0,0 +1,183 @@
+# benchmarks/mime_corpus.py
+"""
+Fixture corpus of Gmail format=full payloads shaped like real mail:
+short replies with quoted history, newsletters with a stub text part,
+non-UTF-8 charsets, attachments, bodies stored as attachments, forwards,
+and multi-megabyte HTML.
+
+build_corpus() returns {name: Fixture}. Everything is generated
+deterministically, so nothing large has to live in the repository.
+"""
+
+import base64
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+class Fixture(NamedTuple):
+    message: Dict[str, Any]
+    # attachmentId -> base64url data, for bodies Gmail stores separately
+    attachments: Dict[str, str]
+    # text the extracted body must contain
+    expect: str
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _part(mime_type: str, data: bytes = b"", charset: Optional[str] = None, headers: Optional[List[tuple]] = None,
+          filename: str = "", attachment_id: Optional[str] = None, parts: Optional[list] = None) -> Dict[str, Any]:
+    content_type = mime_type + (f'; charset="{charset}"' if charset else "")
+    all_headers = [{"name": "Content-Type", "value": content_type}]
+    all_headers += [{"name": n, "value": v} for n, v in headers or []]
+    body: Dict[str, Any] = {"size": len(data)}
+    if attachment_id:
+        body["attachmentId"] = attachment_id
+    elif data:
+        body["data"] = _b64(data)
+    part = {"mimeType": mime_type, "filename": filename, "headers": all_headers, "body": body}
+    if parts is not None:
+        part["parts"] = parts
+        part["body"] = {"size": 0}
+    return part
+
+
+def _message(msg_id: str, payload: Dict[str, Any], subject: str = "Fixture") -> Dict[str, Any]:
+    payload = dict(payload)
+    payload["headers"] = payload.get("headers", []) + [
+        {"name": "Subject", "value": subject},
+        {"name": "From", "value": "Alex Example <alex@example.com>"},
+    ]
+    return {"id": msg_id, "threadId": msg_id, "labelIds": ["INBOX"], "snippet": "", "payload": payload}
+
+
+def _newsletter_html(kbytes: int) -> bytes:
+    style = "<style>" + ".c{color:#333;font-family:Arial}" * 200 + "</style>"
+    row = (
+        '<tr><td class="c" style="padding:12px;border-bottom:1px solid #eee">'
+        '<a href="https://example.com/track?u=1234567890&amp;id=abcdef">'
+        "<img src=\"https://example.com/img.png\" width=\"600\" alt=\"\"></a>"
+        "<p>This week&rsquo;s top stories: product launch, quarterly results &amp; more. "
+        "Read the full article on our website.</p></td></tr>\n"
+    )
+    rows = row * max(1, kbytes * 1024 // len(row))
+    footer = (
+        "<p>You are receiving this email because you subscribed. "
+        '<a href="https://example.com/unsub">Unsubscribe</a> | Manage preferences</p>'
+    )
+    return (
+        f"<html><head>{style}</head><body><table>"
+        "<tr><td><h1>Weekly Digest</h1></td></tr>\n"
+        f"{rows}</table>{footer}</body></html>"
+    ).encode("utf-8")
+
+
+def _thread_html(kbytes: int) -> bytes:
+    reply = "<div>Thanks, that works for me. Let's ship on Friday.</div><br>"
+    quote = (
+        '<div class="gmail_quote"><div>On Mon, Jan 1, 2024 at 9:00 AM Sam &lt;sam@example.com&gt; wrote:</div>'
+        "<blockquote>" + "<p>Earlier message in the thread with details about the release plan.</p>" * 40
+    )
+    depth = max(1, kbytes * 1024 // len(quote))
+    return ("<html><body>" + reply + quote * depth + "</blockquote></div>" * depth + "</body></html>").encode("utf-8")
+
+
+def build_corpus() -> Dict[str, Fixture]:
+    corpus: Dict[str, Fixture] = {}
+
+    plain = (
+        "Hi Sam,\n\nYes, Thursday at 3pm works. I'll bring the Q3 numbers.\n\nThanks,\nAlex\n-- \n"
+        "Alex Example | Finance\n\nOn Mon, Jan 1, 2024 at 10:00 AM Sam <sam@example.com> wrote:\n"
+        + "> Can we meet on Thursday to go over the numbers?\n" * 100
+    ).encode("utf-8")
+    corpus["plain_reply"] = Fixture(
+        _message("plain_reply", _part("text/plain", plain, "UTF-8")), {}, "Thursday at 3pm works"
+    )
+
+    corpus["newsletter_stub_plain"] = Fixture(
+        _message("newsletter_stub_plain", _part("multipart/alternative", parts=[
+            _part("text/plain", b"View this email in your browser.", "UTF-8"),
+            _part("text/html", _newsletter_html(300), "UTF-8"),
+        ])),
+        {},
+        "top stories",
+    )
+
+    latin1 = ("Hallo Jörg,\n\ndas Angebot für das Café ist angehängt. Grüße aus Köln!\n" * 20).encode("iso-8859-1")
+    corpus["latin1_plain"] = Fixture(
+        _message("latin1_plain", _part("text/plain", latin1, "ISO-8859-1")), {}, "Grüße aus Köln"
+    )
+
+    japanese = ("お世話になっております。来週の会議の資料を送付いたします。\n" * 30).encode("shift_jis")
+    corpus["shift_jis_plain"] = Fixture(
+        _message("shift_jis_plain", _part("text/plain", japanese, "Shift_JIS")), {}, "会議の資料"
+    )
+
+    corpus["mixed_with_pdf"] = Fixture(
+        _message("mixed_with_pdf", _part("multipart/mixed", parts=[
+            _part("multipart/alternative", parts=[
+                _part("text/plain", b"Invoice #1042 attached, due in 30 days.\n", "UTF-8"),
+                _part("text/html", b"<p>Invoice #1042 attached, due in 30 days.</p>", "UTF-8"),
+            ]),
+            _part("application/pdf", filename="invoice.pdf", attachment_id="pdf-1",
+                  headers=[("Content-Disposition", 'attachment; filename="invoice.pdf"')]),
+        ])),
+        {},
+        "Invoice #1042",
+    )
+
+    corpus["related_html_only"] = Fixture(
+        _message("related_html_only", _part("multipart/related", parts=[
+            _part("text/html", b"<html><body><p>See the chart below.</p><img src=\"cid:chart\"></body></html>", "UTF-8"),
+            _part("image/png", b"\x89PNG" * 1000, headers=[("Content-ID", "<chart>")]),
+        ])),
+        {},
+        "See the chart below",
+    )
+
+    qp = (
+        "Bonjour,\n\nLe rendez-vous est confirm=C3=A9 pour mardi =C3=A0 10h. Merci de pr=C3=A9voir les =\r\n"
+        "documents n=C3=A9cessaires.\n" * 20
+    ).encode("ascii")
+    corpus["quoted_printable_raw"] = Fixture(
+        _message("quoted_printable_raw", _part(
+            "text/plain", qp, "UTF-8", headers=[("Content-Transfer-Encoding", "quoted-printable")]
+        )),
+        {},
+        "confirmé pour mardi à 10h",
+    )
+
+    stored = _newsletter_html(50)
+    corpus["body_stored_as_attachment"] = Fixture(
+        _message("body_stored_as_attachment", _part("text/html", b"", "UTF-8", attachment_id="body-1")),
+        {"body-1": _b64(stored)},
+        "Weekly Digest",
+    )
+
+    corpus["forwarded_rfc822"] = Fixture(
+        _message("forwarded_rfc822", _part("multipart/mixed", parts=[
+            _part("text/plain", b"FYI, see the forwarded note below.\n", "UTF-8"),
+            _part("message/rfc822", parts=[
+                _part("multipart/alternative", parts=[
+                    _part("text/plain", b"Original: the contract is signed.\n", "UTF-8"),
+                    _part("text/html", b"<p>Original: the contract is signed.</p>", "UTF-8"),
+                ]),
+            ]),
+        ])),
+        {},
+        "FYI, see the forwarded note",
+    )
+
+    corpus["long_thread_html_1mb"] = Fixture(
+        _message("long_thread_html_1mb", _part("text/html", _thread_html(1024), "UTF-8")),
+        {},
+        "ship on Friday",
+    )
+
+    corpus["newsletter_html_2mb"] = Fixture(
+        _message("newsletter_html_2mb", _part("text/html", _newsletter_html(2048), "UTF-8")),
+        {},
+        "Weekly Digest",
+    )
+
+    return corpus
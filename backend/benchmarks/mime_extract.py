@@ -0,0 +1,108 @@
+# benchmarks/mime_extract.py
+"""
+Body extraction benchmark over the fixture corpus (benchmarks/mime_corpus.py).
+
+Compares the previous pipeline (first text part depth-first, always
+UTF-8, then regex tag stripping over the whole HTML) with
+app.mime_body.extract_body at the production character budget, and checks
+that each body contains the text it should.
+
+Run from the backend folder:
+
+    python -m benchmarks.mime_extract --repeat 20
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from base64 import urlsafe_b64decode
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.config import MESSAGE_BODY_MAX_CHARS  # noqa: E402
+from app.mime_body import extract_body  # noqa: E402
+
+from .mime_corpus import build_corpus  # noqa: E402
+
+
+def legacy_extract(msg: Dict[str, Any]) -> str:
+    """The pre-mime_body pipeline: extract_body_from_message + clean_email_body."""
+
+    def walk_parts(part: Dict[str, Any]) -> Optional[str]:
+        mime_type = part.get("mimeType", "")
+        data = part.get("body", {}).get("data")
+        if data and ("text/plain" in mime_type or "text/html" in mime_type):
+            try:
+                return urlsafe_b64decode(data.encode("utf-8") + b"==").decode("utf-8", errors="ignore")
+            except Exception:
+                return None
+        for sub in part.get("parts", []) or []:
+            res = walk_parts(sub)
+            if res:
+                return res
+        return None
+
+    body = walk_parts(msg.get("payload", {})) or ""
+    text = re.sub(r"<[^>]+>", " ", body)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-chars", type=int, default=MESSAGE_BODY_MAX_CHARS)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for name, fixture in build_corpus().items():
+        msg, attachments = fixture.message, fixture.attachments
+        payload_kb = len(json.dumps(msg)) / 1024 + sum(len(a) for a in attachments.values()) / 1024
+
+        def new():
+            return extract_body(msg, max_chars=args.max_chars, fetch_attachment=attachments.get)
+
+        old_text, new_text = legacy_extract(msg), new()
+        rows.append({
+            "fixture": name,
+            "payload_kb": round(payload_kb, 1),
+            "legacy_ms": round(_time(lambda: legacy_extract(msg), args.repeat) * 1000, 3),
+            "new_ms": round(_time(new, args.repeat) * 1000, 3),
+            "legacy_chars": len(old_text),
+            "new_chars": len(new_text),
+            "legacy_ok": fixture.expect in old_text,
+            "new_ok": fixture.expect in new_text,
+        })
+
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return
+
+    print(f"max_chars={args.max_chars}, median of {args.repeat} runs")
+    print(f"{'fixture':<28} {'KB':>8} {'legacy ms':>10} {'new ms':>9} {'speedup':>8} {'chars old/new':>15}  correct old/new")
+    for r in rows:
+        speedup = r["legacy_ms"] / r["new_ms"] if r["new_ms"] else float("inf")
+        print(
+            f"{r['fixture']:<28} {r['payload_kb']:>8.1f} {r['legacy_ms']:>10.3f} {r['new_ms']:>9.3f} "
+            f"{speedup:>7.1f}x {r['legacy_chars']:>7}/{r['new_chars']:<7}  "
+            f"{'yes' if r['legacy_ok'] else 'NO':>3}/{'yes' if r['new_ok'] else 'NO'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
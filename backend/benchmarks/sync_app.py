@@ -0,0 +1,109 @@
+# benchmarks/sync_app.py
+"""
+The request handlers as they were before the async request path, for
+`python -m benchmarks.async_concurrency --mode sync` (or the default `--mode both`).
+
+Plain `def` routes, so Starlette runs each one in its threadpool for the
+whole request, calling Gmail through googleapiclient and the LLM through
+the sync router, as the old /auth/me, /gmail/last5,
+/gmail/messages/{id}/body and /gmail/generate-reply/{id} did. They use
+today's sync helpers (credential cache, service cache, local store, summary
+batching), but not what the async routes gained later (thread context for
+replies, triage, reply drafts): set THREAD_CONTEXT_ENABLED=false to compare
+the reply route like for like.
+Not part of the app; serve with
+
+    uvicorn benchmarks.sync_app:app
+"""
+
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from jose import jwt
+
+from app import db, gmail_service, mail_sync, message_cache
+from app.auth_utils import get_session_email, get_session_token, refresh_credentials_if_needed
+from app.config import GMAIL_MAX_PAGE_SIZE, JWT_ALG, JWT_SECRET
+from app.message_cache import ParsedMessage
+from app.routers.ai import generate_reply, summarize_many
+
+app = FastAPI()
+
+
+@app.on_event("startup")
+def startup_event():
+    db.init_db()
+
+
+def _get_gmail_service(request: Request):
+    session_token = get_session_token(request)
+    creds = refresh_credentials_if_needed(session_token)
+    if not creds:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
+    return gmail_service.get_service(get_session_email(session_token), creds)
+
+
+def _get_parsed_message(request: Request, message_id: str) -> ParsedMessage:
+    user_email = get_session_email(get_session_token(request))
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Not authenticated or token invalid.")
+    record = message_cache.get(user_email, message_id)
+    if record is not None:
+        return record
+    row = db.get_messages(user_email, [message_id]).get(message_id)
+    if row is None:
+        service = _get_gmail_service(request)
+        try:
+            full = service.users().messages().get(userId="me", id=message_id, format="full").execute()
+        except Exception:
+            raise HTTPException(status_code=404, detail="Email not found")
+        row = mail_sync.message_to_row(full)
+    record = ParsedMessage.from_row(row)
+    message_cache.put(user_email, record)
+    return record
+
+
+@app.get("/auth/me")
+def me(request: Request):
+    token = get_session_token(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    return {"email": payload.get("email") or payload.get("sub"), "name": payload.get("name")}
+
+
+@app.get("/gmail/last5")
+def last5(request: Request, limit: int = Query(5, ge=1, le=GMAIL_MAX_PAGE_SIZE)):
+    service = _get_gmail_service(request)
+    user_email = get_session_email(get_session_token(request))
+    mail_sync.sync_mailbox(user_email, service)
+    rows = db.list_messages(user_email, label="INBOX", limit=limit)
+    message_cache.put_many(user_email, (ParsedMessage.from_row(row) for row in rows))
+
+    results: List[Dict[str, Any]] = [
+        {"id": r["id"], "subject": r["subject"], "from": r["from"], "snippet": r["snippet"], "body": r["body"]}
+        for r in rows
+    ]
+    summaries, cache_stats = summarize_many(
+        {m["id"]: m["body"] for m in results},
+        {m["id"]: f"AI summary unavailable. Preview: {m['snippet'][:140]}" for m in results},
+        user_email=user_email,
+    )
+    for m in results:
+        m["summary"] = summaries.get(m["id"], "")
+    return {"messages": results, "summary_cache": cache_stats}
+
+
+@app.get("/gmail/messages/{message_id}/body")
+def message_body(message_id: str, request: Request):
+    msg = _get_parsed_message(request, message_id)
+    return {"id": message_id, "threadId": msg.thread_id, "body": msg.body}
+
+
+@app.post("/gmail/generate-reply/{message_id}")
+def generate_reply_for_message(message_id: str, request: Request):
+    msg = _get_parsed_message(request, message_id)
+    return {"reply": generate_reply(msg.subject, msg.from_line, msg.body)}
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# app.db needs a database at import; the tests get a throwaway SQLite file.
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
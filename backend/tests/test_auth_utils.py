@@ -0,0 +1,8 @@
+from app import auth_utils
+
+
+def test_refresh_locks_are_shared_per_user_and_bounded():
+    assert auth_utils._refresh_lock("a@example.com") is auth_utils._refresh_lock("a@example.com")
+    locks = {id(auth_utils._refresh_lock(f"user{i}@example.com")) for i in range(10000)}
+    assert len(locks) <= auth_utils._REFRESH_LOCK_STRIPES
+    assert len(auth_utils._refresh_locks) == auth_utils._REFRESH_LOCK_STRIPES
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import db, gmail_async
+from app.routers import gmail
+
+EMAIL = "bulk-test@example.com"
+
+
+class FakeGmail:
+    """batchModify/batchDelete over httpx.MockTransport; calls whose first id is in `failing` get a 500."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.calls.append((request.method, request.url.path.rsplit("/", 1)[-1], body))
+        if body["ids"][0] in self.failing:
+            return httpx.Response(500, text="backend error")
+        return httpx.Response(204)
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    fake = FakeGmail()
+    monkeypatch.setattr(gmail_async, "_client", httpx.AsyncClient(transport=httpx.MockTransport(fake)))
+    return fake
+
+
+CREDS = SimpleNamespace(token="token")
+
+
+def test_ids_are_sent_in_chunks_and_a_failed_chunk_fails_only_its_ids(fake_gmail, monkeypatch):
+    monkeypatch.setattr(gmail_async, "GMAIL_BULK_LIMIT", 2)
+    fake_gmail.failing = {"c"}
+    results = asyncio.run(gmail_async.batch_modify(CREDS, ["a", "b", "c", "d", "e"], remove_label_ids=["INBOX"]))
+
+    assert results["a"] is None and results["b"] is None and results["e"] is None
+    assert "500" in results["c"] and "500" in results["d"]
+    assert sorted(body["ids"] for _, _, body in fake_gmail.calls) == [["a", "b"], ["c", "d"], ["e"]]
+    assert all(
+        (method, path, body.get("removeLabelIds"), "addLabelIds" in body) == ("POST", "batchModify", ["INBOX"], False)
+        for method, path, body in fake_gmail.calls
+    )
+
+
+def _request(monkeypatch):
+    async def get_credentials(request):
+        return EMAIL, CREDS
+
+    monkeypatch.setattr(gmail, "_get_credentials", get_credentials)
+    db.init_db()
+    db.replace_messages(EMAIL, [
+        {
+            "id": msg_id, "thread_id": msg_id, "label_ids": ["INBOX", "UNREAD"], "subject": "Hello",
+            "from": "dana@example.com", "snippet": "", "body": "", "internal_date": 1, "headers": {},
+        }
+        for msg_id in ("m1", "m2")
+    ])
+    return SimpleNamespace()
+
+
+def test_bulk_archive_updates_the_local_store(fake_gmail, monkeypatch):
+    request = _request(monkeypatch)
+    response = asyncio.run(gmail.bulk_archive(request, {"ids": ["m1", "m2", "m1"]}))
+
+    assert (response["succeeded"], response["failed"]) == (2, 0)
+    assert [body["ids"] for _, _, body in fake_gmail.calls] == [["m1", "m2"]]
+    assert {i: row["label_ids"] for i, row in db.get_messages(EMAIL, ["m1", "m2"]).items()} == {
+        "m1": ["UNREAD"], "m2": ["UNREAD"],
+    }
+
+
+def test_bulk_delete_forgets_only_what_gmail_deleted(fake_gmail, monkeypatch):
+    request = _request(monkeypatch)
+    monkeypatch.setattr(gmail_async, "GMAIL_BULK_LIMIT", 1)
+    fake_gmail.failing = {"m2"}
+    response = asyncio.run(gmail.bulk_delete(request, {"ids": ["m1", "m2"]}))
+
+    assert (response["succeeded"], response["failed"]) == (1, 1)
+    assert {path for _, path, _ in fake_gmail.calls} == {"batchDelete"}
+    assert list(db.get_messages(EMAIL, ["m1", "m2"])) == ["m2"]
@@ -0,0 +1,190 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import llm_governor
+from app.llm_governor import CircuitBreaker, Governor, LLMUnavailable, RateLimiter
+
+
+class FakeClock:
+    """Stands in for the `time` module: sleeping only moves the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class FakeProvider:
+    """Answers with the queued outcomes in turn: an exception is raised, anything else returned."""
+
+    def __init__(self, clock, *outcomes):
+        self.clock = clock
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def __call__(self, timeout):
+        self.calls.append(self.clock.now)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_governor, "time", clock)
+    # No jitter: backoff takes the low end
+    monkeypatch.setattr(llm_governor, "random", SimpleNamespace(uniform=lambda low, high: low))
+    return clock
+
+
+def _governor(requests_per_minute=0, max_retries=0, failures=3, reset_seconds=30.0):
+    governor = Governor("test", requests_per_minute, 0, max_retries=max_retries, max_queue_seconds=2)
+    governor.breaker = CircuitBreaker("test", failures, reset_seconds)
+    return governor
+
+
+def test_breaker_opens_after_failures_and_closes_after_a_half_open_success(clock):
+    governor = _governor(failures=3)
+    provider = FakeProvider(clock, *[ProviderError(500)] * 3, "probe ok", "ok")
+
+    for _ in range(3):
+        with pytest.raises(LLMUnavailable):
+            governor.call(provider)
+    assert governor.breaker.state == "open"
+
+    # Open: refused without reaching the provider
+    with pytest.raises(LLMUnavailable, match="circuit open"):
+        governor.call(provider)
+    assert len(provider.calls) == 3
+
+    clock.now += 30
+    # Half-open lets one probe through; only one at a time
+    assert governor.breaker.allow()
+    assert not governor.breaker.allow()
+    governor.breaker.release()
+
+    assert governor.call(provider) == "probe ok"
+    assert governor.breaker.state == "closed"
+    assert governor.call(provider) == "ok"
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("test", 2, 30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow() and breaker.state == "half_open"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_retry_after_is_respected(clock):
+    governor = _governor(max_retries=2)
+    provider = FakeProvider(clock, ProviderError(429, {"retry-after": "3"}), "ok")
+    start = clock.now
+
+    assert governor.call(provider) == "ok"
+    assert clock.sleeps == [3.0]
+    assert provider.calls == [start, start + 3]
+    assert governor.stats()["retries"] == 1
+
+
+def test_retry_after_is_respected_by_async_calls(clock, monkeypatch):
+    async def sleep(seconds):
+        clock.sleep(seconds)
+
+    monkeypatch.setattr(llm_governor, "asyncio", SimpleNamespace(sleep=sleep, CancelledError=asyncio.CancelledError))
+    governor = _governor(max_retries=2)
+    provider = FakeProvider(clock, ProviderError(429, {"retry-after": "2"}), "ok")
+
+    async def call(timeout):
+        return provider(timeout)
+
+    assert asyncio.run(governor.call_async(call)) == "ok"
+    assert clock.sleeps == [2.0]
+
+
+def test_retry_after_pauses_other_callers(clock):
+    governor = _governor(max_retries=0)
+    with pytest.raises(LLMUnavailable):
+        governor.call(FakeProvider(clock, ProviderError(429, {"retry-after-ms": "1500"})))
+    # Everyone waits out the pause; no one is sent early
+    assert governor.limiter.reserve(0, max_wait=10) == pytest.approx(1.5)
+    assert governor.limiter.headroom() == 0.0
+
+
+def test_retry_after_longer_than_the_backoff_cap_is_not_waited_out(clock):
+    governor = _governor(max_retries=3)
+    provider = FakeProvider(clock, ProviderError(429, {"retry-after": "600"}), "ok")
+    with pytest.raises(LLMUnavailable, match="retry after"):
+        governor.call(provider)
+    assert clock.sleeps == []
+    assert len(provider.calls) == 1
+
+
+def test_backoff_grows_exponentially_without_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(llm_governor, "random", SimpleNamespace(uniform=lambda low, high: high))
+    governor = _governor(max_retries=3, failures=10)
+    provider = FakeProvider(clock, ProviderError(503), ProviderError(503), ProviderError(503), "ok")
+    assert governor.call(provider) == "ok"
+    base = llm_governor.LLM_BACKOFF_BASE_SECONDS
+    assert clock.sleeps == [base, base * 2, base * 4]
+
+
+def test_client_errors_are_not_retried(clock):
+    governor = _governor(max_retries=3)
+    provider = FakeProvider(clock, ProviderError(400), "ok")
+    with pytest.raises(ProviderError):
+        governor.call(provider)
+    assert len(provider.calls) == 1
+    assert governor.breaker.state == "closed"
+
+
+def test_limiter_blocks_when_the_bucket_is_empty(clock):
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=0)
+    assert limiter.reserve(0, max_wait=0) == 0.0
+    assert limiter.reserve(0, max_wait=0) == 0.0
+    # Empty: the next request is 30 s away (2 per minute)
+    assert limiter.reserve(0, max_wait=1) is None
+    assert limiter.reserve(0, max_wait=60) == pytest.approx(30.0)
+
+    clock.now += 90
+    assert limiter.reserve(0, max_wait=0) == 0.0
+
+
+def test_token_bucket_limits_large_calls(clock):
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600)
+    assert limiter.reserve(600, max_wait=0) == 0.0
+    assert limiter.reserve(100, max_wait=5) is None
+    assert limiter.reserve(100, max_wait=10) == pytest.approx(10.0)
+
+
+def test_governor_refuses_calls_that_would_queue_too_long(clock):
+    governor = _governor(requests_per_minute=1)
+    provider = FakeProvider(clock, "first", "second")
+    assert governor.call(provider) == "first"
+    with pytest.raises(LLMUnavailable, match="rate limit"):
+        governor.call(provider)
+    assert len(provider.calls) == 1
+    assert governor.stats()["throttled"] == 1
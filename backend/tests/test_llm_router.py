@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from app import llm_router
+from app.llm_router import Provider, Router
+
+
+class _Governor:
+    def call(self, fn, tokens=0):
+        return fn(None)
+
+    def headroom(self):
+        return 1.0
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None, x_groq=None)
+
+
+def _provider(name, create):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return Provider(name, "model", _Governor(), client, None)
+
+
+def _fail(**kwargs):
+    raise RuntimeError("down")
+
+
+def test_stream_records_successes_as_well_as_failures(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_ROUTER_MIN_SAMPLES", 1)
+    ok = _provider("ok", lambda **kwargs: iter([_chunk("Hi"), _chunk(" there")]))
+    for _ in range(3):
+        assert "".join(Router([ok]).stream("system", "user")) == "Hi there"
+    stats = ok.stats()
+    assert (stats["calls"], stats["wins"], stats["failures"]) == (3, 3, 0)
+    assert stats["error_rate"] == 0.0
+    assert stats["p50"] is not None
+
+    down = _provider("down", _fail)
+    assert "".join(Router([down, ok]).stream("system", "user")) == "Hi there"
+    assert (down.stats()["calls"], down.stats()["failures"]) == (1, 1)
+    assert ok.stats()["calls"] == 4
@@ -0,0 +1,75 @@
+import pytest
+
+from app import db, mail_sync
+
+EMAIL = "sync-test@example.com"
+
+
+def _msg(msg_id, labels):
+    return {"message": {"id": msg_id, "threadId": "t-" + msg_id, "labelIds": labels}}
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Ids incremental_sync asks Gmail for; each comes back as a minimal inbox row."""
+    db.init_db()
+    ids = []
+
+    def fetch_rows(service, message_ids):
+        ids.extend(message_ids)
+        return [
+            {"id": mid, "thread_id": "t-" + mid, "label_ids": ["INBOX"], "subject": "s", "from": "a@example.com",
+             "snippet": "", "body": "", "internal_date": 1, "headers": {}}
+            for mid in message_ids
+        ]
+
+    monkeypatch.setattr(mail_sync, "_fetch_rows", fetch_rows)
+    return ids
+
+
+def _sync(monkeypatch, records):
+    monkeypatch.setattr(mail_sync, "_read_history", lambda service, start: (records, "2"))
+    return mail_sync.incremental_sync(EMAIL, None, "1")
+
+
+def test_message_added_outside_inbox_then_moved_in_is_fetched(monkeypatch, fetched):
+    records = [
+        {"messagesAdded": [_msg("late-inbox", ["DRAFT"])]},
+        {"labelsAdded": [_msg("late-inbox", ["INBOX", "UNREAD"])]},
+    ]
+    assert _sync(monkeypatch, records)["added"] == 1
+    assert fetched == ["late-inbox"]
+    assert "late-inbox" in db.get_messages(EMAIL, ["late-inbox"])
+
+
+def test_message_added_to_inbox_then_moved_out_is_not_fetched(monkeypatch, fetched):
+    records = [
+        {"messagesAdded": [_msg("archived", ["INBOX"])]},
+        {"labelsRemoved": [_msg("archived", ["CATEGORY_UPDATES"])]},
+    ]
+    assert _sync(monkeypatch, records)["added"] == 0
+    assert fetched == []
+
+
+def test_message_gmail_failed_to_return_is_fetched_by_the_next_sync(monkeypatch, fetched):
+    down = {"flaky"}
+    fetch_rows = mail_sync._fetch_rows
+    monkeypatch.setattr(mail_sync, "_fetch_rows", lambda service, ids: fetch_rows(service, [m for m in ids if m not in down]))
+
+    assert _sync(monkeypatch, [{"messagesAdded": [_msg("flaky", ["INBOX"])]}])["added"] == 0
+    assert "flaky" not in db.get_messages(EMAIL, ["flaky"])
+    assert db.get_sync_retries(EMAIL) == {"flaky": 1}
+
+    down.clear()
+    assert _sync(monkeypatch, [])["added"] == 1
+    assert "flaky" in db.get_messages(EMAIL, ["flaky"])
+    assert db.get_sync_retries(EMAIL) == {}
+
+
+def test_message_deleted_before_the_retry_is_not_fetched(monkeypatch, fetched):
+    monkeypatch.setattr(mail_sync, "_fetch_rows", lambda service, ids: [])
+    _sync(monkeypatch, [{"messagesAdded": [_msg("gone", ["INBOX"])]}])
+    assert db.get_sync_retries(EMAIL) == {"gone": 1}
+
+    _sync(monkeypatch, [{"messagesDeleted": [_msg("gone", [])]}])
+    assert db.get_sync_retries(EMAIL) == {}
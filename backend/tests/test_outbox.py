@@ -0,0 +1,175 @@
+import threading
+from types import SimpleNamespace
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from sqlalchemy import delete, func, select
+
+from app import db, outbox
+
+EMAIL = "outbox-test@example.com"
+
+
+class Clock:
+    """Stands in for db's `time` module, so leases and due times can be jumped over."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    db.init_db()
+    with db.engine.begin() as conn:
+        conn.execute(delete(db.outbox_table))
+    clock = Clock()
+    monkeypatch.setattr(db, "time", clock)
+    return clock
+
+
+def _rows():
+    with db.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(db.outbox_table)).scalar()
+
+
+def test_repeated_enqueue_returns_the_same_entry(clock):
+    first = db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+    assert db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!") == first
+    assert _rows() == 1
+
+    # The key is per user, and a new key is a new reply
+    assert db.enqueue_outbox("someone-else@example.com", "m1", "key-1", "Thanks!") != first
+    assert db.enqueue_outbox(EMAIL, "m1", "key-2", "Thanks again!") != first
+    assert _rows() == 3
+
+
+def test_parallel_workers_never_claim_the_same_entry(clock):
+    ids = {db.enqueue_outbox(EMAIL, f"m{i}", f"key-{i}", "Thanks!") for i in range(20)}
+    barrier = threading.Barrier(2)
+    claimed = [[], []]
+
+    def worker(n):
+        barrier.wait()
+        while True:
+            batch = db.claim_outbox(3, lease_seconds=60)
+            if not batch:
+                return
+            claimed[n].extend(batch)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    got = [entry["id"] for entries in claimed for entry in entries]
+    assert sorted(got) == sorted(ids)
+    assert all(entry["status"] == "sending" and entry["attempts"] == 1 for entries in claimed for entry in entries)
+
+
+def test_expired_lease_is_claimed_again(clock):
+    outbox_id = db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+    assert [e["id"] for e in db.claim_outbox(5, lease_seconds=60)] == [outbox_id]
+
+    # The worker died: nobody else may take it until the lease runs out
+    clock.now += 59
+    assert db.claim_outbox(5, lease_seconds=60) == []
+    clock.now += 2
+    [entry] = db.claim_outbox(5, lease_seconds=60)
+    assert (entry["id"], entry["attempts"]) == (outbox_id, 2)
+
+
+class FakeGmail:
+    """messages.send fails with the queued HTTP statuses, then succeeds; messages.list finds `sent`."""
+
+    def __init__(self, failures=(), sent=None):
+        self.failures = list(failures)
+        self.sent = sent
+        self.sends = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        def execute():
+            if self.failures:
+                status = self.failures.pop(0)
+                raise HttpError(httplib2.Response({"status": status}), b"")
+            self.sends.append(body)
+            return {"id": f"sent-{len(self.sends)}"}
+        return SimpleNamespace(execute=execute)
+
+    def list(self, userId, q, **kwargs):
+        return SimpleNamespace(execute=lambda: {"messages": [{"id": self.sent}] if self.sent else []})
+
+
+@pytest.fixture
+def gmail(monkeypatch, clock):
+    db.upsert_messages(EMAIL, [{
+        "id": "m1", "thread_id": "t1", "label_ids": ["INBOX"], "subject": "Hello", "from": "dana@example.com",
+        "snippet": "", "body": "", "internal_date": 1, "headers": {},
+    }])
+    service = FakeGmail()
+    monkeypatch.setattr(outbox, "get_credentials_for_email", lambda email: object())
+    monkeypatch.setattr(outbox.gmail_service, "get_service", lambda email, creds: service)
+    monkeypatch.setattr(outbox, "retry_delay", lambda attempts: 10.0)
+    return service
+
+
+def _send_next(clock):
+    [entry] = db.claim_outbox(1, lease_seconds=60)
+    outbox.OutboxWorker().send(entry)
+    return db.get_outbox(EMAIL, entry["id"])
+
+
+def test_failed_send_is_retried_after_its_backoff(clock, gmail):
+    gmail.failures = [503]
+    db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+
+    entry = _send_next(clock)
+    assert (entry["status"], entry["attempts"], entry["error"]) == ("queued", 1, "Gmail error 503")
+    assert db.claim_outbox(1, lease_seconds=60) == []
+
+    clock.now += 10
+    entry = _send_next(clock)
+    assert (entry["status"], entry["attempts"], entry["sent_message_id"]) == ("sent", 2, "sent-1")
+    assert len(gmail.sends) == 1
+
+
+def test_send_gives_up_after_max_attempts(clock, gmail, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    gmail.failures = [503, 503]
+    db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+
+    assert _send_next(clock)["status"] == "queued"
+    clock.now += 10
+    entry = _send_next(clock)
+    assert (entry["status"], entry["attempts"]) == ("failed", 2)
+    clock.now += 3600
+    assert db.claim_outbox(1, lease_seconds=60) == []
+
+
+def test_rejected_send_fails_at_once(clock, gmail):
+    gmail.failures = [400]
+    db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+    entry = _send_next(clock)
+    assert (entry["status"], entry["attempts"]) == ("failed", 1)
+
+
+def test_reply_an_earlier_attempt_sent_is_not_sent_again(clock, gmail):
+    db.enqueue_outbox(EMAIL, "m1", "key-1", "Thanks!")
+    db.claim_outbox(1, lease_seconds=60)
+    # That worker died after Gmail took the reply
+    gmail.sent = "sent-earlier"
+    clock.now += 61
+
+    entry = _send_next(clock)
+    assert (entry["status"], entry["attempts"], entry["sent_message_id"]) == ("sent", 2, "sent-earlier")
+    assert gmail.sends == []
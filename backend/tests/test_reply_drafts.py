@@ -0,0 +1,56 @@
+import asyncio
+
+from app import db, reply_drafts, thread_context
+from app.message_cache import ParsedMessage
+
+RECORD = ParsedMessage("m3", "t1", "Plans", "Dana <dana@example.com>", "", "Can we meet on Friday?", ("INBOX",))
+
+
+def _run(monkeypatch, email, tokens_per_hour):
+    """Draft a reply to the third message of a thread whose first two were never folded."""
+    db.init_db()
+    thread = {"messages": [{"id": f"m{i}", "internalDate": str(i)} for i in (1, 2, 3)]}
+    rows = [
+        {"id": f"m{i}", "from": "Dana <dana@example.com>", "body": "Let's plan the offsite. " * 40, "internal_date": i}
+        for i in (1, 2)
+    ]
+    folds = []
+
+    async def get_thread(creds, thread_id, fmt="full"):
+        return thread
+
+    async def load_rows(email, creds, ids):
+        return [r for r in rows if r["id"] in ids]
+
+    async def fold(summary, batch):
+        folds.append(batch)
+        return "They are planning an offsite.", "test:model"
+
+    async def draft(subject, from_line, body, user_name=None, hedge=False, thread_summary=None):
+        return f"Reply (context: {thread_summary})"
+
+    monkeypatch.setattr(thread_context.gmail_async, "get_thread", get_thread)
+    monkeypatch.setattr(thread_context, "_load_rows", load_rows)
+    monkeypatch.setattr(thread_context, "fold_thread_async", fold)
+    monkeypatch.setattr(thread_context, "CACHE_MODELS", ["test:model"])
+    monkeypatch.setattr(reply_drafts, "draft_reply_async", draft)
+    monkeypatch.setattr(reply_drafts, "REPLY_SPECULATION_TOKENS_PER_HOUR", tokens_per_hour)
+    monkeypatch.setattr(reply_drafts, "_spent", {})
+
+    key = reply_drafts.make_key(email, RECORD.id)
+    assert reply_drafts._charge(email, reply_drafts._cost(RECORD))
+    reply = asyncio.run(reply_drafts._draft(key, RECORD, creds=object()))
+    return reply, folds, sum(reply_drafts._spent.values())
+
+
+def test_thread_folds_are_charged_to_the_draft_budget(monkeypatch):
+    reply, folds, spent = _run(monkeypatch, "drafts-charged@example.com", 100000)
+    assert folds and reply == "Reply (context: They are planning an offsite.)"
+    assert spent > reply_drafts._cost(RECORD)
+
+
+def test_draft_skips_folds_its_budget_cannot_cover(monkeypatch):
+    reply, folds, spent = _run(monkeypatch, "drafts-skipped@example.com", reply_drafts._cost(RECORD) + 10)
+    assert folds == []
+    assert reply == "Reply (context: None)"
+    assert spent == reply_drafts._cost(RECORD)
@@ -0,0 +1,81 @@
+import pytest
+
+from app import db
+
+EMAIL = "search-test@example.com"
+
+
+def _row(message_id, subject, body, sender="Dana Lee <dana@example.com>", date=1, labels=("INBOX",)):
+    return {
+        "id": message_id, "thread_id": message_id, "label_ids": list(labels), "subject": subject, "from": sender,
+        "snippet": "", "body": body, "internal_date": date, "headers": {},
+    }
+
+
+def _ids(query, email=EMAIL, **kwargs):
+    return [r["id"] for r in db.search_messages(email, query, **kwargs)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("budget", '"budget"'),
+    ("budget review", '"budget" AND "review"'),
+    ('"quarterly budget" review', '"quarterly budget" AND "review"'),
+    ("budget OR forecast", '("budget" OR "forecast")'),
+    ("budget -draft", '"budget" NOT "draft"'),
+    ('budget -"first draft"', '"budget" NOT "first draft"'),
+    # FTS5 syntax in the input is only ever text
+    ('NEAR(budget review) col:x* "unclosed', '"NEAR budget" AND "review" AND "col x" AND "unclosed"'),
+    ("AND OR NOT", '("AND" OR "NOT")'),
+    ("-only -excluded", None),
+    ("*** ::: ()", None),
+])
+def test_fts5_query(query, expected):
+    assert db._fts5_query(query) == expected
+
+
+def test_index_follows_upserts_summaries_and_deletes():
+    db.init_db()
+    db.upsert_messages(EMAIL, [
+        _row("s1", "Quarterly budget review", "Numbers for the offsite are attached.", date=1),
+        _row("s2", "Lunch", "Shall we try the new budget ramen place?", date=2),
+        _row("s3", "Offsite", "The venue is booked.", sender="Venue Team <events@venue.example>", date=3),
+    ])
+
+    # Subject matches rank above body matches
+    assert _ids("budget") == ["s1", "s2"]
+    assert _ids("offsite") == ["s3", "s1"]
+    assert _ids('"budget review"') == ["s1"]
+    assert _ids("budget -ramen") == ["s1"]
+    assert _ids("ramen OR venue") == ["s3", "s2"]
+    assert _ids("venue.example") == ["s3"]
+    assert _ids('ramen" OR 1=1 --') == ["s2"]
+    assert _ids("budget", email="someone-else@example.com") == []
+
+    # A changed message is reindexed
+    db.upsert_messages(EMAIL, [_row("s2", "Lunch", "Shall we try the new sushi place?", date=2)])
+    assert _ids("ramen") == []
+    assert _ids("sushi") == ["s2"]
+
+    # So is its summary
+    db.save_summary(EMAIL, "s3", "hash", "test:model", "pv", "Catering invoice for the venue.")
+    assert _ids("catering") == ["s3"]
+    assert db.search_messages(EMAIL, "catering")[0]["summary"] == "Catering invoice for the venue."
+
+    db.delete_messages(EMAIL, ["s1"])
+    assert _ids("budget") == []
+    assert _ids("offsite") == ["s3"]
+
+    db.replace_messages(EMAIL, [_row("s4", "Budget v2", "New numbers.", date=4)])
+    assert _ids("budget") == ["s4"]
+    assert _ids("sushi OR venue") == []
+
+
+def test_search_filters_by_label_and_pages():
+    db.init_db()
+    email = "search-pages@example.com"
+    db.upsert_messages(email, [
+        _row(f"p{i}", "Weekly report", f"Report number {i}.", date=i, labels=("INBOX",) if i % 2 else ("SENT",))
+        for i in range(1, 7)
+    ])
+    assert _ids("report", email=email, label="INBOX") == ["p5", "p3", "p1"]
+    assert _ids("report", email=email, limit=2, offset=2) == ["p4", "p3"]
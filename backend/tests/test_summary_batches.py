@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from app.llm_router import Completion, llm_router
+from app.routers import ai
+
+IDS = ["a", "b", "c"]
+
+
+def test_parses_a_json_object_of_summaries():
+    text = json.dumps({"a": "First.", "b": "Second.", "c": "Third."})
+    assert ai._parse_batch_summaries(text, IDS) == {"a": "First.", "b": "Second.", "c": "Third."}
+
+
+def test_parses_an_object_wrapped_in_prose_or_a_summaries_key():
+    fenced = 'Here you go:\n```json\n{"a": "First.", "b": "Second."}\n```'
+    assert ai._parse_batch_summaries(fenced, IDS) == {"a": "First.", "b": "Second."}
+    nested = json.dumps({"summaries": {"c": "Third."}})
+    assert ai._parse_batch_summaries(nested, IDS) == {"c": "Third."}
+
+
+def test_malformed_output_gives_nothing():
+    for text in ("", "not json at all", '{"a": "First.", "b": ', "[\"First.\", \"Second.\"]", "{broken}"):
+        assert ai._parse_batch_summaries(text, IDS) == {}, text
+
+
+def test_missing_extra_and_bad_entries_are_left_out():
+    text = json.dumps({
+        "a": "  First.  ",
+        "b": "",
+        "c": {"summary": "nested"},
+        "z": "An id nobody asked for.",
+    })
+    assert ai._parse_batch_summaries(text, IDS) == {"a": "First."}
+
+    too_long = json.dumps({"a": "x" * (ai.SUMMARY_MAX_CHARS + 1), "b": "AI summary unavailable. Preview: hi"})
+    assert ai._parse_batch_summaries(too_long, IDS) == {}
+
+
+def test_batch_entries_missing_from_the_answer_get_their_own_call(monkeypatch):
+    monkeypatch.setattr(ai, "SUMMARY_BATCH_SIZE", 8)
+    monkeypatch.setattr(llm_router, "available", lambda: True)
+    calls = []
+
+    def complete(system_prompt, user_prompt, **kwargs):
+        calls.append(system_prompt)
+        if system_prompt == ai.SUMMARY_BATCH_SYSTEM_PROMPT:
+            # The model drops one email and invents another
+            return Completion(json.dumps({"a": "Batched a.", "z": "Invented."}), "test", "model")
+        return Completion("Single summary.", "test", "model")
+
+    monkeypatch.setattr(llm_router, "complete", complete)
+    bodies = {"a": "Meeting moved to 3pm on Thursday.", "b": "Invoice 42 is attached for March."}
+    summaries, stats = ai.summarize_many(bodies, {"a": "preview a", "b": "preview b"})
+
+    assert summaries == {"a": "Batched a.", "b": "Single summary."}
+    assert calls == [ai.SUMMARY_BATCH_SYSTEM_PROMPT, ai.SUMMARY_SYSTEM_PROMPT]
+    assert stats["misses"] == 2
+
+
+def test_failed_batch_call_falls_back_to_single_calls(monkeypatch):
+    monkeypatch.setattr(ai, "SUMMARY_BATCH_SIZE", 8)
+    monkeypatch.setattr(llm_router, "available", lambda: True)
+    calls = []
+
+    def complete(system_prompt, user_prompt, **kwargs):
+        calls.append(system_prompt)
+        if system_prompt == ai.SUMMARY_BATCH_SYSTEM_PROMPT:
+            raise RuntimeError("provider down")
+        return Completion("Single summary.", "test", "model")
+
+    monkeypatch.setattr(llm_router, "complete", complete)
+    bodies = {"a": "Meeting moved to 3pm on Thursday.", "b": "Invoice 42 is attached for March."}
+    summaries, _ = ai.summarize_many(bodies, {})
+
+    assert summaries == {"a": "Single summary.", "b": "Single summary."}
+    assert calls.count(ai.SUMMARY_SYSTEM_PROMPT) == 2
+
+
+def test_async_batches_fall_back_the_same_way(monkeypatch):
+    monkeypatch.setattr(ai, "SUMMARY_BATCH_SIZE", 8)
+    monkeypatch.setattr(llm_router, "available", lambda: True)
+    calls = []
+
+    async def complete_async(system_prompt, user_prompt, **kwargs):
+        calls.append(system_prompt)
+        if system_prompt == ai.SUMMARY_BATCH_SYSTEM_PROMPT:
+            return Completion('Sure! {"b": "Batched b."', "test", "model")
+        return Completion("Single summary.", "test", "model")
+
+    monkeypatch.setattr(llm_router, "complete_async", complete_async)
+    bodies = {"a": "Meeting moved to 3pm on Thursday.", "b": "Invoice 42 is attached for March."}
+    summaries, _ = asyncio.run(ai.summarize_many_async(bodies, {}))
+
+    # Truncated JSON: nothing from the batch is trusted
+    assert summaries == {"a": "Single summary.", "b": "Single summary."}
+    assert calls.count(ai.SUMMARY_SYSTEM_PROMPT) == 2
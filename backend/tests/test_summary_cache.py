@@ -0,0 +1,36 @@
+from app import db, summary_cache
+from app.llm_router import Completion, llm_router
+from app.routers import ai
+
+EMAIL = "cache-test@example.com"
+
+
+def _forget_memory():
+    with summary_cache._lock:
+        summary_cache._memory.clear()
+
+
+def test_summaries_are_served_only_for_the_model_that_wrote_them():
+    db.init_db()
+    key = summary_cache.make_key(EMAIL, "m1", "body", "pv-cache-test")
+    summary_cache.put(key, "Written by OpenAI", "openai:gpt-4o")
+    _forget_memory()
+
+    assert summary_cache.get(key, ["groq:llama"]) is None
+    assert summary_cache.get(key, ["groq:llama", "openai:gpt-4o"]) == "Written by OpenAI"
+
+    _forget_memory()
+    summary_cache.invalidate_stale(["groq:llama", "openai:gpt-4o-mini"], "pv-cache-test")
+    assert summary_cache.get(key, ["groq:llama", "openai:gpt-4o"]) is None
+
+
+def test_summary_is_stored_under_the_provider_that_answered(monkeypatch):
+    db.init_db()
+    monkeypatch.setattr(ai, "CACHE_MODELS", ["groq:llama", "openai:gpt-4o"])
+    monkeypatch.setattr(llm_router, "available", lambda: True)
+    monkeypatch.setattr(llm_router, "complete", lambda *args, **kwargs: Completion("A summary.", "openai", "gpt-4o"))
+
+    assert ai.summarize_email("Please review the attached report.", user_email=EMAIL, message_id="m2") == "A summary."
+    stored = db.get_summaries(EMAIL, ["m2"], ["openai:gpt-4o"], ai.SUMMARY_PROMPT_VERSION)
+    assert list(stored.values()) == ["A summary."]
+    assert db.get_summaries(EMAIL, ["m2"], ["groq:llama"], ai.SUMMARY_PROMPT_VERSION) == {}
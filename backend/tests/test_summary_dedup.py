@@ -0,0 +1,66 @@
+from app import db, summary_dedup
+from app.summary_cache import SummaryKey
+
+PARA = (
+    "This week in open source: the project shipped a new scheduler, cut memory use on large "
+    "inboxes, and fixed the long standing bug with calendar invites. Read the full notes on the "
+    "blog, watch the recorded talk from the community call, and join the discussion in the forum "
+    "where maintainers answer questions about the roadmap and upcoming releases for everyone."
+)
+SENDER = "News <news@dedup-test.example>"
+MODELS = ["test:model"]
+
+
+def _store(email, message_id, body):
+    db.upsert_messages(email, [{
+        "id": message_id, "thread_id": message_id, "label_ids": ["INBOX"], "subject": "News", "from": SENDER,
+        "snippet": "", "body": body, "internal_date": 1, "headers": {},
+    }])
+
+
+def _key(email, message_id):
+    return SummaryKey(email, message_id, message_id + "-hash", "test-dedup")
+
+
+def _summarize(email, message_id, body, summary):
+    """What summarize_many does for a message the model summarized."""
+    _store(email, message_id, body)
+    key = _key(email, message_id)
+    assert summary_dedup.find_shared(email, {message_id: body}, {message_id: key}, MODELS) == {}
+    summary_dedup.remember(key, summary, MODELS[0])
+
+
+def _shared(email, message_id, body):
+    _store(email, message_id, body)
+    shared = summary_dedup.find_shared(email, {message_id: body}, {message_id: _key(email, message_id)}, MODELS)
+    return {msg_id: summary for msg_id, (summary, model) in shared.items()}
+
+
+def test_near_duplicates_only_match_within_one_users_mail():
+    db.init_db()
+    _summarize("alice@example.com", "a1", "Hi Alice,\n\n" + PARA, "Alice's issue")
+
+    # Another user's personalized copy never gets Alice's summary...
+    assert _shared("bob@example.com", "b1", "Hi Bob,\n\n" + PARA) == {}
+    # ...an identical copy does, and Alice's own near copy does too.
+    assert _shared("bob@example.com", "b2", "Hi Alice,\n\n" + PARA) == {"b2": "Alice's issue"}
+    assert _shared("alice@example.com", "a2", "Hello Alice,\n\n" + PARA) == {"a2": "Alice's issue"}
+
+
+def test_a_page_is_matched_with_one_query(monkeypatch):
+    db.init_db()
+    _summarize("carol@example.com", "c1", "Hi Carol,\n\n" + PARA, "Carol's issue")
+    _summarize("dave@example.com", "d1", "Hi Dave,\n\n" + PARA, "Dave's issue")
+
+    calls = []
+    find = db.find_summary_fingerprints
+    monkeypatch.setattr(db, "find_summary_fingerprints", lambda *args: calls.append(args) or find(*args))
+    page = {"c2": "Hello Carol,\n\n" + PARA, "c3": "Hi Dave,\n\n" + PARA, "c4": "Unrelated note from the same sender."}
+    for msg_id, body in page.items():
+        _store("carol@example.com", msg_id, body)
+    keys = {msg_id: _key("carol@example.com", msg_id) for msg_id in page}
+    shared = summary_dedup.find_shared("carol@example.com", page, keys, MODELS)
+
+    assert len(calls) == 1
+    # Carol's near copy and the exact copy of Dave's mail; Dave's fingerprint is no near candidate for Carol
+    assert {msg_id: summary for msg_id, (summary, _) in shared.items()} == {"c2": "Carol's issue", "c3": "Dave's issue"}
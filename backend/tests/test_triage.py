@@ -0,0 +1,40 @@
+from app import triage
+
+
+def _row(subject, snippet, sender="Dana Lee <dana.lee@gmail.com>", labels=(), headers=None):
+    return {
+        "id": "m1",
+        "label_ids": list(labels),
+        "from": sender,
+        "subject": subject,
+        "snippet": snippet,
+        "body": snippet,
+        "headers": headers or {},
+    }
+
+
+def test_personal_mail_the_model_mislabels_keeps_its_summary():
+    for subject, snippet in (
+        ("Your account", "I set up your account on the shared drive, let me know if you can't get in."),
+        ("Free this weekend?", "There's a sale at the mall, 50% off shoes. Want to go Saturday?"),
+    ):
+        decision = triage.classify(_row(subject, snippet))
+        assert decision.route == "llm", (subject, decision)
+
+
+def test_model_alone_never_routes_to_extractive():
+    row = _row("50% off everything this weekend only", "Huge sale, shop now and save on all items. Limited offer!")
+    decision = triage.classify(row)
+    assert decision.route == "llm"
+    _, extracted = triage.route([row])
+    assert extracted == {}
+
+
+def test_signals_still_route_automated_mail():
+    label = triage.classify(_row("50% off everything", "Shop now", labels=["CATEGORY_PROMOTIONS"]))
+    assert (label.category, label.reason) == ("promotion", "label")
+    assert label.route == triage.routes["promotion"]
+
+    sender = triage.classify(_row("Your receipt", "Order #1234, total $20.00", sender="Shop <no-reply@shop.example>"))
+    assert sender.reason == "sender"
+    assert sender.route == triage.routes[sender.category]
@@ -59,6 +59,8 @@ export default function Dashboard() {
   const [generatedReplies, setGeneratedReplies] = useState<
     Record<string, string>
   >({});
+  // One idempotency key per generated reply, reused by every send of it
+  const [replyKeys, setReplyKeys] = useState<Record<string, string>>({});
 
   useEffect(() => {
     // 1) If redirected from /auth/callback, grab ?session= from URL once
@@ -177,6 +179,7 @@ export default function Dashboard() {
       );
       const reply = res.data.reply as string;
       setGeneratedReplies((prev) => ({ ...prev, [email.id]: reply }));
+      setReplyKeys((prev) => ({ ...prev, [email.id]: crypto.randomUUID() }));
       pushMessage({
         id: crypto.randomUUID(),
         from: "assistant",
@@ -222,17 +225,43 @@ export default function Dashboard() {
 
     try {
       const headers = getAuthHeaders();
+      // The backend queues the reply and sends it in the background. The key
+      // belongs to this reply, so a double click or a retry after a timeout
+      // gets the entry queued first instead of a second send.
+      const idempotencyKey = replyKeys[email.id];
       const res = await axios.post(
         `${backend}/gmail/send-reply/${email.id}`,
         { reply_text: reply },
-        { withCredentials: true, headers }
+        {
+          withCredentials: true,
+          headers: idempotencyKey
+            ? { ...headers, "Idempotency-Key": idempotencyKey }
+            : headers,
+        }
       );
-      if (res.data.status === "sent") {
+
+      let status: string = res.data.status;
+      for (let i = 0; i < 30 && (status === "queued" || status === "sending"); i++) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const poll = await axios.get(`${backend}/gmail/outbox/${res.data.id}`, {
+          withCredentials: true,
+          headers,
+        });
+        status = poll.data.status;
+      }
+
+      if (status === "sent") {
         pushMessage({
           id: crypto.randomUUID(),
           from: "assistant",
           text: `✅ Reply for email ${index + 1} has been sent via Gmail.`,
         });
+      } else if (status === "queued" || status === "sending") {
+        pushMessage({
+          id: crypto.randomUUID(),
+          from: "assistant",
+          text: `Reply for email ${index + 1} is queued and will be sent as soon as Gmail accepts it.`,
+        });
       } else {
         throw new Error("send failed");
       }